@@ -0,0 +1,4 @@
+# common/__init__.py
+#
+# Code shared by the gateway and router services. Both images copy this
+# package next to their entrypoint module (see the service Dockerfiles).
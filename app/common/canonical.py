@@ -0,0 +1,19 @@
+# common/canonical.py
+
+import json
+import hashlib
+
+
+def request_key(model: str, messages: list, max_tokens: int, temperature: float) -> str:
+    """Canonical hash of the fields that determine a deterministic completion.
+
+    ``messages`` must be plain dicts ({"role", "content"}). Used by the
+    gateway response cache and the router's request coalescing.
+    """
+    canonical = json.dumps(
+        [model, messages, max_tokens, temperature],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -0,0 +1,104 @@
+# common/deadline.py
+#
+# Per-request deadlines carried across hops, and cancellation of upstream
+# work when the client goes away.
+#
+# The budget travels as remaining seconds in DEADLINE_HEADER (relative, so
+# pod clock skew does not matter). Each hop turns it into a local monotonic
+# deadline, refuses work that cannot finish in time, sizes its upstream
+# timeouts from what is left and forwards the rest.
+
+import os
+import time
+import asyncio
+from typing import Awaitable, Optional, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# Default budget: DEADLINE_BASE_SECONDS + max_tokens * DEADLINE_PER_TOKEN_SECONDS,
+# capped at DEADLINE_MAX_SECONDS. Clients may ask for less, never for more.
+DEADLINE_BASE_SECONDS = float(os.environ.get("DEADLINE_BASE_SECONDS", "10"))
+DEADLINE_PER_TOKEN_SECONDS = float(os.environ.get("DEADLINE_PER_TOKEN_SECONDS", "0.1"))
+DEADLINE_MAX_SECONDS = float(os.environ.get("DEADLINE_MAX_SECONDS", "600"))
+# A deadline shorter than this share of the default budget for its
+# max_tokens was cut short by the caller (X-Request-Timeout): running out
+# of it says nothing about the replica. The slack absorbs the time earlier
+# hops spent before forwarding what was left.
+CALLER_LIMITED_SHARE = 0.9
+
+
+class ClientDisconnected(Exception):
+    """The downstream client went away before the response was ready."""
+
+
+class Deadline:
+    def __init__(self, budget: float, full_budget: Optional[float] = None):
+        self.budget = budget
+        self.expires = time.monotonic() + budget
+        # What the work would get without a caller-imposed limit.
+        self.full_budget = budget if full_budget is None else full_budget
+
+    @classmethod
+    def for_request(cls, max_tokens: int, header: Optional[str] = None) -> "Deadline":
+        """Budget from ``max_tokens``, shortened by an incoming header value."""
+        full = min(DEADLINE_BASE_SECONDS + max_tokens * DEADLINE_PER_TOKEN_SECONDS, DEADLINE_MAX_SECONDS)
+        budget = full
+        if header:
+            try:
+                budget = min(budget, float(header))
+            except ValueError:
+                pass
+        return cls(budget, full)
+
+    @property
+    def caller_limited(self) -> bool:
+        """The caller asked for (much) less time than the work normally gets."""
+        return self.budget < CALLER_LIMITED_SHARE * self.full_budget
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def headers(self) -> dict:
+        return {DEADLINE_HEADER: f"{max(self.remaining(), 0.0):.3f}"}
+
+    def timeout(self, client: httpx.AsyncClient) -> httpx.Timeout:
+        """The client's timeouts, none longer than the remaining budget."""
+        remaining = max(self.remaining(), 0.001)
+        connect = client.timeout.connect
+        return httpx.Timeout(remaining, connect=min(connect, remaining) if connect else remaining)
+
+
+async def cancel_on_disconnect(request, awaitable: Awaitable[T]) -> T:
+    """Await ``awaitable`` unless the client disconnects first.
+
+    Starlette does not cancel a non-streaming handler when its client goes
+    away, so upstream calls would run to completion for nobody. This waits
+    on the ASGI ``http.disconnect`` message alongside the work, cancels the
+    work if it arrives first (closing upstream connections, which makes
+    the next hop cancel in turn) and raises ClientDisconnected.
+    """
+    task = asyncio.ensure_future(awaitable)
+
+    async def disconnected():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        task.cancel()
+        watcher.cancel()
+        raise
+    watcher.cancel()
+    if task not in done:
+        task.cancel()
+        raise ClientDisconnected()
+    return task.result()
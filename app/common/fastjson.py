@@ -0,0 +1,27 @@
+# common/fastjson.py
+#
+# JSON encode/decode for the request path. Uses orjson when it is
+# installed (several times faster than the stdlib, and encodes straight to
+# bytes), otherwise falls back to the json module with the same interface.
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+JSON_CONTENT_TYPE = {"Content-Type": "application/json"}
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+else:
+    loads = json.loads
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
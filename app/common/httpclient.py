@@ -0,0 +1,97 @@
+# common/httpclient.py
+
+import os
+import logging
+from typing import Callable, Optional
+
+import httpx
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger("common.httpclient")
+
+
+# =====================
+# Pool config (env)
+# =====================
+def _env_bool(name: str, default: str = "false") -> bool:
+    return os.environ.get(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+def build_async_client(timeout: float = 30.0) -> httpx.AsyncClient:
+    """Create the long-lived, keep-alive pooled client for one process.
+
+    Pool limits come from env so they can be tuned per deployment:
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY (seconds), HTTP_CONNECT_TIMEOUT (seconds) and
+    HTTP2_ENABLED. ``timeout`` covers reads/writes; connecting gets its own,
+    much shorter limit so an unreachable replica fails fast.
+    """
+    max_connections = int(os.environ.get("HTTP_MAX_CONNECTIONS", "200"))
+    max_keepalive = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+    keepalive_expiry = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+    connect_timeout = min(float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3")), timeout)
+
+    http2 = _env_bool("HTTP2_ENABLED")
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP2_ENABLED is set but 'h2' is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=keepalive_expiry,
+    )
+    logger.info(
+        f"HTTP client pool: max_connections={max_connections}, "
+        f"max_keepalive={max_keepalive}, keepalive_expiry={keepalive_expiry}s, "
+        f"connect_timeout={connect_timeout}s, http2={http2}"
+    )
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        limits=limits,
+        http2=http2,
+    )
+
+
+# =====================
+# Per-host pool metrics
+# =====================
+class PoolCollector:
+    """Prometheus collector exposing the client's connection pool per host.
+
+    The pool is read at scrape time, so the request path pays nothing for
+    these metrics. httpx does not expose its pool publicly, so any
+    attribute lookup failure simply yields an empty metric.
+    """
+
+    def __init__(self, prefix: str, get_client: Callable[[], Optional[httpx.AsyncClient]]):
+        self.prefix = prefix
+        self.get_client = get_client
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            f"{self.prefix}_upstream_connections",
+            "Pooled upstream HTTP connections by host and state",
+            labels=["host", "state"],
+        )
+        counts = {}
+        client = self.get_client()
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        for conn in getattr(pool, "connections", []):
+            origin = getattr(conn, "_origin", None)
+            if origin is None:
+                continue
+            host = f"{origin.host.decode()}:{origin.port}"
+            if conn.is_closed():
+                continue
+            state = "idle" if conn.is_idle() else "active"
+            counts[(host, state)] = counts.get((host, state), 0) + 1
+        for (host, state), value in sorted(counts.items()):
+            gauge.add_metric([host, state], value)
+        yield gauge
@@ -0,0 +1,374 @@
+# common/metrics.py
+#
+# Request metrics shared by the gateway and the router.
+#
+# HopMetrics(service) defines one set of families per service, prefixed
+# with the service name. Its ASGI middleware records in-flight requests,
+# status-labelled responses, duration (error paths included) and body
+# sizes for every API route. Handlers add what only they know through
+# annotate() / add_upstream_time(), which write to per-request state held
+# in a ContextVar, so nothing has to be threaded through call signatures.
+#
+# With several worker processes (common/serve.py) PROMETHEUS_MULTIPROC_DIR
+# is set and HopMetrics.render() aggregates every worker's samples. Custom
+# collectors only see their own process, so in that mode they are sampled
+# periodically into file-backed gauges instead of being read at scrape
+# time (HopMetrics.register_collector).
+#
+# Hops also report their own handling time in a Server-Timing header, so
+# the caller can measure what the hop in between costs (see
+# server_timing()); a hop run in-process is recorded via InProcessRequest.
+
+import os
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# =====================
+# Buckets (LLM scale)
+# =====================
+# Whole requests: sub-second cache hits up to multi-minute generations.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0, 300.0)
+TTFT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+CHUNK_GAP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Time a hop adds on top of its upstream call.
+OVERHEAD_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+TOKEN_BUCKETS = (1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+TPS_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Model names come from clients; only the first METRICS_MAX_MODELS distinct
+# names get their own label value, the rest are reported as "other".
+METRICS_MAX_MODELS = int(os.environ.get("METRICS_MAX_MODELS", "32"))
+_models = set()
+
+# Routes that are not API traffic.
+UNINSTRUMENTED_PATHS = ("/metrics", "/health")
+
+_current: ContextVar[Optional[dict]] = ContextVar("request_metrics", default=None)
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+# How often custom collectors are copied into shared gauges (multiprocess only).
+METRICS_SAMPLE_INTERVAL = float(os.environ.get("METRICS_SAMPLE_INTERVAL", "5"))
+
+
+def model_label(model: Optional[str]) -> str:
+    if not model:
+        return ""
+    if model in _models:
+        return model
+    if len(_models) < METRICS_MAX_MODELS:
+        _models.add(model)
+        return model
+    return "other"
+
+
+def annotate(model: Optional[str] = None, backend: Optional[str] = None):
+    """Attach model/backend labels to the current request's metrics."""
+    state = _current.get()
+    if state is None:
+        return
+    if model is not None:
+        state["model"] = model_label(model)
+    if backend is not None:
+        state["backend"] = backend
+
+
+def add_upstream_time(seconds: float):
+    """Count time the current request spent waiting on the next hop."""
+    state = _current.get()
+    if state is not None:
+        state["upstream"] += seconds
+
+
+# =====================
+# Per-hop timing
+# =====================
+# Each hop reports its own handling time (to response headers) in a
+# Server-Timing header, so the caller can tell what the hop in between
+# (network, serialization, validation) added.
+SERVER_TIMING_HEADER = "Server-Timing"
+
+
+def server_timing(name: str, seconds: float) -> dict:
+    return {SERVER_TIMING_HEADER: f"{name};dur={seconds * 1000:.3f}"}
+
+
+def server_timing_seconds(value: Optional[str], name: str) -> Optional[float]:
+    """Seconds reported for ``name`` in a Server-Timing value, if any."""
+    for metric in (value or "").split(","):
+        parts = [p.strip() for p in metric.split(";")]
+        if parts[0] != name:
+            continue
+        for param in parts[1:]:
+            key, _, dur = param.partition("=")
+            if key == "dur":
+                try:
+                    return float(dur) / 1000
+                except ValueError:
+                    return None
+    return None
+
+
+class HopMetrics:
+    def __init__(self, service: str):
+        self.service = service
+        self.inflight = Gauge(
+            f"{service}_inflight_requests",
+            "Requests currently being handled",
+            ["endpoint"],
+            multiprocess_mode="livesum",
+        )
+        self.responses = Counter(
+            f"{service}_responses_total",
+            "Responses by status, model and serving backend",
+            ["endpoint", "model", "backend", "status"],
+        )
+        self.duration = Histogram(
+            f"{service}_request_duration_seconds",
+            "Time from request to last response byte, including errors",
+            ["endpoint", "model", "status"],
+            buckets=LATENCY_BUCKETS,
+        )
+        self.upstream = Histogram(
+            f"{service}_upstream_seconds",
+            "Time spent waiting on the next hop",
+            ["endpoint", "model"],
+            buckets=LATENCY_BUCKETS,
+        )
+        self.overhead = Histogram(
+            f"{service}_overhead_seconds",
+            "Request duration minus upstream time (queueing, parsing, serialization)",
+            ["endpoint"],
+            buckets=OVERHEAD_BUCKETS,
+        )
+        self.request_size = Histogram(
+            f"{service}_request_size_bytes",
+            "Request body size",
+            ["endpoint"],
+            buckets=SIZE_BUCKETS,
+        )
+        self.response_size = Histogram(
+            f"{service}_response_size_bytes",
+            "Response body size",
+            ["endpoint"],
+            buckets=SIZE_BUCKETS,
+        )
+        self.prompt_tokens = Histogram(
+            f"{service}_prompt_tokens",
+            "Prompt tokens per request (from usage)",
+            ["model"],
+            buckets=TOKEN_BUCKETS,
+        )
+        self.completion_tokens = Histogram(
+            f"{service}_completion_tokens",
+            "Completion tokens per request (from usage)",
+            ["model"],
+            buckets=TOKEN_BUCKETS,
+        )
+        self.tokens_per_second = Histogram(
+            f"{service}_completion_tokens_per_second",
+            "Completion tokens / upstream time per request",
+            ["model"],
+            buckets=TPS_BUCKETS,
+        )
+
+        # Collectors mirrored into shared gauges: (collector, summed families)
+        self._collectors = []
+        self._mirrors = {}
+        self._seen = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- exposition ----------
+    def register_collector(self, collector, summed=()):
+        """Register a scrape-time collector.
+
+        In multiprocess mode its families become gauges with a ``pid``
+        label, except those named in ``summed``, which are added up across
+        live workers.
+        """
+        if MULTIPROC_DIR:
+            self._collectors.append((collector, frozenset(summed)))
+        else:
+            REGISTRY.register(collector)
+
+    def render(self) -> bytes:
+        if not MULTIPROC_DIR:
+            return generate_latest(REGISTRY)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+    def _mirror(self, family, summed) -> Optional[Gauge]:
+        gauge = self._mirrors.get(family.name)
+        if gauge is None and family.samples:
+            gauge = Gauge(
+                family.name,
+                family.documentation,
+                list(family.samples[0].labels),
+                registry=None,
+                multiprocess_mode="livesum" if family.name in summed else "liveall",
+            )
+            self._mirrors[family.name] = gauge
+        return gauge
+
+    def sample_collectors(self):
+        for collector, summed in self._collectors:
+            for family in collector.collect():
+                gauge = self._mirror(family, summed)
+                if gauge is None:
+                    continue
+                seen = set()
+                for sample in family.samples:
+                    key = tuple(sample.labels.values())
+                    seen.add(key)
+                    (gauge.labels(*key) if key else gauge).set(sample.value)
+                # Series that disappeared (closed connection, removed
+                # endpoint) are zeroed: file-backed values cannot be deleted.
+                for key in self._seen.get(family.name, set()) - seen:
+                    gauge.labels(*key).set(0)
+                self._seen[family.name] = seen
+
+    # ---------- lifecycle (call from the app lifespan) ----------
+    def start(self):
+        if MULTIPROC_DIR and self._collectors:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if MULTIPROC_DIR:
+            # Drops this worker's live* gauges from the aggregate.
+            multiprocess.mark_process_dead(os.getpid())
+
+    async def _run(self):
+        while True:
+            self.sample_collectors()
+            await asyncio.sleep(METRICS_SAMPLE_INTERVAL)
+
+    # ---------- requests ----------
+    def record(self, endpoint: str, state: dict, status: str, duration: float, sizes=None):
+        model = state["model"]
+        self.responses.labels(endpoint=endpoint, model=model, backend=state["backend"], status=status).inc()
+        self.duration.labels(endpoint=endpoint, model=model, status=status).observe(duration)
+        if state["upstream"]:
+            self.upstream.labels(endpoint=endpoint, model=model).observe(state["upstream"])
+        self.overhead.labels(endpoint=endpoint).observe(max(duration - state["upstream"], 0.0))
+        if sizes is not None:
+            self.request_size.labels(endpoint=endpoint).observe(sizes[0])
+            self.response_size.labels(endpoint=endpoint).observe(sizes[1])
+
+    # ---------- usage ----------
+    def observe_usage(self, model: str, usage: Optional[dict], seconds: float):
+        """Record the OpenAI ``usage`` block of one completion."""
+        if not isinstance(usage, dict):
+            return
+        model = model_label(model)
+        prompt = usage.get("prompt_tokens")
+        completion = usage.get("completion_tokens")
+        if isinstance(prompt, int):
+            self.prompt_tokens.labels(model=model).observe(prompt)
+        if isinstance(completion, int):
+            self.completion_tokens.labels(model=model).observe(completion)
+            if completion and seconds > 0:
+                self.tokens_per_second.labels(model=model).observe(completion / seconds)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed bodies are measured to the last byte.
+
+    Install with ``app.add_middleware(MetricsMiddleware, hop=METRICS)``.
+    """
+
+    def __init__(self, app, hop: HopMetrics):
+        self.app = app
+        self.hop = hop
+        self._static_paths = None
+
+    def _inflight_label(self, scope) -> str:
+        # The route is only resolved inside the app, so in-flight requests
+        # are labelled by path for static routes and "other" otherwise.
+        if self._static_paths is None:
+            routes = getattr(scope.get("app"), "routes", [])
+            self._static_paths = {r.path for r in routes if "{" not in getattr(r, "path", "{")}
+        path = scope["path"]
+        return path if path in self._static_paths else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNINSTRUMENTED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"model": "", "backend": "", "upstream": 0.0}
+        sizes = [0, 0]  # request, response bytes
+        status = [500]
+        token = _current.set(state)
+        start = time.perf_counter()
+        inflight = self.hop.inflight.labels(endpoint=self._inflight_label(scope))
+        inflight.inc()
+
+        async def receive_counted():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        except asyncio.CancelledError:
+            status[0] = 499
+            raise
+        finally:
+            _current.reset(token)
+            inflight.dec()
+            # Route template (e.g. /v1/batches/{batch_id}) keeps label
+            # cardinality bounded; unmatched paths all count as "other".
+            endpoint = getattr(scope.get("route"), "path", None) or "other"
+            self.hop.record(endpoint, state, str(status[0]), time.perf_counter() - start, sizes)
+
+
+class InProcessRequest:
+    """A request handled in this process without going through the ASGI
+    middleware (the embedded router): it gets its own per-request state
+    and is recorded in the same families.
+
+    Awaitables passed to ``run`` see this request's state, so annotate()
+    and add_upstream_time() inside the handler do not touch the caller's.
+    """
+
+    def __init__(self, hop: HopMetrics, endpoint: str):
+        self.hop = hop
+        self.endpoint = endpoint
+        self.state = {"model": "", "backend": "", "upstream": 0.0}
+        self.start = time.perf_counter()
+        self.finished = False
+        self.inflight = hop.inflight.labels(endpoint=endpoint)
+        self.inflight.inc()
+
+    async def run(self, awaitable):
+        token = _current.set(self.state)
+        try:
+            return await awaitable
+        finally:
+            _current.reset(token)
+
+    def finish(self, status: int):
+        if self.finished:
+            return
+        self.finished = True
+        self.inflight.dec()
+        self.hop.record(self.endpoint, self.state, str(status), time.perf_counter() - self.start)
@@ -0,0 +1,57 @@
+# common/serve.py
+#
+# Process launcher for the gateway and router images:
+#
+#   python -m common.serve gateway:app --port 8000
+#
+# WEB_CONCURRENCY uvicorn worker processes share the listening socket. With
+# more than one, Prometheus runs in multiprocess mode: every worker writes
+# its samples to mmap files in PROMETHEUS_MULTIPROC_DIR and /metrics
+# aggregates them (see common/metrics.py). The directory is wiped here,
+# before any worker starts, so samples from a previous run never leak in.
+#
+# Deliberately imports neither prometheus_client nor the app: the client
+# picks its storage when first imported, which must happen after the env
+# below is set.
+
+import os
+import glob
+import argparse
+
+WEB_CONCURRENCY = max(int(os.environ.get("WEB_CONCURRENCY", "1")), 1)
+DEFAULT_MULTIPROC_DIR = "/tmp/prometheus-multiproc"
+
+
+def per_worker(total: float) -> float:
+    """Share of a pod-wide limit enforced by each worker process."""
+    return total / WEB_CONCURRENCY
+
+
+def prepare_multiproc_dir() -> str:
+    path = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", DEFAULT_MULTIPROC_DIR)
+    os.makedirs(path, exist_ok=True)
+    for stale in glob.glob(os.path.join(path, "*.db")):
+        os.remove(stale)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a service with WEB_CONCURRENCY workers")
+    parser.add_argument("app", help="import string, e.g. gateway:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if WEB_CONCURRENCY > 1:
+        prepare_multiproc_dir()
+    else:
+        # A stray setting would switch a single process to file-backed metrics.
+        os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    import uvicorn
+
+    uvicorn.run(args.app, host=args.host, port=args.port, workers=WEB_CONCURRENCY)
+
+
+if __name__ == "__main__":
+    main()
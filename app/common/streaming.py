@@ -0,0 +1,56 @@
+# common/streaming.py
+
+import time
+import asyncio
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+
+# Headers sent on every relayed event stream. X-Accel-Buffering stops
+# ingress-nginx from buffering the response before it reaches the client.
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+async def relay_stream(
+    resp: httpx.Response,
+    start: float,
+    ttft_hist,
+    gap_hist,
+    on_done: Optional[Callable[[], None]] = None,
+    deadline=None,
+    on_cancel: Optional[Callable[[str], None]] = None,
+) -> AsyncIterator[bytes]:
+    """Yield the upstream body bytes as they arrive, without re-parsing.
+
+    Time to the first chunk (from ``start``) goes to ``ttft_hist`` and the
+    gap between consecutive chunks to ``gap_hist``. The upstream response
+    is always closed, including when the client goes away mid-stream or
+    ``deadline`` (a common.deadline.Deadline) runs out, and ``on_done``
+    (if given) runs after it. ``on_cancel`` is told why a stream was cut
+    short ("client_disconnect" or "deadline").
+    """
+    last: Optional[float] = None
+    try:
+        async for chunk in resp.aiter_raw():
+            now = time.time()
+            if last is None:
+                ttft_hist.observe(now - start)
+            else:
+                gap_hist.observe(now - last)
+            last = now
+            yield chunk
+            if deadline is not None and deadline.expired():
+                if on_cancel is not None:
+                    on_cancel("deadline")
+                break
+    except (asyncio.CancelledError, GeneratorExit):
+        if on_cancel is not None:
+            on_cancel("client_disconnect")
+        raise
+    finally:
+        await resp.aclose()
+        if on_done is not None:
+            on_done()
@@ -0,0 +1,223 @@
+# common/tracing.py
+
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+from typing import Optional
+
+from prometheus_client import Counter
+
+from common.serve import WEB_CONCURRENCY
+
+logger = logging.getLogger("common.tracing")
+
+LEVELS = ("debug", "info", "error")
+
+TRACE_EVENTS = Counter(
+    "trace_events_total",
+    "Structured trace events by outcome (written or dropped on a full queue)",
+    ["service", "outcome"],
+)
+
+
+# =====================
+# Per-request handles
+# =====================
+class _NoopTrace:
+    """Returned when a request is not traced; every call is a no-op."""
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def debug(self, message: str, **data):
+        pass
+
+    def info(self, message: str, **data):
+        pass
+
+    def error(self, message: str, **data):
+        pass
+
+
+NOOP_TRACE = _NoopTrace()
+
+
+class RequestTrace:
+    __slots__ = ("tracer", "request_id", "sampled")
+
+    def __init__(self, tracer: "Tracer", request_id: str, sampled: bool):
+        self.tracer = tracer
+        self.request_id = request_id
+        self.sampled = sampled
+
+    def __bool__(self):
+        return True
+
+    def _emit(self, level: str, message: str, data: dict):
+        # Errors are kept even for unsampled requests.
+        if level not in self.tracer.levels or not (self.sampled or level == "error"):
+            return
+        self.tracer.put({
+            "ts": time.time(),
+            "service": self.tracer.service,
+            "request_id": self.request_id,
+            "level": level,
+            "message": message,
+            "data": data,
+        })
+
+    def debug(self, message: str, **data):
+        self._emit("debug", message, data)
+
+    def info(self, message: str, **data):
+        self._emit("info", message, data)
+
+    def error(self, message: str, **data):
+        self._emit("error", message, data)
+
+
+# =====================
+# Tracer
+# =====================
+class Tracer:
+    """Structured trace sink that keeps file I/O off the event loop.
+
+    Events are queued in memory (dropped when the queue is full) and a
+    background thread serializes and appends them in batches, rotating the
+    file by size. Configured from env:
+
+    - TRACE_ENABLED: master switch (default off)
+    - TRACE_LEVELS: comma list of debug,info,error (default "info,error")
+    - TRACE_SAMPLE_RATE: fraction of requests traced (errors always are)
+    - TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT: output and rotation
+      (with WEB_CONCURRENCY > 1 each process writes and rotates its own
+      file, TRACE_FILE with the pid before the extension)
+    - TRACE_QUEUE_SIZE, TRACE_FLUSH_INTERVAL: buffering
+    """
+
+    def __init__(
+        self,
+        service: str,
+        enabled: bool = False,
+        levels=("info", "error"),
+        sample_rate: float = 1.0,
+        path: str = "/tmp/debug.log",
+        max_bytes: int = 50 * 1024 * 1024,
+        backup_count: int = 3,
+        queue_size: int = 10000,
+        flush_interval: float = 1.0,
+        per_process: bool = False,
+    ):
+        self.service = service
+        self.enabled = enabled
+        self.levels = frozenset(levels)
+        self.sample_rate = sample_rate
+        self.path = path
+        self.base_path = path
+        self.per_process = per_process
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._written = TRACE_EVENTS.labels(service=service, outcome="written")
+        self._dropped = TRACE_EVENTS.labels(service=service, outcome="dropped")
+
+    @classmethod
+    def from_env(cls, service: str) -> "Tracer":
+        levels = [l.strip().lower() for l in os.environ.get("TRACE_LEVELS", "info,error").split(",")]
+        return cls(
+            service=service,
+            enabled=os.environ.get("TRACE_ENABLED", "false").lower() in ("1", "true", "yes"),
+            levels=[l for l in levels if l in LEVELS],
+            sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", "1.0")),
+            path=os.environ.get("TRACE_FILE", "/tmp/debug.log"),
+            max_bytes=int(os.environ.get("TRACE_MAX_BYTES", str(50 * 1024 * 1024))),
+            backup_count=int(os.environ.get("TRACE_BACKUP_COUNT", "3")),
+            queue_size=int(os.environ.get("TRACE_QUEUE_SIZE", "10000")),
+            flush_interval=float(os.environ.get("TRACE_FLUSH_INTERVAL", "1.0")),
+            per_process=WEB_CONCURRENCY > 1,
+        )
+
+    def begin(self, request_id: str):
+        """Trace handle for one request; a shared no-op when tracing is off."""
+        if not self.enabled:
+            return NOOP_TRACE
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        return RequestTrace(self, request_id, sampled)
+
+    def put(self, event: dict):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._dropped.inc()
+
+    # ---------- background writer ----------
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        if self.per_process:
+            # Processes sharing one file would each rotate it under the
+            # others. Resolved here, in the worker process, not at import.
+            root, ext = os.path.splitext(self.base_path)
+            self.path = f"{root}.{os.getpid()}{ext}"
+        self._thread = threading.Thread(target=self._run, name=f"{self.service}-trace", daemon=True)
+        self._thread.start()
+        logger.info(f"Tracing to {self.path} (levels={sorted(self.levels)}, sample_rate={self.sample_rate})")
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        running = True
+        while running:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                while True:
+                    if item is None:
+                        running = False
+                        break
+                    batch.append(item)
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        lines = "".join(json.dumps(e, default=str) + "\n" for e in batch)
+        try:
+            self._rotate_if_needed(len(lines))
+            with open(self.path, "a") as f:
+                f.write(lines)
+            self._written.inc(len(batch))
+        except OSError as e:
+            self._dropped.inc(len(batch))
+            logger.warning(f"Failed to write trace file {self.path}: {e}")
+
+    def _rotate_if_needed(self, incoming: int):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size + incoming <= self.max_bytes:
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
@@ -0,0 +1,294 @@
+# gateway/batch.py
+#
+# Offline batch inference over JSONL files.
+#
+# Each input line is either an OpenAI batch request
+#   {"custom_id": "...", "method": "POST", "url": "/v1/chat/completions", "body": {...}}
+# or a bare chat completion body {"model": ..., "messages": [...]}.
+# Each output line is
+#   {"id": ..., "custom_id": ..., "response": {"status_code": ..., "body": ...}, "error": ...}
+# in input order. Requests go straight to the router with X-Priority: low,
+# so batch work only fills capacity interactive traffic leaves idle.
+#
+# Each line gets the deadline an interactive request with its max_tokens
+# would (common/deadline.py): sent as X-Request-Timeout and used as the
+# call's timeout, so long generations are not timed out and retried while
+# the first attempt is still running on a worker.
+#
+# CLI (with the shared "common" package importable, as in the image):
+#   python batch.py --input in.jsonl --output out.jsonl --router-url http://router:80
+
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from collections import deque
+from typing import Optional
+
+import httpx
+from prometheus_client import Counter
+
+from common.deadline import Deadline
+
+logger = logging.getLogger("gateway.batch")
+
+BATCH_REQUESTS = Counter(
+    "gateway_batch_requests_total",
+    "Batch lines processed",
+    ["outcome"],  # ok | error | retry
+)
+
+# Worth retrying: overload, transient upstream failures.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class BatchJob:
+    """Streams an input JSONL through the router with a bounded window.
+
+    At most ``concurrency`` lines are in flight; results are written in
+    input order as the head of the window completes. Progress is saved to
+    ``<output>.ckpt`` (input byte offset + output size) every
+    ``checkpoint_every`` lines, so a restarted job skips what is already
+    written and truncates any partial tail of the output.
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        router_url: str,
+        client: httpx.AsyncClient,
+        concurrency: int = 8,
+        max_retries: int = 3,
+        priority: str = "low",
+        checkpoint_every: int = 100,
+        job_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        owner: Optional[str] = None,
+    ):
+        self.id = job_id or f"batch_{int(time.time() * 1000)}"
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint_path = f"{output_path}.ckpt"
+        self.router_url = router_url
+        self.client = client
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.priority = priority
+        self.checkpoint_every = checkpoint_every
+        self.timeout = timeout  # caps each line's deadline
+        self.owner = owner  # API key name that created the job (None without auth)
+
+        self.status = "queued"
+        self.created_at = int(time.time())
+        self.completed = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._written = (0, 0)  # (input offset, line) covered by the output
+
+    # ---------- public ----------
+    def start(self) -> "BatchJob":
+        self._task = asyncio.create_task(self.run())
+        return self
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "input_file": self.input_path,
+            "output_file": self.output_path,
+            "status": self.status,
+            "created_at": self.created_at,
+            "request_counts": {
+                "total": self.completed + self.failed,
+                "completed": self.completed,
+                "failed": self.failed,
+            },
+            "error": self.error,
+        }
+
+    async def run(self):
+        self.status = "in_progress"
+        try:
+            await self._run()
+            self.status = "completed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.exception(f"[{self.id}] batch failed: {e}")
+        logger.info(f"[{self.id}] {self.status}: {self.completed} ok, {self.failed} failed")
+
+    # ---------- internals ----------
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                ckpt = json.load(f)
+            return ckpt["input_offset"], ckpt["output_size"], ckpt["line"]
+        except FileNotFoundError:
+            return 0, 0, 0
+
+    def _save_checkpoint(self, out, input_offset: int, line: int):
+        out.flush()
+        os.fsync(out.fileno())
+        tmp = f"{self.checkpoint_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"input_offset": input_offset, "output_size": out.tell(), "line": line}, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    async def _run(self):
+        input_offset, output_size, line_no = self._load_checkpoint()
+        if line_no:
+            logger.info(f"[{self.id}] resuming after line {line_no} (offset {input_offset})")
+        self._written = (input_offset, line_no)
+
+        window: deque = deque()
+        mode = "r+" if os.path.exists(self.output_path) else "w"
+        with open(self.input_path, "rb") as src, open(self.output_path, mode) as out:
+            src.seek(input_offset)
+            out.truncate(output_size)
+            out.seek(output_size)
+            since_ckpt = 0
+            try:
+                while True:
+                    raw = src.readline()
+                    if not raw:
+                        break
+                    line_no += 1
+                    if not raw.strip():
+                        continue
+                    task = asyncio.create_task(self._process(raw, line_no))
+                    window.append((task, src.tell(), line_no))
+                    while len(window) >= self.concurrency:
+                        await self._write_head(window, out)
+                        since_ckpt += 1
+                    if since_ckpt >= self.checkpoint_every:
+                        await asyncio.to_thread(self._save_checkpoint, out, *self._written)
+                        since_ckpt = 0
+                while window:
+                    await self._write_head(window, out)
+            finally:
+                for task, _, _ in window:
+                    task.cancel()
+                await asyncio.to_thread(self._save_checkpoint, out, *self._written)
+
+    async def _write_head(self, window: deque, out):
+        task, end_offset, line_no = window[0]
+        result = await task
+        window.popleft()
+        out.write(json.dumps(result, separators=(",", ":")) + "\n")
+        self._written = (end_offset, line_no)
+        if result["error"] is None:
+            self.completed += 1
+            BATCH_REQUESTS.labels(outcome="ok").inc()
+        else:
+            self.failed += 1
+            BATCH_REQUESTS.labels(outcome="error").inc()
+
+    async def _process(self, raw: bytes, line_no: int) -> dict:
+        custom_id = f"line-{line_no}"
+        try:
+            item = json.loads(raw)
+            custom_id = item.get("custom_id", custom_id)
+            body = item.get("body", item)
+            payload = {
+                "model": body["model"],
+                "messages": body["messages"],
+                "max_tokens": body.get("max_tokens", 128),
+                "temperature": body.get("temperature", 0.7),
+            }
+        except (ValueError, KeyError, AttributeError) as e:
+            return self._result(custom_id, None, None, f"invalid request line: {e}")
+
+        return await self._call(custom_id, payload)
+
+    async def _call(self, custom_id: str, payload: dict) -> dict:
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            deadline = Deadline.for_request(payload["max_tokens"], str(self.timeout) if self.timeout else None)
+            try:
+                resp = await self.client.post(
+                    f"{self.router_url}/route_generate",
+                    json=payload,
+                    headers={"X-Priority": self.priority, **deadline.headers()},
+                    timeout=deadline.timeout(self.client),
+                )
+            except httpx.TransportError as e:
+                status, error, retry_after = None, f"{type(e).__name__}: {e}", None
+            else:
+                if resp.status_code == 200:
+                    try:
+                        return self._result(custom_id, 200, resp.json(), None)
+                    except ValueError as e:
+                        # Not retried: the router answered, just not with JSON.
+                        return self._result(custom_id, 200, None, f"invalid JSON from router: {e}")
+                status, error = resp.status_code, resp.text[:500]
+                retry_after = resp.headers.get("retry-after")
+                if status not in RETRY_STATUSES:
+                    return self._result(custom_id, status, None, error)
+
+            if attempt == self.max_retries:
+                break
+            BATCH_REQUESTS.labels(outcome="retry").inc()
+            await asyncio.sleep(float(retry_after) if retry_after else delay)
+            delay = min(delay * 2, 30.0)
+        return self._result(custom_id, status, None, error)
+
+    def _result(self, custom_id: str, status: Optional[int], body: Optional[dict], error: Optional[str]) -> dict:
+        return {
+            "id": f"{self.id}_{custom_id}",
+            "custom_id": custom_id,
+            "response": {"status_code": status, "body": body} if status is not None else None,
+            "error": None if error is None else {"message": error},
+        }
+
+
+# =====================
+# CLI
+# =====================
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of chat requests through the router")
+    parser.add_argument("--input", required=True, help="input JSONL path")
+    parser.add_argument("--output", required=True, help="output JSONL path (resumes via <output>.ckpt)")
+    parser.add_argument("--router-url", default=os.environ.get("ROUTER_URL", "http://router-service.llm.svc.cluster.local:80"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--priority", default="low", choices=["high", "normal", "low"])
+    parser.add_argument("--timeout", type=float, default=300.0, help="upper bound on a line's deadline in seconds")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="lines between checkpoints")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    async def run():
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            job = BatchJob(
+                args.input,
+                args.output,
+                args.router_url.rstrip("/"),
+                client,
+                concurrency=args.concurrency,
+                max_retries=args.retries,
+                priority=args.priority,
+                checkpoint_every=args.checkpoint_every,
+                timeout=args.timeout,
+            )
+            await job.run()
+            print(json.dumps(job.to_dict(), indent=2))
+            return job.status == "completed"
+
+    raise SystemExit(0 if asyncio.run(run()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# gateway/cache.py
+
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+# =====================
+# Metrics
+# =====================
+CACHE_HITS = Counter("gateway_cache_hits_total", "Response cache hits")
+CACHE_MISSES = Counter("gateway_cache_misses_total", "Response cache misses")
+CACHE_EVICTIONS = Counter(
+    "gateway_cache_evictions_total",
+    "Response cache evictions",
+    ["reason"],  # lru | ttl
+)
+CACHE_SIZE_BYTES = Gauge("gateway_cache_size_bytes", "Bytes held by the response cache", multiprocess_mode="livesum")
+CACHE_ENTRIES = Gauge("gateway_cache_entries", "Entries held by the response cache", multiprocess_mode="livesum")
+
+
+class ResponseCache:
+    """In-memory LRU of serialized responses with a TTL and a byte budget.
+
+    Only touched from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            CACHE_MISSES.inc()
+            return None
+        expires, body = entry
+        if expires < time.monotonic():
+            self._remove(key, "ttl")
+            CACHE_MISSES.inc()
+            return None
+        self._entries.move_to_end(key)
+        CACHE_HITS.inc()
+        return body
+
+    def put(self, key: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest, "lru")
+        self._update_gauges()
+
+    def _remove(self, key: str, reason: Optional[str]):
+        _, body = self._entries.pop(key)
+        self.size -= len(body)
+        if reason is not None:
+            CACHE_EVICTIONS.labels(reason=reason).inc()
+        self._update_gauges()
+
+    def _update_gauges(self):
+        CACHE_SIZE_BYTES.set(self.size)
+        CACHE_ENTRIES.set(len(self._entries))
@@ -1,15 +1,40 @@
 # gateway/gateway.py
 
 import os
+import sys
 import time
 import logging
 import httpx
-from typing import List, Optional, Literal
+from contextlib import asynccontextmanager, nullcontext
+from typing import List, Optional, Literal, Union
 
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Request
 from pydantic import BaseModel, Field
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from fastapi.responses import Response
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST
+from fastapi.responses import Response, StreamingResponse
+
+from common.httpclient import build_async_client, PoolCollector
+from common.streaming import relay_stream, SSE_HEADERS
+from common.tracing import Tracer
+from common.canonical import request_key
+from common.fastjson import JSON_CONTENT_TYPE, dumps, loads
+from common.deadline import ClientDisconnected, Deadline, cancel_on_disconnect
+from common.metrics import (
+    CHUNK_GAP_BUCKETS,
+    OVERHEAD_BUCKETS,
+    SERVER_TIMING_HEADER,
+    TTFT_BUCKETS,
+    HopMetrics,
+    MetricsMiddleware,
+    add_upstream_time,
+    annotate,
+    server_timing_seconds,
+)
+from cache import ResponseCache
+from batch import BatchJob
+from models import ModelCatalog
+from ratelimit import KeyStore, RateLimited, estimate_input_tokens, estimate_tokens, resolve_priority
+from sessions import SESSIONS_ENABLED, Session, StreamedReply, TurnGuard, build_session_store
 
 # =====================
 # Logging
@@ -26,10 +51,30 @@ logger.setLevel(getattr(logging, log_level, logging.INFO))
 # =====================
 # Router config
 # =====================
+# remote: call the router service over HTTP. embedded: run the routing
+# library (router/embedded.py) in this process, configured from the same
+# env as the router service (VLLM_WORKER_URLS, ...), with no extra hop.
+ROUTER_MODE = os.environ.get("ROUTER_MODE", "remote").strip().lower()
 ROUTER_SERVICE_HOST = os.environ.get("ROUTER_SERVICE_HOST")
 ROUTER_SERVICE_PORT = os.environ.get("ROUTER_SERVICE_PORT", "80")
 
-if ROUTER_SERVICE_HOST:
+
+def load_embedded_router():
+    """Import the router library: copied next to the gateway modules in the
+    image, a sibling directory in a source checkout."""
+    source_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "router")
+    if os.path.isdir(source_dir) and source_dir not in sys.path:
+        sys.path.append(source_dir)
+    from embedded import CHAT_REQUEST_EXTENSION, EmbeddedRouter
+
+    return EmbeddedRouter(), CHAT_REQUEST_EXTENSION
+
+
+EMBEDDED_ROUTER = None
+if ROUTER_MODE == "embedded":
+    EMBEDDED_ROUTER, CHAT_REQUEST_EXTENSION = load_embedded_router()
+    ROUTER_URL = EMBEDDED_ROUTER.url
+elif ROUTER_SERVICE_HOST:
     ROUTER_URL = f"http://{ROUTER_SERVICE_HOST}:{ROUTER_SERVICE_PORT}"
 else:
     ROUTER_URL = os.environ.get(
@@ -37,28 +82,121 @@ else:
         "http://router-service.llm.svc.cluster.local:80",
     )
 
-logger.info(f"Using ROUTER_URL: {ROUTER_URL}")
+# Models served by the workers, cached from the router's registry.
+MODEL_CATALOG = ModelCatalog(ROUTER_URL)
+
+# Structured request tracing (off by default, see common/tracing.py)
+TRACER = Tracer.from_env("gateway")
+
+# API keys with per-key request/token rate limits (API_KEYS_FILE, hot
+# reloaded), plus the single legacy API_KEY. Neither set = no auth.
+API_KEYS = KeyStore(legacy_key=os.environ.get("API_KEY"))
+
+# =====================
+# Response cache (opt-in)
+# =====================
+# Deterministic (temperature=0, non-streaming) completions are cached so
+# repeats are answered without touching the router.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE = (
+    ResponseCache(
+        max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "300")),
+    )
+    if RESPONSE_CACHE_ENABLED
+    else None
+)
+
+# =====================
+# Conversation sessions (opt-in)
+# =====================
+# History stored per session id (sessions.py): clients send only the new
+# turn, and the router pins the session to one worker for its prefix cache.
+SESSIONS = build_session_store() if SESSIONS_ENABLED else None
+SESSION_TURNS = TurnGuard()
+
+# =====================
+# Batch jobs
+# =====================
+# Input/output files for /v1/batches must live under BATCH_DIR.
+BATCH_DIR = os.path.realpath(os.environ.get("BATCH_DIR", "/tmp/batches"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_JOBS = {}
+
+# =====================
+# Upstream HTTP client
+# =====================
+# One pooled client per process, opened/closed by the app lifespan.
+http_client: Optional[httpx.AsyncClient] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    logger.info(f"Using ROUTER_URL: {ROUTER_URL} ({ROUTER_MODE})")
+    async with EMBEDDED_ROUTER.lifespan() if EMBEDDED_ROUTER is not None else nullcontext():
+        # Router calls (completions, batches, catalogue) go through this
+        # client in both modes; embedded, its transport is the router itself.
+        http_client = EMBEDDED_ROUTER.client() if EMBEDDED_ROUTER is not None else build_async_client(timeout=30.0)
+        TRACER.start()
+        MODEL_CATALOG.start(http_client)
+        API_KEYS.start()
+        METRICS.start()
+        try:
+            yield
+        finally:
+            await METRICS.stop()
+            await API_KEYS.stop()
+            await MODEL_CATALOG.stop()
+            for job in BATCH_JOBS.values():
+                job.cancel()  # progress is checkpointed, a new job resumes it
+            await http_client.aclose()
+            http_client = None
+            TRACER.stop()
 
-EXPECTED_API_KEY = os.environ.get("API_KEY")  # optional
 
 # =====================
 # FastAPI app
 # =====================
-app = FastAPI(title="LLM API Gateway (OpenAI-compatible)")
+app = FastAPI(title="LLM API Gateway (OpenAI-compatible)", lifespan=lifespan)
 
 # =====================
 # Prometheus metrics
 # =====================
+# Status/model/backend-labelled counts, duration (errors included), router
+# time vs. gateway overhead, body sizes and token usage (common/metrics.py)
+METRICS = HopMetrics("gateway")
+app.add_middleware(MetricsMiddleware, hop=METRICS)
+
 GATEWAY_REQUESTS = Counter(
     "gateway_requests_total",
     "Total API requests",
     ["endpoint"],
 )
-GATEWAY_LATENCY = Histogram(
-    "gateway_request_latency_seconds",
-    "API request latency",
-    ["endpoint"],
+GATEWAY_STREAM_TTFT = Histogram(
+    "gateway_stream_ttft_seconds",
+    "Time from request to first streamed chunk from the router",
+    buckets=TTFT_BUCKETS,
+)
+GATEWAY_STREAM_CHUNK_GAP = Histogram(
+    "gateway_stream_inter_chunk_seconds",
+    "Time between consecutive streamed chunks from the router",
+    buckets=CHUNK_GAP_BUCKETS,
 )
+GATEWAY_CANCELLED = Counter(
+    "gateway_cancelled_requests_total",
+    "Router calls abandoned before completion",
+    ["reason"],  # client_disconnect | deadline
+)
+# Compare against gateway_upstream_seconds / router_request_duration_seconds
+# to see what each topology adds per hop.
+ROUTER_HOP = Histogram(
+    "gateway_router_hop_seconds",
+    "Time to router response headers not spent inside the router (network, serialization, validation)",
+    ["mode"],  # remote | embedded
+    buckets=OVERHEAD_BUCKETS,
+)
+METRICS.register_collector(PoolCollector("gateway", lambda: http_client))
 
 # =====================
 # OpenAI-style schemas
@@ -73,6 +211,27 @@ class ChatCompletionRequest(BaseModel):
     messages: List[ChatMessage]
     max_tokens: int = 128
     temperature: float = 0.7
+    stream: bool = False
+
+
+class EmbeddingRequest(BaseModel):
+    model: str = Field(..., description="Logical model name")
+    input: Union[str, List[str]]
+    encoding_format: Optional[Literal["float", "base64"]] = None
+    dimensions: Optional[int] = None
+    user: Optional[str] = None
+
+
+class SessionCreateRequest(BaseModel):
+    messages: List[ChatMessage] = Field(default_factory=list, description="Initial history, e.g. the system prompt")
+
+
+class BatchCreateRequest(BaseModel):
+    input_file: str = Field(..., description="JSONL path relative to BATCH_DIR")
+    output_file: Optional[str] = Field(None, description="Defaults to <input_file>.output.jsonl")
+    concurrency: int = Field(BATCH_CONCURRENCY, ge=1, le=256)
+    max_retries: int = Field(3, ge=0, le=10)
+    priority: Literal["high", "normal", "low"] = "low"
 
 
 class ChatCompletionChoice(BaseModel):
@@ -87,19 +246,205 @@ class ChatCompletionResponse(BaseModel):
     created: int
     model: str
     choices: List[ChatCompletionChoice]
+    usage: Optional[dict] = None
 
 
 # =====================
 # Helpers
 # =====================
 def check_api_key(authorization: Optional[str]):
-    if EXPECTED_API_KEY is None:
-        return
+    """The caller's ApiKey, or None when auth is disabled."""
+    if not API_KEYS.enabled:
+        return None
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
-    token = authorization.split(" ", 1)[1].strip()
-    if token != EXPECTED_API_KEY:
+    key = API_KEYS.get(authorization.split(" ", 1)[1].strip())
+    if key is None:
         raise HTTPException(status_code=403, detail="Invalid API key")
+    return key
+
+
+def charge_api_key(api_key, tokens: int, request_id: str):
+    """Take the request's estimated tokens from the key's limits, or 429."""
+    if api_key is None:
+        return None
+    try:
+        return api_key.acquire(tokens)
+    except RateLimited as e:
+        logger.warning(f"[{request_id}] {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers=e.headers)
+
+
+# Router back-pressure is passed through so clients see 429/503 with
+# Retry-After instead of a generic 502.
+PASSTHROUGH_STATUSES = (429, 503)
+# Unknown model / request over the model's context: the client's fault.
+CLIENT_ERROR_STATUSES = (400, 404)
+# The router ran out of the request's deadline (or timed out the worker).
+GATEWAY_TIMEOUT_STATUSES = (504,)
+
+
+def router_http_error(resp: httpx.Response, response_text: str) -> HTTPException:
+    if resp.status_code in CLIENT_ERROR_STATUSES:
+        try:
+            detail = loads(response_text)["detail"]
+        except (ValueError, KeyError, TypeError):
+            detail = response_text[:200]
+        return HTTPException(status_code=resp.status_code, detail=detail)
+    if resp.status_code in GATEWAY_TIMEOUT_STATUSES:
+        try:
+            detail = loads(response_text)["detail"]
+        except (ValueError, KeyError, TypeError):
+            detail = "Router timeout"
+        return HTTPException(status_code=504, detail=detail)
+    if resp.status_code in PASSTHROUGH_STATUSES:
+        return HTTPException(
+            status_code=resp.status_code,
+            detail=f"Service overloaded, retry later: {response_text[:200]}",
+            headers={"Retry-After": resp.headers.get("retry-after", "1")},
+        )
+    return HTTPException(
+        status_code=502,
+        detail=f"Router HTTP error {resp.status_code}: {response_text[:200] if response_text else 'No details'}",
+    )
+
+
+def batch_path(name: str) -> str:
+    path = os.path.realpath(os.path.join(BATCH_DIR, name))
+    if os.path.commonpath([path, BATCH_DIR]) != BATCH_DIR:
+        raise HTTPException(status_code=400, detail=f"Batch files must be inside {BATCH_DIR}")
+    return path
+
+
+def key_owner(api_key) -> Optional[str]:
+    """Owner recorded on per-tenant resources (sessions, batch jobs)."""
+    return api_key.name if api_key is not None else None
+
+
+def owned_batch(batch_id: str, api_key) -> BatchJob:
+    """The caller's batch job, or 404 (also for another key's job)."""
+    job = BATCH_JOBS.get(batch_id)
+    if job is None or job.owner != key_owner(api_key):
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return job
+
+
+async def load_session(session_id: str, api_key) -> Session:
+    """The caller's session, or 404 (also for another key's session)."""
+    if SESSIONS is None:
+        raise HTTPException(status_code=404, detail="Sessions are not enabled")
+    session = await SESSIONS.get(session_id)
+    if session is None or session.owner != key_owner(api_key):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found or expired")
+    return session
+
+
+async def save_turn(session: Session, turn: List[dict], reply: str, request_id: str):
+    """Append a completed turn (the client's messages + the reply)."""
+    session.append(turn + [{"role": "assistant", "content": reply}])
+    await SESSIONS.put(session)
+    logger.info(f"[{request_id}] session {session.id}: {len(session.messages)} messages")
+
+
+async def save_reply(session: Session, turn: List[dict], data, request_id: str):
+    """Store a turn from a completion body. Replies without text (tool
+    calls, filtered output) are not stored: the turn would be half-empty."""
+    choices = data.get("choices") if isinstance(data, dict) else None
+    message = choices[0].get("message") if choices and isinstance(choices[0], dict) else None
+    reply = message.get("content") if isinstance(message, dict) else None
+    if not isinstance(reply, str) or not reply:
+        logger.warning(f"[{request_id}] session {session.id}: reply has no text, turn not saved")
+        return
+    await save_turn(session, turn, reply, request_id)
+
+
+async def record_stream(body, session: Session, turn: List[dict], request_id: str):
+    """Relay a streamed reply, storing the turn once it has finished."""
+    reply = StreamedReply()
+    try:
+        async for chunk in body:
+            reply.feed(chunk if isinstance(chunk, bytes) else chunk.encode())
+            yield chunk
+        if reply.complete:
+            await save_turn(session, turn, reply.text(), request_id)
+    finally:
+        await body.aclose()  # closes the router stream on client disconnect
+        SESSION_TURNS.end(session.id)
+
+
+def router_headers(api_key, x_priority: Optional[str]) -> dict:
+    # The client's X-Priority is never forwarded as-is: it can only lower
+    # the priority its key is configured with.
+    return {"X-Priority": resolve_priority(api_key, x_priority)}
+
+
+def router_request(req: "ChatCompletionRequest", payload: dict, headers: dict, deadline: Deadline) -> dict:
+    """Keyword arguments for a /route_generate call. The embedded router is
+    handed the validated request itself: nothing is encoded or validated
+    a second time."""
+    kwargs = {"headers": {**headers, **deadline.headers()}, "timeout": deadline.timeout(http_client)}
+    if EMBEDDED_ROUTER is not None:
+        kwargs["extensions"] = {CHAT_REQUEST_EXTENSION: req}
+    else:
+        kwargs["content"] = dumps(payload)
+        kwargs["headers"].update(JSON_CONTENT_TYPE)
+    return kwargs
+
+
+def observe_router_hop(resp: httpx.Response, elapsed: float):
+    """Record what the hop added to ``elapsed`` (request sent to response
+    headers), from the router's own Server-Timing."""
+    router_time = server_timing_seconds(resp.headers.get(SERVER_TIMING_HEADER), "router")
+    if router_time is not None:
+        ROUTER_HOP.labels(mode=ROUTER_MODE).observe(max(elapsed - router_time, 0.0))
+
+
+async def stream_completion(req: "ChatCompletionRequest", payload: dict, headers: dict, request_id: str, start: float, deadline: Deadline):
+    """Open a streaming call to the router and relay its SSE bytes as-is."""
+    request = http_client.build_request(
+        "POST",
+        f"{ROUTER_URL}/route_generate",
+        **router_request(req, payload, headers, deadline),
+    )
+    sent = time.time()
+    try:
+        resp = await http_client.send(request, stream=True)
+        observe_router_hop(resp, time.time() - sent)
+    except httpx.ConnectError as e:
+        logger.error(f"[{request_id}] router connection error: {e}")
+        raise HTTPException(status_code=502, detail=f"Router connection error: {str(e)}")
+    except httpx.TimeoutException:
+        if deadline.expired():
+            GATEWAY_CANCELLED.labels(reason="deadline").inc()
+            raise HTTPException(status_code=504, detail="Deadline exceeded waiting for router")
+        raise HTTPException(status_code=504, detail="Router timeout")
+    except httpx.HTTPError as e:
+        # e.g. RemoteProtocolError on a stale keep-alive connection
+        logger.exception(f"[{request_id}] router error: {e}")
+        raise HTTPException(status_code=502, detail=f"Router error: {str(e)}")
+
+    annotate(backend=resp.headers.get("x-backend"))
+    if resp.status_code >= 400:
+        response_text = (await resp.aread()).decode(errors="replace")[:500]
+        await resp.aclose()
+        logger.error(f"[{request_id}] router HTTP error {resp.status_code}: {response_text[:100]}")
+        if resp.status_code in GATEWAY_TIMEOUT_STATUSES and deadline.expired():
+            GATEWAY_CANCELLED.labels(reason="deadline").inc()
+        raise router_http_error(resp, response_text)
+
+    return StreamingResponse(
+        relay_stream(
+            resp,
+            start,
+            GATEWAY_STREAM_TTFT,
+            GATEWAY_STREAM_CHUNK_GAP,
+            on_done=lambda: add_upstream_time(time.time() - sent),
+            deadline=deadline,
+            on_cancel=lambda reason: GATEWAY_CANCELLED.labels(reason=reason).inc(),
+        ),
+        media_type=resp.headers.get("content-type", "text/event-stream"),
+        headers=SSE_HEADERS,
+    )
 
 
 # =====================
@@ -107,12 +452,12 @@ def check_api_key(authorization: Optional[str]):
 # =====================
 @app.get("/health")
 def health():
-    return {"status": "ok", "router_url": ROUTER_URL}
+    return {"status": "ok", "router_url": ROUTER_URL, "router_mode": ROUTER_MODE}
 
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return Response(METRICS.render(), media_type=CONTENT_TYPE_LATEST)
 
 
 # =====================
@@ -120,223 +465,363 @@ def metrics():
 # =====================
 @app.get("/v1/models")
 def list_models():
-    return {
-        "object": "list",
-        "data": [
-            {
-                "id": "qwen2.5-0.5b",
-                "object": "model",
-                "owned_by": "local",
-            }
-        ],
-    }
+    return MODEL_CATALOG.list()
+
+
+# =====================
+# Conversation sessions: /v1/sessions
+# =====================
+@app.post("/v1/sessions")
+async def create_session(
+    req: SessionCreateRequest,
+    authorization: Optional[str] = Header(default=None),
+):
+    api_key = check_api_key(authorization)
+    if SESSIONS is None:
+        raise HTTPException(status_code=404, detail="Sessions are not enabled")
+    session = Session.create(key_owner(api_key), [m.dict() for m in req.messages])
+    await SESSIONS.put(session)
+    logger.info(f"[{session.id}] session created with {len(session.messages)} messages")
+    return {"id": session.id, "object": "chat.session", "messages": session.messages}
+
+
+@app.get("/v1/sessions/{session_id}")
+async def get_session(session_id: str, authorization: Optional[str] = Header(default=None)):
+    session = await load_session(session_id, check_api_key(authorization))
+    return {"id": session.id, "object": "chat.session", "messages": session.messages}
+
+
+@app.delete("/v1/sessions/{session_id}")
+async def delete_session(session_id: str, authorization: Optional[str] = Header(default=None)):
+    await load_session(session_id, check_api_key(authorization))
+    await SESSIONS.delete(session_id)
+    return {"id": session_id, "object": "chat.session.deleted", "deleted": True}
+
+
+# =====================
+# Offline batches: /v1/batches
+# =====================
+@app.post("/v1/batches")
+async def create_batch(
+    req: BatchCreateRequest,
+    authorization: Optional[str] = Header(default=None),
+):
+    api_key = check_api_key(authorization)
+    input_path = batch_path(req.input_file)
+    if not os.path.isfile(input_path):
+        raise HTTPException(status_code=404, detail=f"Input file not found: {req.input_file}")
+    output_path = batch_path(req.output_file or f"{req.input_file}.output.jsonl")
+
+    for job in BATCH_JOBS.values():
+        if job.output_path == output_path and job.status in ("queued", "in_progress"):
+            # Another key's job is not named: its id would let the caller probe it.
+            busy = f"Batch {job.id}" if job.owner == key_owner(api_key) else "Another batch"
+            raise HTTPException(status_code=409, detail=f"{busy} is already writing {req.output_file}")
+
+    job = BatchJob(
+        input_path,
+        output_path,
+        ROUTER_URL,
+        http_client,
+        concurrency=req.concurrency,
+        max_retries=req.max_retries,
+        priority=resolve_priority(api_key, req.priority),
+        owner=key_owner(api_key),
+    ).start()
+    BATCH_JOBS[job.id] = job
+    logger.info(f"[{job.id}] batch started: {input_path} -> {output_path}")
+    return job.to_dict()
+
+
+@app.get("/v1/batches")
+def list_batches(authorization: Optional[str] = Header(default=None)):
+    owner = key_owner(check_api_key(authorization))
+    return {"object": "list", "data": [job.to_dict() for job in BATCH_JOBS.values() if job.owner == owner]}
+
+
+@app.get("/v1/batches/{batch_id}")
+def get_batch(batch_id: str, authorization: Optional[str] = Header(default=None)):
+    return owned_batch(batch_id, check_api_key(authorization)).to_dict()
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+def cancel_batch(batch_id: str, authorization: Optional[str] = Header(default=None)):
+    job = owned_batch(batch_id, check_api_key(authorization))
+    job.cancel()
+    return job.to_dict()
 
 
 # =====================
 # Core API: /v1/chat/completions
 # =====================
-@app.post("/v1/chat/completions", response_model=ChatCompletionResponse)
+# Documentation only: the worker's JSON is passed through unvalidated, and
+# stream=true answers with an SSE stream (text/event-stream) instead.
+@app.post(
+    "/v1/chat/completions",
+    responses={
+        200: {
+            "model": ChatCompletionResponse,
+            "description": "The worker's chat completion, passed through as-is; "
+            "an SSE stream of chat.completion.chunk events when stream=true",
+            "content": {"text/event-stream": {}},
+        }
+    },
+)
 async def chat_completions(
     req: ChatCompletionRequest,
+    request: Request,
     authorization: Optional[str] = Header(default=None),
+    cache_control: Optional[str] = Header(default=None),
+    x_priority: Optional[str] = Header(default=None),
+    x_request_timeout: Optional[str] = Header(default=None),
+    x_session_id: Optional[str] = Header(default=None),
 ):
     request_id = f"gw_{int(time.time() * 1000)}"
     endpoint = "/v1/chat/completions"
-    # #region agent log
-    import json
-    debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"A","location":"gateway.py:139","message":"Gateway request received","data":{"model":req.model,"messages_count":len(req.messages),"max_tokens":req.max_tokens,"router_url":ROUTER_URL},"timestamp":int(time.time()*1000)}
-    logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-    try:
-        with open('/tmp/debug.log', 'a') as f:
-            f.write(json.dumps(debug_data)+'\n')
-    except Exception as e:
-        logger.warning(f"[DEBUG] Failed to write log file: {e}")
-    # #endregion
+    trace = TRACER.begin(request_id)
+    trace.info("Gateway request received", model=req.model, messages_count=len(req.messages), max_tokens=req.max_tokens)
 
     logger.info(
         f"[{request_id}] model={req.model}, messages={len(req.messages)}, max_tokens={req.max_tokens}"
     )
 
     GATEWAY_REQUESTS.labels(endpoint=endpoint).inc()
+    annotate(model=req.model)
     start = time.time()
-
-    check_api_key(authorization)
-
-    # 2. Call router with OpenAI-compatible format
-    payload = {
-        "model": req.model,
-        "messages": [msg.dict() for msg in req.messages],
-        "max_tokens": req.max_tokens,
-        "temperature": req.temperature,
-    }
-
-    # #region agent log
-    import json
-    debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"A","location":"gateway.py:163","message":"Before router call","data":{"router_url":ROUTER_URL,"payload_keys":list(payload.keys())},"timestamp":int(time.time()*1000)}
-    logger.info(f"[DEBUG] {json.dumps(debug_data)}")
+    # Budget for the whole call, forwarded to the router (which also caps
+    # its worker call with it); clients may shorten it via X-Request-Timeout.
+    deadline = Deadline.for_request(req.max_tokens, x_request_timeout)
+
+    api_key = check_api_key(authorization)
+
+    # 1. Unknown models fail fast, without a router round trip
+    if not MODEL_CATALOG.allows(req.model):
+        raise HTTPException(status_code=404, detail=f"Model '{req.model}' not found")
+
+    # With X-Session-Id the request carries only the new turn: the stored
+    # history goes in front of it (and counts towards the token estimate).
+    session = None
+    if x_session_id:
+        session = await load_session(x_session_id, api_key)
+        if not SESSION_TURNS.begin(session.id, deadline.expires):
+            raise HTTPException(status_code=409, detail=f"Session {session.id} already has a turn in progress")
+        turn = [msg.dict() for msg in req.messages]
+        history = [ChatMessage.construct(**m) for m in session.messages]
+        req = req.copy(update={"messages": history + req.messages})
+
+    # One turn per session at a time: released when the reply is stored
+    # (or the request fails).
+    held = session is not None
     try:
-        with open('/tmp/debug.log', 'a') as f:
-            f.write(json.dumps(debug_data)+'\n')
-    except Exception as e:
-        logger.warning(f"[DEBUG] Failed to write log file: {e}")
-    # #endregion
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # #region agent log
-            debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"A","location":"gateway.py:166","message":"Calling router","data":{"url":f"{ROUTER_URL}/route_generate"},"timestamp":int(time.time()*1000)}
-            logger.info(f"[DEBUG] {json.dumps(debug_data)}")
+        # Per-key limits: charged the estimate now, corrected from usage below
+        charge = charge_api_key(api_key, estimate_tokens(req.messages, req.max_tokens), request_id)
+
+        # 2. Call router with OpenAI-compatible format
+        payload = {
+            "model": req.model,
+            "messages": [msg.dict() for msg in req.messages],
+            "max_tokens": req.max_tokens,
+            "temperature": req.temperature,
+            "stream": req.stream,
+        }
+
+        headers = router_headers(api_key, x_priority)
+        if session is not None:
+            headers["X-Session-Id"] = session.id
+        if req.stream:
             try:
-                with open('/tmp/debug.log', 'a') as f:
-                    f.write(json.dumps(debug_data)+'\n')
-            except Exception as e:
-                logger.warning(f"[DEBUG] Failed to write log file: {e}")
-            # #endregion
-            resp = await client.post(
-                f"{ROUTER_URL}/route_generate",
-                json=payload,
+                response = await stream_completion(req, payload, headers, request_id, start, deadline)
+                if session is not None:
+                    response.body_iterator = record_stream(response.body_iterator, session, turn, request_id)
+                    held = False  # record_stream releases it when the stream ends
+                return response
+            except HTTPException:
+                if charge is not None:
+                    charge.refund()
+                raise
+            finally:
+                if charge is not None:
+                    charge.settle()  # streams carry no usage: the estimate stands
+
+        key = None
+        if RESPONSE_CACHE is not None and req.temperature == 0:
+            key = request_key(req.model, payload["messages"], req.max_tokens, req.temperature)
+            directives = (cache_control or "").lower()
+            if "no-store" in directives:
+                key = None
+            elif "no-cache" not in directives:
+                cached = RESPONSE_CACHE.get(key)
+                if cached is not None:
+                    annotate(backend="cache")
+                    if charge is not None:
+                        charge.refund()
+                    if session is not None:
+                        await save_reply(session, turn, loads(cached), request_id)
+                    logger.info(f"[{request_id}] served from cache")
+                    return Response(content=cached, media_type="application/json", headers={"X-Cache": "HIT"})
+
+        trace.debug("Calling router", url=f"{ROUTER_URL}/route_generate")
+        upstream_start = time.time()
+        try:
+            resp = await cancel_on_disconnect(
+                request,
+                http_client.post(f"{ROUTER_URL}/route_generate", **router_request(req, payload, headers, deadline)),
             )
-            # #region agent log
-            debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"A","location":"gateway.py:172","message":"Router response received","data":{"status_code":resp.status_code,"headers":dict(resp.headers)},"timestamp":int(time.time()*1000)}
-            logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-            try:
-                with open('/tmp/debug.log', 'a') as f:
-                    f.write(json.dumps(debug_data)+'\n')
-            except Exception as e:
-                logger.warning(f"[DEBUG] Failed to write log file: {e}")
-            # #endregion
+            observe_router_hop(resp, time.time() - upstream_start)
+            trace.debug("Router response received", status_code=resp.status_code)
+            annotate(backend=resp.headers.get("x-backend"))
             resp.raise_for_status()
-            data = resp.json()
-            # #region agent log
-            debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"E","location":"gateway.py:175","message":"Router response parsed","data":{"has_choices":"choices" in data,"choices_count":len(data.get("choices",[]))},"timestamp":int(time.time()*1000)}
-            logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-            try:
-                with open('/tmp/debug.log', 'a') as f:
-                    f.write(json.dumps(debug_data)+'\n')
-            except Exception as e:
-                logger.warning(f"[DEBUG] Failed to write log file: {e}")
-            # #endregion
+            body = resp.content
+            data = loads(body)
+
+        except httpx.ConnectError as e:
+            trace.error("Router connection error", exception_type=type(e).__name__, exception_msg=str(e))
+            logger.error(f"[{request_id}] router connection error: {e}")
+            if charge is not None:
+                charge.refund()
+            raise HTTPException(status_code=502, detail=f"Router connection error: {str(e)}")
+
+        except ClientDisconnected:
+            GATEWAY_CANCELLED.labels(reason="client_disconnect").inc()
+            trace.info("Client disconnected, router call cancelled")
+            logger.info(f"[{request_id}] client disconnected after {time.time() - start:.3f}s, cancelled")
+            if charge is not None:
+                # Settled, not refunded: the worker may already have generated
+                # tokens, and leaving must not be a way around the token limit.
+                charge.settle()
+            return Response(status_code=499)
+
+        except httpx.TimeoutException:
+            trace.error("Router timeout")
+            if deadline.expired():
+                GATEWAY_CANCELLED.labels(reason="deadline").inc()
+                raise HTTPException(status_code=504, detail="Deadline exceeded waiting for router")
+            raise HTTPException(status_code=504, detail="Router timeout")
+
+        except httpx.HTTPStatusError as e:
+            response_text = e.response.text[:500]
+            trace.error("Router HTTP error", status_code=e.response.status_code, response_text=response_text)
+            logger.error(f"[{request_id}] router HTTP error {e.response.status_code}: {response_text[:100]}")
+            if e.response.status_code in GATEWAY_TIMEOUT_STATUSES:
+                if deadline.expired():
+                    GATEWAY_CANCELLED.labels(reason="deadline").inc()
+            elif charge is not None:
+                charge.refund()  # rejected before any generation
+            raise router_http_error(e.response, response_text)
+
+        except Exception as e:
+            trace.error("Router exception", exception_type=type(e).__name__, exception_msg=str(e))
+            logger.exception(f"[{request_id}] router error: {e}")
+            raise HTTPException(status_code=502, detail=f"Router error: {str(e)}")
+
+        finally:
+            upstream = time.time() - upstream_start
+            add_upstream_time(upstream)
+
+        latency = time.time() - start
+        if not isinstance(data, dict) or not data.get("choices"):
+            trace.error("Empty response from router", data_keys=list(data) if isinstance(data, dict) else None)
+            raise HTTPException(status_code=502, detail="Empty response from router")
+        usage = data.get("usage")
+        METRICS.observe_usage(req.model, usage, upstream)
+        if charge is not None:
+            total = usage.get("total_tokens") if isinstance(usage, dict) else None
+            charge.settle(total if isinstance(total, int) else None)
+
+        logger.info(f"[{request_id}] done in {latency:.3f}s")
+        trace.info("Gateway returning success", latency=latency, response_bytes=len(body))
+
+        # 3. Pass the worker's OpenAI response through byte-for-byte (usage,
+        # finish_reason and every choice included), no re-serialization.
+        if key is not None:
+            RESPONSE_CACHE.put(key, body)
+        if session is not None:
+            await save_reply(session, turn, data, request_id)
+        return Response(content=body, media_type="application/json")
+
+    finally:
+        if held:
+            SESSION_TURNS.end(session.id)
+
+
+# =====================
+# Core API: /v1/embeddings
+# =====================
+@app.post("/v1/embeddings")
+async def embeddings(
+    req: EmbeddingRequest,
+    request: Request,
+    authorization: Optional[str] = Header(default=None),
+    x_request_timeout: Optional[str] = Header(default=None),
+):
+    request_id = f"gw_{int(time.time() * 1000)}"
+    inputs = [req.input] if isinstance(req.input, str) else req.input
+    logger.info(f"[{request_id}] embeddings model={req.model}, inputs={len(inputs)}")
+
+    GATEWAY_REQUESTS.labels(endpoint="/v1/embeddings").inc()
+    annotate(model=req.model)
+    start = time.time()
+    deadline = Deadline.for_request(0, x_request_timeout)
+
+    api_key = check_api_key(authorization)
+    if not MODEL_CATALOG.allows(req.model):
+        raise HTTPException(status_code=404, detail=f"Model '{req.model}' not found")
+    charge = charge_api_key(api_key, estimate_input_tokens(inputs), request_id)
+
+    # The router micro-batches concurrent requests onto the embedding pool.
+    payload = req.dict(exclude_none=True, exclude={"user"})
+    upstream_start = time.time()
+    try:
+        resp = await cancel_on_disconnect(
+            request,
+            http_client.post(
+                f"{ROUTER_URL}/route_embeddings",
+                content=dumps(payload),
+                headers={**JSON_CONTENT_TYPE, **deadline.headers()},
+                timeout=deadline.timeout(http_client),
+            ),
+        )
+        observe_router_hop(resp, time.time() - upstream_start)
+        annotate(backend=resp.headers.get("x-backend"))
+        resp.raise_for_status()
+        body = resp.content
+        usage = loads(body).get("usage")
 
     except httpx.ConnectError as e:
-        # #region agent log
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"A","location":"gateway.py:219","message":"Router connection error","data":{"exception_type":type(e).__name__,"exception_msg":str(e),"router_url":ROUTER_URL},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e2:
-            logger.warning(f"[DEBUG] Failed to write log file: {e2}")
-        # #endregion
         logger.error(f"[{request_id}] router connection error: {e}")
+        if charge is not None:
+            charge.refund()
         raise HTTPException(status_code=502, detail=f"Router connection error: {str(e)}")
 
+    except ClientDisconnected:
+        GATEWAY_CANCELLED.labels(reason="client_disconnect").inc()
+        logger.info(f"[{request_id}] client disconnected after {time.time() - start:.3f}s, cancelled")
+        if charge is not None:
+            charge.settle()  # the estimate stands, as for chat completions
+        return Response(status_code=499)
+
     except httpx.TimeoutException:
-        # #region agent log
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"D","location":"gateway.py:231","message":"Router timeout","data":{"router_url":ROUTER_URL},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e:
-            logger.warning(f"[DEBUG] Failed to write log file: {e}")
-        # #endregion
+        if deadline.expired():
+            GATEWAY_CANCELLED.labels(reason="deadline").inc()
+            raise HTTPException(status_code=504, detail="Deadline exceeded waiting for router")
         raise HTTPException(status_code=504, detail="Router timeout")
 
     except httpx.HTTPStatusError as e:
-        # #region agent log
-        response_text = ""
-        try:
-            if hasattr(e.response, 'text'):
-                response_text = e.response.text[:500]
-        except:
-            pass
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"C","location":"gateway.py:245","message":"Router HTTP error","data":{"status_code":e.response.status_code,"response_text":response_text,"router_url":ROUTER_URL},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e2:
-            logger.warning(f"[DEBUG] Failed to write log file: {e2}")
-        # #endregion
+        response_text = e.response.text[:500]
         logger.error(f"[{request_id}] router HTTP error {e.response.status_code}: {response_text[:100]}")
-        raise HTTPException(
-            status_code=502,
-            detail=f"Router HTTP error {e.response.status_code}: {response_text[:200] if response_text else 'No details'}",
-        )
+        if charge is not None:
+            charge.refund()
+        raise router_http_error(e.response, response_text)
 
     except Exception as e:
-        # #region agent log
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"A","location":"gateway.py:263","message":"Router exception","data":{"exception_type":type(e).__name__,"exception_msg":str(e),"router_url":ROUTER_URL},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e2:
-            logger.warning(f"[DEBUG] Failed to write log file: {e2}")
-        # #endregion
         logger.exception(f"[{request_id}] router error: {e}")
         raise HTTPException(status_code=502, detail=f"Router error: {str(e)}")
 
-    latency = time.time() - start
-    GATEWAY_LATENCY.labels(endpoint=endpoint).observe(latency)
+    finally:
+        add_upstream_time(time.time() - upstream_start)
 
-    # 3. Parse Router OpenAI-style response
-    output_text = ""
-    # #region agent log
-    debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"E","location":"gateway.py:196","message":"Before parsing response","data":{"data_keys":list(data.keys()) if isinstance(data,dict) else "not_dict"},"timestamp":int(time.time()*1000)}
-    logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-    try:
-        with open('/tmp/debug.log', 'a') as f:
-            f.write(json.dumps(debug_data)+'\n')
-    except Exception as e:
-        logger.warning(f"[DEBUG] Failed to write log file: {e}")
-    # #endregion
-    if "choices" in data and data["choices"]:
-        choice = data["choices"][0]
-        if "message" in choice and "content" in choice["message"]:
-            output_text = choice["message"]["content"]
-            # #region agent log
-            debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"E","location":"gateway.py:201","message":"Extracted output text","data":{"output_length":len(output_text)},"timestamp":int(time.time()*1000)}
-            logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-            try:
-                with open('/tmp/debug.log', 'a') as f:
-                    f.write(json.dumps(debug_data)+'\n')
-            except Exception as e:
-                logger.warning(f"[DEBUG] Failed to write log file: {e}")
-            # #endregion
-
-    if not output_text:
-        # #region agent log
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"E","location":"gateway.py:207","message":"Empty response from router","data":{"data":str(data)[:500]},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e:
-            logger.warning(f"[DEBUG] Failed to write log file: {e}")
-        # #endregion
-        raise HTTPException(status_code=502, detail="Empty response from router")
-
-    logger.info(f"[{request_id}] done in {latency:.3f}s")
-    # #region agent log
-    debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"E","location":"gateway.py:220","message":"Gateway returning success","data":{"latency":latency,"output_length":len(output_text)},"timestamp":int(time.time()*1000)}
-    logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-    try:
-        with open('/tmp/debug.log', 'a') as f:
-            f.write(json.dumps(debug_data)+'\n')
-    except Exception as e:
-        logger.warning(f"[DEBUG] Failed to write log file: {e}")
-    # #endregion
-
-    # 4. Return OpenAI-compatible response
-    return ChatCompletionResponse(
-        id=data.get("id", f"chatcmpl-{int(time.time() * 1000)}"),
-        created=int(time.time()),
-        model=req.model,
-        choices=[
-            ChatCompletionChoice(
-                index=0,
-                message=ChatMessage(role="assistant", content=output_text),
-                finish_reason="stop",
-            )
-        ],
-    )
+    if charge is not None:
+        total = usage.get("total_tokens") if isinstance(usage, dict) else None
+        charge.settle(total if isinstance(total, int) else None)
+    logger.info(f"[{request_id}] embeddings done in {time.time() - start:.3f}s")
+    return Response(content=body, media_type="application/json")
@@ -0,0 +1,101 @@
+# gateway/models.py
+
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+import httpx
+from prometheus_client import Counter
+
+logger = logging.getLogger("gateway.models")
+
+# =====================
+# Config
+# =====================
+MODEL_CATALOG_REFRESH = float(os.environ.get("MODEL_CATALOG_REFRESH", "15"))
+# A catalogue older than this (router unreachable) stops rejecting models,
+# so a stale list cannot lock clients out of newly deployed ones.
+MODEL_CATALOG_MAX_AGE = float(os.environ.get("MODEL_CATALOG_MAX_AGE", "300"))
+# Listed by /v1/models until the first refresh succeeds.
+DEFAULT_MODEL = os.environ.get("DEFAULT_MODEL", "qwen2.5-0.5b")
+
+CATALOG_REFRESHES = Counter(
+    "gateway_model_catalog_refreshes_total",
+    "Model catalogue refreshes from the router",
+    ["result"],  # ok | error
+)
+UNKNOWN_MODELS = Counter(
+    "gateway_unknown_model_requests_total",
+    "Requests rejected with 404 for a model no worker serves",
+)
+
+
+class ModelCatalog:
+    """The router's model catalogue, cached in the gateway.
+
+    Serves ``/v1/models`` and rejects unknown models without a round trip.
+    Until the router reports a discovered catalogue every model is allowed
+    and the router decides, as it routes unknown models to DEFAULT_POOL
+    until then.
+    """
+
+    def __init__(self, router_url: str, refresh: float = MODEL_CATALOG_REFRESH):
+        self.router_url = router_url
+        self.refresh_interval = refresh
+        self._payload = {"object": "list", "data": [{"id": DEFAULT_MODEL, "object": "model", "owned_by": "local"}] if DEFAULT_MODEL else []}
+        self._ids = frozenset()
+        self._discovered = False
+        self._fetched_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- lifecycle ----------
+    def start(self, client: httpx.AsyncClient):
+        if self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._run(client))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, client: httpx.AsyncClient):
+        while True:
+            await self.refresh(client)
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self, client: httpx.AsyncClient):
+        try:
+            resp = await client.get(f"{self.router_url}/v1/models", timeout=self.refresh_interval or 5.0)
+            resp.raise_for_status()
+            payload = resp.json()
+            data = payload["data"]
+            ids = frozenset(card["id"] for card in data)
+            discovered = bool(payload.get("discovered", True))
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            CATALOG_REFRESHES.labels(result="error").inc()
+            logger.warning(f"Model catalogue refresh failed: {e}")
+            return
+        CATALOG_REFRESHES.labels(result="ok").inc()
+        if ids != self._ids:
+            logger.info(f"Model catalogue: {sorted(ids)}")
+        self._payload = {"object": "list", "data": data}
+        self._ids = ids
+        self._discovered = discovered
+        self._fetched_at = time.monotonic()
+
+    # ---------- lookups ----------
+    def list(self) -> dict:
+        return self._payload
+
+    def allows(self, model: str) -> bool:
+        if not self._discovered or not self._ids or time.monotonic() - self._fetched_at > MODEL_CATALOG_MAX_AGE:
+            return True
+        if model in self._ids:
+            return True
+        UNKNOWN_MODELS.inc()
+        return False
@@ -0,0 +1,287 @@
+# gateway/ratelimit.py
+
+import os
+import math
+import hashlib
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge
+
+from common.fastjson import loads
+
+logger = logging.getLogger("gateway.ratelimit")
+
+# =====================
+# Config
+# =====================
+# JSON key file, typically a mounted ConfigMap/Secret:
+#   {"keys": [{"key": "sk-...", "name": "team-a", "rps": 10, "burst": 20, "tpm": 200000, "priority": "high"}]}
+# Limits left out of an entry use the defaults below; 0 means unlimited.
+# Limits apply per process: every gateway process (WEB_CONCURRENCY per pod,
+# times replicas) holds full buckets for each key. A client on one
+# keep-alive connection gets exactly its limit; one spread over many
+# connections can get up to processes x limit. Size limits accordingly.
+API_KEYS_FILE = os.environ.get("API_KEYS_FILE", "")
+API_KEYS_RELOAD_INTERVAL = float(os.environ.get("API_KEYS_RELOAD_INTERVAL", "5"))
+RATE_LIMIT_QPS = float(os.environ.get("RATE_LIMIT_QPS", "0"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "0"))  # 0 = 2 x rps
+RATE_LIMIT_TPM = float(os.environ.get("RATE_LIMIT_TPM", "0"))
+CHARS_PER_TOKEN = float(os.environ.get("CHARS_PER_TOKEN", "4"))
+# Router priority of keys without their own (and of all traffic without
+# auth). A client's X-Priority may lower it, never raise it.
+PRIORITIES = ("high", "normal", "low")  # best first
+API_KEY_PRIORITY = os.environ.get("API_KEY_PRIORITY", "normal")
+
+# =====================
+# Metrics
+# =====================
+RATE_LIMITED = Counter(
+    "gateway_rate_limited_requests_total",
+    "Requests rejected with 429 by per-key limits",
+    ["key", "limit"],  # limit: requests | tokens
+)
+KEY_TOKENS = Counter(
+    "gateway_key_tokens_total",
+    "Tokens charged per API key (usage when known, else the estimate)",
+    ["key"],
+)
+KEYS_LOADED = Gauge("gateway_api_keys", "API keys currently loaded", multiprocess_mode="livemax")
+
+
+class RateLimited(Exception):
+    def __init__(self, key: "ApiKey", limit: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded ({limit}) for key '{key.name}'")
+        self.limit = limit
+        self.headers = {"Retry-After": str(max(math.ceil(retry_after), 1)), **key.headers()}
+
+
+# =====================
+# Token bucket
+# =====================
+class TokenBucket:
+    """Lazily refilled token bucket.
+
+    No background task and no lock: state only changes on the event loop
+    and there is no await between reading and updating it. Each key owns
+    its buckets, so keys never contend with each other.
+    """
+
+    __slots__ = ("rate", "capacity", "level", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` can be taken (0 = now). A request larger
+        than the bucket only needs a full bucket."""
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.level
+        return max(needed, 0.0) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give(self, amount: float):
+        # Corrections may push the level below zero (debt repaid by refill),
+        # but never more than one bucket deep.
+        self.level = min(self.capacity, max(self.level + amount, -self.capacity))
+
+    def reset_after(self) -> float:
+        return max(self.capacity - self.level, 0.0) / self.rate
+
+
+# =====================
+# Keys
+# =====================
+class ApiKey:
+    """One key's limits, enforced per process (see Config above)."""
+
+    def __init__(self, name: str, rps: float, burst: float, tpm: float, priority: str = API_KEY_PRIORITY):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}' for key '{name}'")
+        self.name = name
+        self.priority = priority
+        self.rps = rps
+        self.burst = burst or max(2 * rps, 1.0)
+        self.tpm = tpm
+        self.requests = TokenBucket(rps, max(self.burst, 1.0)) if rps > 0 else None
+        self.tokens = TokenBucket(tpm / 60.0, tpm) if tpm > 0 else None
+
+    def limits(self) -> tuple:
+        return (self.rps, self.burst, self.tpm, self.priority)
+
+    def headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.requests is not None:
+            headers["X-RateLimit-Limit-Requests"] = f"{self.rps:g}"
+            headers["X-RateLimit-Remaining-Requests"] = str(max(int(self.requests.level), 0))
+            headers["X-RateLimit-Reset-Requests"] = f"{self.requests.reset_after():.2f}s"
+        if self.tokens is not None:
+            headers["X-RateLimit-Limit-Tokens"] = f"{self.tpm:g}"
+            headers["X-RateLimit-Remaining-Tokens"] = str(max(int(self.tokens.level), 0))
+            headers["X-RateLimit-Reset-Tokens"] = f"{self.tokens.reset_after():.2f}s"
+        return headers
+
+    def acquire(self, tokens: int) -> "Charge":
+        """Take one request and ``tokens`` tokens, or raise RateLimited."""
+        now = time.monotonic()
+        if self.requests is not None:
+            wait = self.requests.wait_time(1, now)
+            if wait > 0:
+                RATE_LIMITED.labels(key=self.name, limit="requests").inc()
+                raise RateLimited(self, "requests", wait)
+        if self.tokens is not None:
+            wait = self.tokens.wait_time(tokens, now)
+            if wait > 0:
+                RATE_LIMITED.labels(key=self.name, limit="tokens").inc()
+                raise RateLimited(self, "tokens", wait)
+            self.tokens.take(tokens)
+        if self.requests is not None:
+            self.requests.take(1)
+        return Charge(self, tokens)
+
+
+class Charge:
+    """Tokens taken up front for one request, corrected once usage is known."""
+
+    __slots__ = ("key", "tokens", "settled")
+
+    def __init__(self, key: ApiKey, tokens: int):
+        self.key = key
+        self.tokens = tokens
+        self.settled = False
+
+    def settle(self, used: Optional[int] = None):
+        """Replace the estimate with ``used`` tokens (None keeps the estimate)."""
+        if self.settled:
+            return
+        self.settled = True
+        used = self.tokens if used is None else used
+        if self.key.tokens is not None:
+            self.key.tokens.give(self.tokens - used)
+        KEY_TOKENS.labels(key=self.key.name).inc(used)
+
+    def refund(self):
+        """Nothing was generated (rejected upstream, cache hit)."""
+        self.settle(0)
+
+
+def resolve_priority(key: Optional[ApiKey], requested: Optional[str]) -> str:
+    """Priority to send the router: the key's own, or a lower one the
+    client asked for. Anything else the client sends is ignored."""
+    ceiling = key.priority if key is not None else API_KEY_PRIORITY
+    requested = (requested or "").strip().lower()
+    if requested in PRIORITIES and PRIORITIES.index(requested) > PRIORITIES.index(ceiling):
+        return requested
+    return ceiling
+
+
+def estimate_tokens(messages, max_tokens: int) -> int:
+    """Prompt chars / CHARS_PER_TOKEN + max_tokens: an upper-bound charge
+    that usage corrects afterwards."""
+    return estimate_input_tokens(m.content for m in messages) + max_tokens
+
+
+def estimate_input_tokens(texts) -> int:
+    return int(sum(len(text) for text in texts) / CHARS_PER_TOKEN)
+
+
+# =====================
+# Key store
+# =====================
+class KeyStore:
+    """API keys from API_KEYS_FILE, plus the legacy single ``API_KEY``.
+
+    The file is re-read when it changes (ConfigMap updates swap a symlink,
+    so its identity is checked, not just mtime). Keys whose limits did not
+    change keep their bucket state across reloads. A file that fails to
+    parse leaves the previous keys in place.
+    """
+
+    def __init__(self, path: str = API_KEYS_FILE, legacy_key: Optional[str] = None):
+        self.path = path
+        self.legacy_key = legacy_key
+        self.keys: Dict[str, ApiKey] = {}
+        self._stamp = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        # Configured but unreadable still means "authenticate": no key matches.
+        return bool(self.path or self.legacy_key)
+
+    def get(self, token: str) -> Optional[ApiKey]:
+        return self.keys.get(token)
+
+    # ---------- loading ----------
+    def _entry(self, item: dict) -> ApiKey:
+        return ApiKey(
+            # Unnamed keys are labelled by a hash, never by the key itself.
+            name=str(item.get("name") or hashlib.sha256(item["key"].encode()).hexdigest()[:8]),
+            rps=float(item.get("rps", RATE_LIMIT_QPS)),
+            burst=float(item.get("burst", RATE_LIMIT_BURST)),
+            tpm=float(item.get("tpm", RATE_LIMIT_TPM)),
+            priority=str(item.get("priority", API_KEY_PRIORITY)),
+        )
+
+    def reload(self):
+        entries = []
+        if self.legacy_key:
+            entries.append({"key": self.legacy_key, "name": "default"})
+        if self.path:
+            try:
+                st = os.stat(self.path)
+                stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+                if stamp == self._stamp:
+                    return
+                with open(self.path, "rb") as f:
+                    entries.extend(loads(f.read())["keys"])
+                self._stamp = stamp
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.error(f"Could not load API keys from {self.path}, keeping previous keys: {e}")
+                if self.keys:
+                    return
+        elif self.keys:
+            return
+
+        keys = {}
+        try:
+            for item in entries:
+                key = self._entry(item)
+                old = self.keys.get(item["key"])
+                keys[item["key"]] = old if old is not None and old.limits() == key.limits() else key
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Invalid API key entry in {self.path}, keeping previous keys: {e}")
+            return
+        self.keys = keys
+        KEYS_LOADED.set(len(keys))
+        logger.info(f"Loaded {len(keys)} API keys")
+
+    # ---------- hot reload ----------
+    def start(self):
+        self.reload()
+        if self.path and API_KEYS_RELOAD_INTERVAL > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(API_KEYS_RELOAD_INTERVAL)
+            self.reload()
@@ -0,0 +1,254 @@
+# gateway/sessions.py
+
+import os
+import time
+import uuid
+import logging
+import importlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+from common.fastjson import loads
+from common.serve import WEB_CONCURRENCY
+
+logger = logging.getLogger("gateway.sessions")
+
+# =====================
+# Config
+# =====================
+# Server-side conversation history: clients send only the new turn with
+# X-Session-Id and the gateway prepends what it stored for that session.
+SESSIONS_ENABLED = os.environ.get("SESSIONS_ENABLED", "false").lower() in ("1", "true", "yes")
+# "memory", or "package.module:factory" returning a SessionStore (e.g. one
+# backed by Redis, needed when several processes/replicas share sessions).
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+SESSION_STORE_MAX_BYTES = int(os.environ.get("SESSION_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Idle time after which a session is dropped (every turn extends it).
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "3600"))
+
+# Per-message bookkeeping counted on top of role + content.
+MESSAGE_OVERHEAD_BYTES = 64
+
+# =====================
+# Metrics
+# =====================
+SESSION_LOOKUPS = Counter(
+    "gateway_session_lookups_total",
+    "Session store lookups",
+    ["result"],  # hit | miss
+)
+SESSION_EVICTIONS = Counter(
+    "gateway_session_evictions_total",
+    "Sessions dropped by the store",
+    ["reason"],  # lru | ttl | size
+)
+SESSION_BYTES = Gauge("gateway_session_store_bytes", "Approximate bytes of stored conversation history", multiprocess_mode="livesum")
+SESSION_COUNT = Gauge("gateway_sessions", "Sessions held by the store", multiprocess_mode="livesum")
+
+
+class Session:
+    """One conversation: an owner (API key name, None without auth) and
+    its messages as ``{"role", "content"}`` dicts."""
+
+    __slots__ = ("id", "owner", "messages", "size")
+
+    def __init__(self, session_id: str, owner: Optional[str], messages: List[dict]):
+        self.id = session_id
+        self.owner = owner
+        self.messages = messages
+        self.size = sum(message_size(m) for m in messages)
+
+    @classmethod
+    def create(cls, owner: Optional[str], messages: List[dict]) -> "Session":
+        return cls(f"sess_{uuid.uuid4().hex}", owner, messages)
+
+    def append(self, messages: List[dict]):
+        self.messages.extend(messages)
+        self.size += sum(message_size(m) for m in messages)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "owner": self.owner, "messages": self.messages}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Session":
+        return cls(data["id"], data.get("owner"), data["messages"])
+
+
+def message_size(message: dict) -> int:
+    return len(message["role"]) + len(message["content"]) + MESSAGE_OVERHEAD_BYTES
+
+
+# =====================
+# Backends
+# =====================
+class SessionStore(ABC):
+    """Session backend interface.
+
+    Methods are async so shared stores can do I/O; ``put`` is called with
+    the whole session after every turn. A backend missing any of them
+    cannot be instantiated, so a bad SESSION_BACKEND fails at startup.
+    """
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Session]:
+        ...
+
+    @abstractmethod
+    async def put(self, session: Session):
+        ...
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> bool:
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    """In-process LRU with an idle TTL and a byte budget.
+
+    Every access moves a session to the end and extends its expiry by the
+    same TTL, so the oldest entry is also the first to expire: expired
+    sessions are dropped from the front on each access, no sweeper needed.
+    Only touched from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, max_bytes: int = SESSION_STORE_MAX_BYTES, ttl: float = SESSION_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (expires, session, size)
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        self._expire(time.monotonic())
+        entry = self._entries.get(session_id)
+        if entry is None:
+            SESSION_LOOKUPS.labels(result="miss").inc()
+            return None
+        SESSION_LOOKUPS.labels(result="hit").inc()
+        _, session, size = entry
+        self._entries[session_id] = (time.monotonic() + self.ttl, session, size)
+        self._entries.move_to_end(session_id)
+        return session
+
+    async def put(self, session: Session):
+        now = time.monotonic()
+        self._expire(now)
+        if session.id in self._entries:
+            self._remove(session.id, None)
+        if session.size > self.max_bytes:
+            logger.warning(f"Session {session.id} ({session.size} bytes) exceeds the store budget, dropped")
+            SESSION_EVICTIONS.labels(reason="size").inc()
+            self._update_gauges()
+            return
+        self._entries[session.id] = (now + self.ttl, session, session.size)
+        self.size += session.size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)), "lru")
+        self._update_gauges()
+
+    async def delete(self, session_id: str) -> bool:
+        if session_id not in self._entries:
+            return False
+        self._remove(session_id, None)
+        self._update_gauges()
+        return True
+
+    def _expire(self, now: float):
+        expired = False
+        while self._entries:
+            oldest = next(iter(self._entries))
+            if self._entries[oldest][0] >= now:
+                break
+            self._remove(oldest, "ttl")
+            expired = True
+        if expired:
+            self._update_gauges()
+
+    def _remove(self, session_id: str, reason: Optional[str]):
+        _, _, size = self._entries.pop(session_id)
+        self.size -= size
+        if reason is not None:
+            SESSION_EVICTIONS.labels(reason=reason).inc()
+
+    def _update_gauges(self):
+        SESSION_BYTES.set(self.size)
+        SESSION_COUNT.set(len(self._entries))
+
+
+class TurnGuard:
+    """Sessions with a turn in flight in this process.
+
+    Two concurrent turns would both be built on the same history, and one
+    reply would overwrite or interleave with the other, so a second turn
+    is refused until the first is stored. An entry lapses at its request's
+    deadline, so a turn whose cleanup never ran (a stream the client left
+    before it started) cannot lock its session for good. Per process,
+    like the memory store.
+    """
+
+    def __init__(self):
+        self._until: Dict[str, float] = {}  # session id -> monotonic expiry
+
+    def begin(self, session_id: str, until: float) -> bool:
+        if self._until.get(session_id, 0.0) > time.monotonic():
+            return False
+        self._until[session_id] = until
+        return True
+
+    def end(self, session_id: str):
+        self._until.pop(session_id, None)
+
+
+def build_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    if backend == "memory":
+        if WEB_CONCURRENCY > 1:
+            logger.warning(
+                "In-memory sessions are per process: with WEB_CONCURRENCY > 1 a turn can land "
+                "on a process that does not hold its session (use a shared SESSION_BACKEND)"
+            )
+        return MemorySessionStore()
+    module, _, factory = backend.partition(":")
+    store = getattr(importlib.import_module(module), factory)()
+    if not isinstance(store, SessionStore):
+        raise TypeError(f"SESSION_BACKEND {backend} returned {type(store).__name__}, not a SessionStore")
+    logger.info(f"Session backend: {backend}")
+    return store
+
+
+# =====================
+# Streamed replies
+# =====================
+class StreamedReply:
+    """Collects the assistant text of a relayed SSE stream, so a streamed
+    turn can be stored too."""
+
+    def __init__(self):
+        self._buffer = b""
+        self._parts: List[str] = []
+        self.complete = False
+
+    def feed(self, chunk: bytes):
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                self.complete = True
+                continue
+            try:
+                choice = loads(data)["choices"][0]
+            except (ValueError, KeyError, IndexError, TypeError):
+                continue
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                self._parts.append(content)
+            if choice.get("finish_reason"):
+                self.complete = True
+
+    def text(self) -> str:
+        return "".join(self._parts)
@@ -0,0 +1,185 @@
+# router/admission.py
+
+import os
+import math
+import heapq
+import asyncio
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from common.serve import per_worker
+
+# =====================
+# Config
+# =====================
+# Priority classes, best first. Requests pick one with the X-Priority header.
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+DEFAULT_PRIORITY = "normal"
+
+MAX_CONCURRENCY = int(os.environ.get("POOL_MAX_CONCURRENCY", "128"))
+MAX_QUEUE = int(os.environ.get("POOL_MAX_QUEUE", "256"))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "10"))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", "1"))
+
+# Shortest-job-first within a priority class: a queued request's position
+# is its arrival time plus SJF_SECONDS_PER_TOKEN x its estimated tokens,
+# capped at SJF_WINDOW. A long request is therefore overtaken only by
+# shorter ones arriving less than SJF_WINDOW seconds after it, which
+# bounds its extra wait. SJF_WINDOW=0 restores plain FIFO.
+SJF_WINDOW = float(os.environ.get("SJF_WINDOW", "2.0"))
+SJF_SECONDS_PER_TOKEN = float(os.environ.get("SJF_SECONDS_PER_TOKEN", "0.001"))
+
+# =====================
+# Metrics (HPA/KEDA inputs)
+# =====================
+QUEUE_DEPTH = Gauge("router_queue_depth", "Requests waiting for a pool slot", ["pool"], multiprocess_mode="livesum")
+ADMITTED = Gauge("router_admitted_requests", "Requests holding a pool slot", ["pool"], multiprocess_mode="livesum")
+QUEUE_WAIT = Histogram(
+    "router_queue_wait_seconds",
+    "Time spent waiting for a pool slot",
+    ["pool", "priority"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+SHED = Counter(
+    "router_shed_requests_total",
+    "Requests rejected by admission control",
+    ["pool", "priority", "reason"],  # queue_full | queue_timeout | preempted
+)
+
+
+class Shed(Exception):
+    """Raised when admission control rejects a request."""
+
+    def __init__(self, reason: str, status_code: int, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_priority(value: Optional[str]) -> str:
+    value = (value or "").strip().lower()
+    return value if value in PRIORITIES else DEFAULT_PRIORITY
+
+
+# =====================
+# Admission controller
+# =====================
+class AdmissionController:
+    """Concurrency limit plus a bounded priority wait queue for one pool.
+
+    At most ``limit`` requests hold a slot; up to ``max_queue`` more wait,
+    best priority first, then shortest job first within SJF_WINDOW. A full
+    queue sheds with 429 (or preempts a waiting request of lower priority),
+    and a request still queued after ``queue_timeout`` is shed with 503.
+    Event-loop only.
+    """
+
+    def __init__(self, pool: str, limit: int, max_queue: int, queue_timeout: float):
+        self.pool = pool
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._heap: List[Tuple[int, float, int, asyncio.Future, str]] = []
+        self._seq = itertools.count()
+        self._depth = QUEUE_DEPTH.labels(pool=pool)
+        self._admitted = ADMITTED.labels(pool=pool)
+
+    def _update_gauges(self):
+        self._depth.set(self.waiting)
+        self._admitted.set(self.active)
+
+    async def acquire(self, priority: str = DEFAULT_PRIORITY, timeout: Optional[float] = None, cost: int = 0):
+        """Wait for a slot; ``cost`` is the request's estimated tokens."""
+        if self.active < self.limit and self.waiting == 0:
+            self.active += 1
+            self._update_gauges()
+            QUEUE_WAIT.labels(pool=self.pool, priority=priority).observe(0.0)
+            return
+
+        rank = PRIORITIES[priority]
+        if self.waiting >= self.max_queue and not self._preempt(rank):
+            SHED.labels(pool=self.pool, priority=priority, reason="queue_full").inc()
+            raise Shed("queue_full", 429, RETRY_AFTER_SECONDS)
+
+        fut = asyncio.get_running_loop().create_future()
+        start = time.monotonic()
+        position = start + min(cost * SJF_SECONDS_PER_TOKEN, SJF_WINDOW)
+        heapq.heappush(self._heap, (rank, position, next(self._seq), fut, priority))
+        self.waiting += 1
+        self._update_gauges()
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                return  # granted at the same moment the wait expired
+            if not fut.done():
+                fut.cancel()
+                self.waiting -= 1
+                self._update_gauges()
+            SHED.labels(pool=self.pool, priority=priority, reason="queue_timeout").inc()
+            raise Shed("queue_timeout", 503, RETRY_AFTER_SECONDS)
+        except asyncio.CancelledError:
+            # Caller went away: give back a slot we were just handed,
+            # or leave the queue.
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release()
+            elif not fut.done():
+                fut.cancel()
+                self.waiting -= 1
+                self._update_gauges()
+            raise
+        finally:
+            QUEUE_WAIT.labels(pool=self.pool, priority=priority).observe(time.monotonic() - start)
+
+    def _preempt(self, rank: int) -> bool:
+        """Shed the worst queued request if it has lower priority than ``rank``."""
+        live = [item for item in self._heap if not item[3].done()]
+        if not live:
+            return False
+        worst = max(live, key=lambda item: (item[0], item[1], item[2]))
+        if worst[0] <= rank:
+            return False
+        SHED.labels(pool=self.pool, priority=worst[4], reason="preempted").inc()
+        worst[3].set_exception(Shed("preempted", 429, RETRY_AFTER_SECONDS))
+        self.waiting -= 1
+        self._update_gauges()
+        return True
+
+    def release(self):
+        while self._heap:
+            _, _, _, fut, _ = heapq.heappop(self._heap)
+            if not fut.done():
+                # Hand the slot straight to the next waiter.
+                fut.set_result(None)
+                self.waiting -= 1
+                self._update_gauges()
+                return
+        self.active -= 1
+        self._update_gauges()
+
+
+def build_admission(pool_names) -> Dict[str, AdmissionController]:
+    """One controller per pool; ``<POOL>_MAX_CONCURRENCY`` / ``<POOL>_MAX_QUEUE``
+    override the POOL_MAX_CONCURRENCY / POOL_MAX_QUEUE defaults.
+
+    Limits are per pod: with several worker processes each enforces its share.
+    """
+    controllers = {}
+    for name in pool_names:
+        prefix = name.upper()
+        limit = int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", MAX_CONCURRENCY))
+        max_queue = int(os.environ.get(f"{prefix}_MAX_QUEUE", MAX_QUEUE))
+        controllers[name] = AdmissionController(
+            pool=name,
+            limit=max(math.ceil(per_worker(limit)), 1),
+            max_queue=math.ceil(per_worker(max_queue)),
+            queue_timeout=QUEUE_TIMEOUT,
+        )
+    return controllers
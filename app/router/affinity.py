@@ -0,0 +1,119 @@
+# router/affinity.py
+
+import os
+import math
+import bisect
+import hashlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter
+
+from pool import Endpoint, WorkerPool
+
+# =====================
+# Config
+# =====================
+PREFIX_AFFINITY = os.environ.get("PREFIX_AFFINITY", "true").strip().lower() in ("1", "true", "yes", "on")
+# Non-system turns (after all system messages) that make up the affinity key.
+AFFINITY_PREFIX_TURNS = int(os.environ.get("AFFINITY_PREFIX_TURNS", "1"))
+# Bounded-load factor c: an endpoint may carry at most c * average in-flight.
+AFFINITY_LOAD_FACTOR = float(os.environ.get("AFFINITY_LOAD_FACTOR", "1.25"))
+AFFINITY_VNODES = int(os.environ.get("AFFINITY_VNODES", "100"))
+
+AFFINITY_REQUESTS = Counter(
+    "router_affinity_requests_total",
+    "Prefix-affinity routing decisions (hit = ring owner, spill = bounded-load fallback)",
+    ["pool", "result"],
+)
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def prefix_key(messages: Sequence) -> Optional[bytes]:
+    """Affinity key for a chat: every system message plus the first
+    AFFINITY_PREFIX_TURNS other turns. These are the tokens shared by all
+    later turns of the same conversation (and by requests that reuse a
+    system prompt), so they are what the worker's prefix cache can reuse.
+    """
+    parts = []
+    turns = 0
+    for m in messages:
+        if m.role != "system":
+            if turns >= AFFINITY_PREFIX_TURNS:
+                break
+            turns += 1
+        parts.append(f"{m.role}\x00{m.content}")
+    if not parts:
+        return None
+    return "\x01".join(parts).encode()
+
+
+# =====================
+# Consistent-hash ring
+# =====================
+class HashRing:
+    def __init__(self, endpoints: Sequence[Endpoint], vnodes: int = AFFINITY_VNODES):
+        self.endpoints = list(endpoints)
+        ring: List[Tuple[int, int]] = []
+        for idx, ep in enumerate(self.endpoints):
+            for v in range(vnodes):
+                ring.append((_hash(f"{ep.url}#{v}".encode()), idx))
+        ring.sort()
+        self._hashes = [h for h, _ in ring]
+        self._owners = [i for _, i in ring]
+
+    def walk(self, key_hash: int):
+        """Yield distinct endpoints clockwise from ``key_hash``."""
+        n = len(self._hashes)
+        start = bisect.bisect(self._hashes, key_hash) % n
+        seen = set()
+        for i in range(n):
+            idx = self._owners[(start + i) % n]
+            if idx not in seen:
+                seen.add(idx)
+                yield self.endpoints[idx]
+                if len(seen) == len(self.endpoints):
+                    return
+
+
+class PrefixAffinity:
+    """Consistent hashing with bounded loads over each pool's endpoints."""
+
+    def __init__(self, load_factor: float = AFFINITY_LOAD_FACTOR):
+        self.load_factor = load_factor
+        self._rings: Dict[str, HashRing] = {}
+
+    def _ring(self, pool: WorkerPool) -> HashRing:
+        ring = self._rings.get(pool.name)
+        if ring is None or ring.endpoints != pool.endpoints:
+            ring = HashRing(pool.endpoints)
+            self._rings[pool.name] = ring
+        return ring
+
+    def pick(self, pool: WorkerPool, messages: Sequence, exclude: Sequence[Endpoint] = (), key: Optional[bytes] = None) -> Endpoint:
+        """Ring owner of the chat's prefix, or of ``key`` when given (a
+        session id: every turn of a stored conversation lands together)."""
+        key = key or prefix_key(messages)
+        if key is None or len(pool.endpoints) == 1:
+            return pool.pick(exclude)
+
+        # Unhealthy / ejected / open-breaker endpoints keep their ring
+        # positions (so keys do not reshuffle) but are skipped, and load is
+        # averaged over the endpoints that can actually take traffic.
+        available = pool.available()
+        if not available:
+            return pool.pick(exclude)
+        total = sum(e.inflight for e in available)
+        capacity = math.ceil(self.load_factor * (total + 1) / len(available))
+
+        first = True
+        for ep in self._ring(pool).walk(_hash(key)):
+            if ep not in exclude and ep in available and ep.inflight < capacity:
+                AFFINITY_REQUESTS.labels(pool=pool.name, result="hit" if first else "spill").inc()
+                return ep
+            first = False
+
+        AFFINITY_REQUESTS.labels(pool=pool.name, result="spill").inc()
+        return pool.pick(exclude)
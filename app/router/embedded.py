@@ -0,0 +1,163 @@
+# router/embedded.py
+#
+# The router as a library. With ROUTER_MODE=embedded the gateway imports
+# this module and routes in its own process: the routing logic is the
+# same route_completion() the standalone service runs, but the gateway ->
+# router HTTP round trip, JSON re-encoding and second request validation
+# are gone. Worker pools, admission, health checks etc. are configured on
+# the gateway pods from the same env the router service reads.
+#
+# EmbeddedTransport is an httpx transport, so the gateway keeps talking to
+# "the router" through one httpx client (completions, streams, embeddings,
+# batches, the model catalogue) whichever mode it runs in. Requests are recorded in
+# the router_* metric families as they would be by the service.
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+import router
+from common.fastjson import JSON_CONTENT_TYPE, dumps, loads
+from common.metrics import InProcessRequest
+
+logger = logging.getLogger("router.embedded")
+
+# Base URL the gateway uses for the in-process router (host is ignored).
+EMBEDDED_ROUTER_URL = "http://embedded-router"
+
+# httpx request extension carrying an already validated chat request
+# (model, messages with role/content, max_tokens, temperature, stream):
+# it is used as-is instead of parsing the request body.
+CHAT_REQUEST_EXTENSION = "chat_request"
+
+
+def _json_response(status_code: int, data, headers: Optional[dict] = None) -> httpx.Response:
+    return httpx.Response(status_code, content=dumps(data), headers={**(headers or {}), **JSON_CONTENT_TYPE})
+
+
+def _chat_request(validated) -> router.ChatCompletionRequest:
+    # construct() skips validation: the caller's schema already checked it.
+    return router.ChatCompletionRequest.construct(
+        model=validated.model,
+        messages=[router.ChatMessage.construct(role=m.role, content=m.content) for m in validated.messages],
+        max_tokens=validated.max_tokens,
+        temperature=validated.temperature,
+        stream=validated.stream,
+    )
+
+
+class _RelayedStream(httpx.AsyncByteStream):
+    """A StreamingResponse body read through httpx, recorded when closed."""
+
+    def __init__(self, call: InProcessRequest, body):
+        self.call = call
+        self.body = body
+        self.complete = False
+
+    async def __aiter__(self):
+        while True:
+            try:
+                chunk = await self.call.run(self.body.__anext__())
+            except StopAsyncIteration:
+                self.complete = True
+                return
+            yield chunk
+
+    async def aclose(self):
+        if self.call.finished:
+            return
+        try:
+            await self.call.run(self.body.aclose())
+        finally:
+            self.call.finish(200 if self.complete else 499)
+
+
+class EmbeddedTransport(httpx.AsyncBaseTransport):
+    """Serves the router's API by calling its handlers directly."""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "POST" and path == "/route_generate":
+            return await self._route_generate(request)
+        if request.method == "POST" and path == "/route_embeddings":
+            return await self._route_embeddings(request)
+        if request.method == "GET" and path == "/v1/models":
+            return _json_response(200, router.list_models())
+        if request.method == "GET" and path == "/health":
+            return _json_response(200, router.health())
+        return _json_response(404, {"detail": "Not Found"})
+
+    async def _route_generate(self, request: httpx.Request) -> httpx.Response:
+        validated = request.extensions.get(CHAT_REQUEST_EXTENSION)
+        if validated is not None:
+            req = _chat_request(validated)
+        else:
+            try:
+                req = router.ChatCompletionRequest(**loads(await request.aread()))
+            except (ValueError, TypeError) as e:
+                return _json_response(422, {"detail": str(e)})
+        return await self._call(
+            "/route_generate",
+            router.route_completion(
+                req,
+                request.headers.get("x-priority"),
+                request.headers.get("x-request-timeout"),
+                x_session_id=request.headers.get("x-session-id"),
+            ),
+        )
+
+    async def _route_embeddings(self, request: httpx.Request) -> httpx.Response:
+        try:
+            req = router.EmbeddingRequest(**loads(await request.aread()))
+        except (ValueError, TypeError) as e:
+            return _json_response(422, {"detail": str(e)})
+        return await self._call("/route_embeddings", router.route_embedding(req, request.headers.get("x-request-timeout")))
+
+    async def _call(self, endpoint: str, handler) -> httpx.Response:
+        """Run a router handler as the service would: metrics, HTTPException
+        turned into an error response, streamed bodies relayed."""
+        call = InProcessRequest(router.METRICS, endpoint)
+        try:
+            response = await call.run(handler)
+        except HTTPException as e:
+            call.finish(e.status_code)
+            return _json_response(e.status_code, {"detail": e.detail}, e.headers)
+        except asyncio.CancelledError:
+            call.finish(499)
+            raise
+        except BaseException:
+            call.finish(500)
+            raise
+
+        if isinstance(response, StreamingResponse):
+            return httpx.Response(
+                response.status_code,
+                headers=response.raw_headers,
+                stream=_RelayedStream(call, response.body_iterator),
+            )
+        call.finish(response.status_code)
+        return httpx.Response(response.status_code, headers=response.raw_headers, content=response.body)
+
+
+class EmbeddedRouter:
+    """Lifecycle of the in-process router, plus the client that reaches it."""
+
+    url = EMBEDDED_ROUTER_URL
+
+    @asynccontextmanager
+    async def lifespan(self):
+        """Run the router service's startup/shutdown (pools, health checks,
+        model discovery) around the embedding app's lifespan."""
+        logger.info("Routing in-process (embedded router)")
+        async with router.lifespan(router.app):
+            yield
+
+    def client(self, timeout: float = 30.0) -> httpx.AsyncClient:
+        # Timeouts are not enforced by the transport: the router bounds its
+        # worker calls with the request deadline.
+        return httpx.AsyncClient(transport=EmbeddedTransport(), base_url=self.url, timeout=timeout)
@@ -0,0 +1,189 @@
+# router/embeddings.py
+
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+from prometheus_client import Counter, Histogram
+
+from common.deadline import Deadline
+
+# =====================
+# Config
+# =====================
+# Concurrent embedding requests for the same pool/model are sent to the
+# worker as one call of up to EMBED_MAX_BATCH_SIZE inputs. A batch is sent
+# when full or EMBED_MAX_WAIT_MS after its first request, whichever comes
+# first (0 = no waiting: only requests arriving together share a call).
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", "32"))
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", "5"))
+
+# =====================
+# Metrics
+# =====================
+BATCH_SIZE = Histogram(
+    "router_embedding_batch_size",
+    "Inputs per batched embedding call to a worker",
+    ["pool"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+BATCH_WAIT = Histogram(
+    "router_embedding_batch_wait_seconds",
+    "Time an embedding request waited for its batch to be sent",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+BATCHES = Counter(
+    "router_embedding_batches_total",
+    "Batched embedding calls by what triggered them",
+    ["pool", "reason"],  # size | time | split (a rejected batch re-sent per request)
+)
+
+# (pool, model, encoding_format, dimensions): requests batch together only
+# when the worker would answer them with the same call.
+BatchKey = Tuple[str, str, Optional[str], Optional[int]]
+# send(key, inputs, deadline) -> (one embedding per input, prompt tokens)
+SendBatch = Callable[[BatchKey, List[str], Deadline], Awaitable[Tuple[list, int]]]
+
+
+class _Pending:
+    __slots__ = ("inputs", "deadline", "future", "enqueued")
+
+    def __init__(self, inputs: List[str], deadline: Deadline):
+        self.inputs = inputs
+        self.deadline = deadline
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.perf_counter()
+
+
+class _Batch:
+    __slots__ = ("requests", "size", "timer")
+
+    def __init__(self):
+        self.requests: List[_Pending] = []
+        self.size = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+# =====================
+# Micro-batcher
+# =====================
+class MicroBatcher:
+    """Dynamic micro-batching of embedding requests.
+
+    ``submit`` adds a request's inputs to the open batch for its key and
+    waits; the batch goes out in one ``send`` call when it is full or its
+    wait runs out, and each caller gets its own slice of the results. A
+    request's inputs are never split across calls, so one larger than the
+    batch size is sent on its own.
+
+    The call runs under the longest of its callers' deadlines, and each
+    caller waits only until its own deadline (asyncio.TimeoutError), so one
+    short deadline does not cut the batch short for everybody. Callers that
+    give up before their batch is sent are dropped from it. Errors reach
+    every caller in the batch, except ``split_on`` errors (the worker
+    rejected the inputs): the batch is then re-sent one request at a time,
+    so only the request at fault fails.
+    """
+
+    def __init__(
+        self,
+        send: SendBatch,
+        max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+        max_wait_ms: float = EMBED_MAX_WAIT_MS,
+        split_on: Tuple[Type[BaseException], ...] = (),
+    ):
+        self.send = send
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait_ms / 1000.0
+        self.split_on = split_on
+        self._open: Dict[BatchKey, _Batch] = {}
+        self._tasks = set()
+
+    async def submit(self, key: BatchKey, inputs: List[str], deadline: Deadline) -> Tuple[list, int]:
+        """Embeddings for ``inputs`` (in order) and their share of the
+        batch's prompt tokens."""
+        batch = self._open.get(key)
+        if batch is not None and batch.size + len(inputs) > self.max_batch_size:
+            self._flush(key, batch, "size")
+            batch = None
+        if batch is None:
+            batch = self._open[key] = _Batch()
+            if self.max_wait > 0:
+                batch.timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush, key, batch, "time")
+
+        pending = _Pending(inputs, deadline)
+        batch.requests.append(pending)
+        batch.size += len(inputs)
+        if batch.size >= self.max_batch_size or self.max_wait <= 0:
+            self._flush(key, batch, "size")
+        # On timeout the future is cancelled, which drops it from the batch
+        # if it has not been sent yet.
+        return await asyncio.wait_for(pending.future, timeout=max(deadline.remaining(), 0.0))
+
+    def _flush(self, key: BatchKey, batch: _Batch, reason: str):
+        if self._open.get(key) is not batch:
+            return  # already sent
+        del self._open[key]
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._send(key, batch, reason))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key: BatchKey, batch: _Batch, reason: str):
+        requests = [p for p in batch.requests if not p.future.done()]
+        if not requests:
+            return
+        pool = key[0]
+        now = time.perf_counter()
+        inputs = []
+        for p in requests:
+            BATCH_WAIT.labels(pool=pool).observe(now - p.enqueued)
+            inputs.extend(p.inputs)
+        BATCH_SIZE.labels(pool=pool).observe(len(inputs))
+        BATCHES.labels(pool=pool, reason=reason).inc()
+        deadline = max((p.deadline for p in requests), key=lambda d: d.expires)
+
+        try:
+            embeddings, prompt_tokens = await self.send(key, inputs, deadline)
+        except self.split_on as e:
+            if len(requests) == 1:
+                _fail(requests, e)
+                return
+            await asyncio.gather(*(self._send_alone(key, p) for p in requests))
+            return
+        except Exception as e:
+            _fail(requests, e)
+            return
+
+        # Usage is per call; each request is charged its share by input length.
+        total_chars = sum(len(text) for text in inputs) or 1
+        offset = 0
+        for p in requests:
+            n = len(p.inputs)
+            share = round(prompt_tokens * sum(len(text) for text in p.inputs) / total_chars)
+            if not p.future.done():
+                p.future.set_result((embeddings[offset:offset + n], share))
+            offset += n
+
+    async def _send_alone(self, key: BatchKey, pending: _Pending):
+        # Alone, a request runs under its own deadline, not the batch's.
+        if pending.future.done():
+            return
+        BATCH_SIZE.labels(pool=key[0]).observe(len(pending.inputs))
+        BATCHES.labels(pool=key[0], reason="split").inc()
+        try:
+            result = await self.send(key, pending.inputs, pending.deadline)
+        except Exception as e:
+            _fail([pending], e)
+            return
+        if not pending.future.done():
+            pending.future.set_result(result)
+
+
+def _fail(requests: List[_Pending], error: Exception):
+    for p in requests:
+        if not p.future.done():
+            p.future.set_exception(error)
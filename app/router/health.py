@@ -0,0 +1,206 @@
+# router/health.py
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+import httpx
+from prometheus_client import Counter
+
+logger = logging.getLogger("router.health")
+
+# =====================
+# Config
+# =====================
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", "5"))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", "2"))
+HEALTH_CHECK_PATH = os.environ.get("HEALTH_CHECK_PATH", "/health")
+# Consecutive probe results needed to flip an endpoint's health.
+HEALTH_UNHEALTHY_THRESHOLD = int(os.environ.get("HEALTH_UNHEALTHY_THRESHOLD", "2"))
+HEALTH_HEALTHY_THRESHOLD = int(os.environ.get("HEALTH_HEALTHY_THRESHOLD", "1"))
+
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "10"))
+# A half-open trial that has not reported after this long is treated as
+# lost, and the next request becomes the trial.
+BREAKER_TRIAL_TIMEOUT = float(os.environ.get("BREAKER_TRIAL_TIMEOUT", "60"))
+
+OUTLIER_WINDOW = int(os.environ.get("OUTLIER_WINDOW", "20"))
+OUTLIER_MIN_REQUESTS = int(os.environ.get("OUTLIER_MIN_REQUESTS", "10"))
+OUTLIER_ERROR_RATE = float(os.environ.get("OUTLIER_ERROR_RATE", "0.5"))
+OUTLIER_EJECTION_SECONDS = float(os.environ.get("OUTLIER_EJECTION_SECONDS", "30"))
+OUTLIER_MAX_EJECTION_PERCENT = float(os.environ.get("OUTLIER_MAX_EJECTION_PERCENT", "50"))
+
+# =====================
+# Metrics
+# =====================
+BREAKER_TRANSITIONS = Counter(
+    "router_breaker_transitions_total",
+    "Circuit breaker state changes per endpoint",
+    ["endpoint", "state"],
+)
+EJECTIONS = Counter(
+    "router_outlier_ejections_total",
+    "Endpoints ejected for a high error rate",
+    ["pool", "endpoint"],
+)
+HEALTH_PROBES = Counter(
+    "router_health_probes_total",
+    "Active health probes per endpoint",
+    ["endpoint", "result"],
+)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+# =====================
+# Circuit breaker
+# =====================
+class CircuitBreaker:
+    """Opens after ``failures`` consecutive failures (errors or timeouts).
+
+    Once ``open_seconds`` have passed it goes half-open and lets a single
+    trial request through: success closes it, failure re-opens it. A trial
+    still outstanding after ``trial_timeout`` no longer blocks a new one.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        failures: int = BREAKER_FAILURES,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        trial_timeout: float = BREAKER_TRIAL_TIMEOUT,
+    ):
+        self.url = url
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self.trial_timeout = trial_timeout
+        self._state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_inflight = False
+        self.trial_started = 0.0
+        self._trials = 0  # token of the current trial
+
+    def state(self, now: Optional[float] = None) -> str:
+        if self._state == OPEN and (now or time.monotonic()) - self.opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def allows(self, now: float) -> bool:
+        state = self.state(now)
+        if state == HALF_OPEN and self.trial_inflight and now - self.trial_started >= self.trial_timeout:
+            logger.warning(f"Circuit breaker for {self.url}: trial request lost, allowing a new one")
+            self.trial_inflight = False
+        return state == CLOSED or (state == HALF_OPEN and not self.trial_inflight)
+
+    def on_pick(self) -> Optional[int]:
+        """A token if this request is the half-open trial, else None."""
+        if self._state != HALF_OPEN:
+            return None
+        self._trials += 1
+        self.trial_inflight = True
+        self.trial_started = time.monotonic()
+        return self._trials
+
+    def on_done(self, trial: Optional[int]):
+        # Only the trial itself frees the slot: a request picked while the
+        # breaker was closed, or an earlier (lost) trial, must not.
+        if trial is not None and trial == self._trials:
+            self.trial_inflight = False
+
+    def record(self, ok: bool):
+        if ok:
+            self.consecutive_failures = 0
+            if self._state != CLOSED:
+                self._transition(CLOSED)
+            return
+        self.consecutive_failures += 1
+        if self._state == HALF_OPEN or (self._state == CLOSED and self.consecutive_failures >= self.failures):
+            self.opened_at = time.monotonic()
+            self._transition(OPEN)
+
+    def _transition(self, state: str):
+        self._state = state
+        self.trial_inflight = False
+        BREAKER_TRANSITIONS.labels(endpoint=self.url, state=state).inc()
+        log = logger.warning if state == OPEN else logger.info
+        log(f"Circuit breaker for {self.url} -> {state}")
+
+
+# =====================
+# Passive outlier detection
+# =====================
+class OutlierDetector:
+    """Sliding window of request outcomes for one endpoint."""
+
+    def __init__(self, window: int = OUTLIER_WINDOW):
+        self.outcomes = deque(maxlen=window)
+        self.ejected_until = 0.0
+        self.ejections = 0
+
+    def record(self, ok: bool) -> bool:
+        """Record an outcome; True if the endpoint now looks like an outlier."""
+        self.outcomes.append(ok)
+        if len(self.outcomes) < OUTLIER_MIN_REQUESTS:
+            return False
+        errors = self.outcomes.count(False)
+        return errors / len(self.outcomes) >= OUTLIER_ERROR_RATE
+
+    def eject(self, now: float):
+        # Repeat offenders stay out longer.
+        self.ejections += 1
+        self.ejected_until = now + OUTLIER_EJECTION_SECONDS * self.ejections
+        self.outcomes.clear()
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+
+def may_eject(endpoints, now: float) -> bool:
+    """Never eject more than OUTLIER_MAX_EJECTION_PERCENT of a pool."""
+    ejected = sum(1 for e in endpoints if e.outlier.is_ejected(now))
+    return (ejected + 1) * 100.0 <= OUTLIER_MAX_EJECTION_PERCENT * len(endpoints)
+
+
+# =====================
+# Active health checks
+# =====================
+class HealthChecker:
+    """Background task probing every endpoint's health URL."""
+
+    def __init__(self, pool_set, client: httpx.AsyncClient, interval: float = HEALTH_CHECK_INTERVAL):
+        self.pool_set = pool_set
+        self.client = client
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.gather(*(self.probe(ep) for ep in self.pool_set.endpoints()))
+            await asyncio.sleep(self.interval)
+
+    async def probe(self, ep):
+        try:
+            resp = await self.client.get(f"{ep.url}{HEALTH_CHECK_PATH}", timeout=HEALTH_CHECK_TIMEOUT)
+            ok = resp.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        HEALTH_PROBES.labels(endpoint=ep.url, result="ok" if ok else "fail").inc()
+        ep.record_probe(ok)
@@ -0,0 +1,189 @@
+# router/length.py
+
+import os
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+from prometheus_client import Counter, Histogram
+
+from common.metrics import TOKEN_BUCKETS, model_label
+
+logger = logging.getLogger("router.length")
+
+# =====================
+# Config
+# =====================
+# tokenizer.json of the served model; without it (or without the
+# `tokenizers` package) prompt length comes from a calibrated heuristic.
+TOKENIZER_PATH = os.environ.get("TOKENIZER_PATH", "")
+CHARS_PER_TOKEN = float(os.environ.get("CHARS_PER_TOKEN", "4"))
+# Chat-template tokens added around every message (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = int(os.environ.get("MESSAGE_OVERHEAD_TOKENS", "4"))
+TOKEN_ESTIMATE_CACHE_SIZE = int(os.environ.get("TOKEN_ESTIMATE_CACHE_SIZE", "8192"))
+# Weight of the newest usage sample in the per-model correction factor.
+TOKEN_CALIBRATION_ALPHA = float(os.environ.get("TOKEN_CALIBRATION_ALPHA", "0.05"))
+
+# Context window per model ("model-a=32768,model-b=8192"); otherwise the
+# max_model_len the workers report, otherwise DEFAULT_CONTEXT_LENGTH
+# (0 = unknown, never reject).
+MODEL_CONTEXT_LENGTHS = os.environ.get("MODEL_CONTEXT_LENGTHS", "")
+DEFAULT_CONTEXT_LENGTH = int(os.environ.get("DEFAULT_CONTEXT_LENGTH", "0"))
+# Estimates are not exact: only reject requests over the window by this much.
+CONTEXT_REJECT_SLACK = float(os.environ.get("CONTEXT_REJECT_SLACK", "0.05"))
+
+# Requests whose prompt + max_tokens reach LONG_CONTEXT_TOKENS go to the
+# LONG_CONTEXT_POOL (when configured and serving the model), so they do
+# not hold slots and KV cache that interactive traffic needs.
+LONG_CONTEXT_POOL = os.environ.get("LONG_CONTEXT_POOL", "long")
+LONG_CONTEXT_TOKENS = int(os.environ.get("LONG_CONTEXT_TOKENS", "8192"))
+
+# =====================
+# Metrics
+# =====================
+ESTIMATED_TOKENS = Histogram(
+    "router_estimated_prompt_tokens",
+    "Estimated prompt tokens per request",
+    buckets=TOKEN_BUCKETS,
+)
+ESTIMATE_ERROR = Histogram(
+    "router_prompt_estimate_ratio",
+    "Actual / estimated prompt tokens (from worker usage)",
+    buckets=(0.5, 0.67, 0.8, 0.9, 0.95, 1.0, 1.05, 1.1, 1.25, 1.5, 2.0),
+)
+CONTEXT_REJECTED = Counter(
+    "router_context_rejected_total",
+    "Requests rejected because prompt + max_tokens exceed the model context",
+    ["model"],
+)
+LONG_CONTEXT_ROUTED = Counter(
+    "router_long_context_requests_total",
+    "Requests sent to the long-context pool",
+    ["pool"],
+)
+
+
+def _parse_lengths(value: str) -> Dict[str, int]:
+    lengths = {}
+    for item in value.split(","):
+        model, _, length = item.partition("=")
+        if model.strip() and length.strip():
+            lengths[model.strip()] = int(length)
+    return lengths
+
+
+# =====================
+# Estimator
+# =====================
+class TokenEstimator:
+    """Cheap prompt-token estimates for scheduling decisions.
+
+    Per-message counts are memoized (LRU), so repeated system prompts and
+    conversation history cost a dict lookup. Heuristic counts are scaled
+    by a per-model factor learned from the ``usage`` workers return.
+    """
+
+    def __init__(self, tokenizer_path: str = TOKENIZER_PATH, cache_size: int = TOKEN_ESTIMATE_CACHE_SIZE):
+        self.tokenizer_path = tokenizer_path
+        self.tokenizer = None
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._factors: Dict[str, float] = {}
+
+    def load(self):
+        """Load the tokenizer (app startup, not import: it is slow)."""
+        if not self.tokenizer_path or self.tokenizer is not None:
+            return
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            logger.warning("TOKENIZER_PATH set but `tokenizers` is not installed, using heuristic")
+            return
+        try:
+            self.tokenizer = Tokenizer.from_file(self.tokenizer_path)
+            logger.info(f"Token estimates from {self.tokenizer_path}")
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer {self.tokenizer_path}, using heuristic: {e}")
+
+    def _count(self, text: str) -> int:
+        cached = self._cache.get(text)
+        if cached is not None:
+            self._cache.move_to_end(text)
+            return cached
+        if self.tokenizer is not None:
+            count = len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        elif text.isascii():
+            count = int(len(text) / CHARS_PER_TOKEN) + 1
+        else:
+            # CJK and other non-ASCII text is roughly one token per character.
+            wide = sum(1 for c in text if ord(c) > 127)
+            count = int((len(text) - wide) / CHARS_PER_TOKEN) + wide + 1
+        self._cache[text] = count
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return count
+
+    def _raw(self, messages: Iterable) -> int:
+        return sum(self._count(m.content) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+    def estimate(self, model: str, messages: Iterable) -> int:
+        tokens = int(self._raw(messages) * self._factors.get(model, 1.0))
+        ESTIMATED_TOKENS.observe(tokens)
+        return tokens
+
+    def calibrate(self, model: str, messages: Iterable, prompt_tokens: int):
+        """Fold one actual prompt_tokens count into the model's factor."""
+        raw = self._raw(messages)
+        if raw <= 0 or prompt_tokens <= 0:
+            return
+        ratio = prompt_tokens / raw
+        factor = self._factors.get(model, 1.0)
+        ESTIMATE_ERROR.observe(prompt_tokens / max(raw * factor, 1.0))
+        factor += TOKEN_CALIBRATION_ALPHA * (ratio - factor)
+        self._factors[model] = min(max(factor, 0.25), 4.0)
+
+
+# =====================
+# Length policy
+# =====================
+class ContextExceeded(Exception):
+    def __init__(self, context: int, prompt_tokens: int, max_tokens: int):
+        super().__init__(
+            f"This model's maximum context length is {context} tokens; the request needs about "
+            f"{prompt_tokens + max_tokens} ({prompt_tokens} prompt + {max_tokens} max_tokens)"
+        )
+
+
+class LengthPolicy:
+    """Early context-limit rejection and long-context pool selection."""
+
+    def __init__(self, pool_set, registry):
+        self.pool_set = pool_set
+        self.registry = registry
+        self.context_lengths = _parse_lengths(MODEL_CONTEXT_LENGTHS)
+        self.long_pool = pool_set.pools.get(LONG_CONTEXT_POOL)
+
+    def context_for(self, model: str, pool) -> int:
+        if model in self.context_lengths:
+            return self.context_lengths[model]
+        return self.registry.max_model_len(model, pool.name) or DEFAULT_CONTEXT_LENGTH
+
+    def check(self, model: str, pool, prompt_tokens: int, max_tokens: int):
+        """Raise ContextExceeded if the request cannot fit the model."""
+        context = self.context_for(model, pool)
+        if context and prompt_tokens + max_tokens > context * (1 + CONTEXT_REJECT_SLACK):
+            CONTEXT_REJECTED.labels(model=model_label(model)).inc()
+            raise ContextExceeded(context, prompt_tokens, max_tokens)
+
+    def route(self, model: str, pool, total_tokens: int):
+        """The long-context pool for long requests, ``pool`` otherwise."""
+        long_pool = self.long_pool
+        if (
+            long_pool is None
+            or long_pool is pool
+            or total_tokens < LONG_CONTEXT_TOKENS
+            or not self.registry.serves(model, long_pool.name)
+        ):
+            return pool
+        LONG_CONTEXT_ROUTED.labels(pool=long_pool.name).inc()
+        return long_pool
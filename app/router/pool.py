@@ -0,0 +1,314 @@
+# router/pool.py
+
+import os
+import time
+import random
+import logging
+import itertools
+from typing import Dict, Iterable, List, Optional
+
+from prometheus_client.core import GaugeMetricFamily
+
+from health import (
+    BREAKER_STATE_VALUES,
+    EJECTIONS,
+    HEALTH_HEALTHY_THRESHOLD,
+    HEALTH_UNHEALTHY_THRESHOLD,
+    CircuitBreaker,
+    OutlierDetector,
+    may_eject,
+)
+
+logger = logging.getLogger("router.pool")
+
+POLICIES = ("round_robin", "least_outstanding", "p2c")
+
+# Weight of the newest sample in the per-endpoint latency EWMA.
+EWMA_ALPHA = float(os.environ.get("EWMA_ALPHA", "0.3"))
+
+
+class NoEndpointAvailable(Exception):
+    """Every endpoint of a pool is unhealthy, ejected or behind an open breaker."""
+
+
+# =====================
+# Endpoint
+# =====================
+class Endpoint:
+    """One worker replica, with live load and latency stats.
+
+    Everything runs on the event loop, so plain attributes are enough:
+    there is no await between reading and updating ``inflight``.
+    """
+
+    def __init__(self, url: str, pool: str):
+        self.url = url.rstrip("/")
+        self.pool = pool
+        self.inflight = 0
+        self.ewma_latency = 0.0  # seconds; 0 until the first sample
+
+        # Health: active probes, circuit breaker, passive outlier detection.
+        # Endpoints start healthy so traffic flows before the first probe.
+        self.healthy = True
+        self._probe_streak = 0  # >0 consecutive probe successes, <0 failures
+        self.breaker = CircuitBreaker(self.url)
+        self.outlier = OutlierDetector()
+        self.peers: List["Endpoint"] = [self]
+
+    def available(self, now: float) -> bool:
+        return self.healthy and not self.outlier.is_ejected(now) and self.breaker.allows(now)
+
+    def begin(self) -> Optional[int]:
+        """Count a request in; returns its breaker trial token (pass it to
+        ``end``)."""
+        self.inflight += 1
+        return self.breaker.on_pick()
+
+    def end(self, latency: Optional[float] = None, trial: Optional[int] = None):
+        self.inflight -= 1
+        self.breaker.on_done(trial)
+        if latency is None:
+            return
+        if self.ewma_latency == 0.0:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency += EWMA_ALPHA * (latency - self.ewma_latency)
+
+    def report(self, ok: bool):
+        """Record the outcome of one request (False = error or timeout)."""
+        self.breaker.record(ok)
+        now = time.monotonic()
+        if self.outlier.record(ok) and may_eject(self.peers, now):
+            self.outlier.eject(now)
+            EJECTIONS.labels(pool=self.pool, endpoint=self.url).inc()
+            logger.warning(
+                f"Ejected {self.url} from pool '{self.pool}' for "
+                f"{self.outlier.ejected_until - now:.0f}s (high error rate)"
+            )
+
+    def record_probe(self, ok: bool):
+        """Record an active health probe; flips ``healthy`` after enough
+        consecutive results in the other direction."""
+        if ok:
+            self._probe_streak = max(self._probe_streak, 0) + 1
+            if not self.healthy and self._probe_streak >= HEALTH_HEALTHY_THRESHOLD:
+                self.healthy = True
+                logger.info(f"Endpoint {self.url} is healthy again")
+        else:
+            self._probe_streak = min(self._probe_streak, 0) - 1
+            if self.healthy and -self._probe_streak >= HEALTH_UNHEALTHY_THRESHOLD:
+                self.healthy = False
+                logger.warning(f"Endpoint {self.url} failed {-self._probe_streak} health checks, marking unhealthy")
+
+    def load_score(self) -> float:
+        # Peak-EWMA style: expected wait grows with queue length and with
+        # how slow this replica has been recently. Unmeasured endpoints
+        # score as cheap so they get traffic and a first sample.
+        return (self.inflight + 1) * (self.ewma_latency or 1e-3)
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.url,
+            "inflight": self.inflight,
+            "ewma_latency": round(self.ewma_latency, 4),
+            "healthy": self.healthy,
+            "breaker": self.breaker.state(),
+            "ejected": self.outlier.is_ejected(time.monotonic()),
+        }
+
+
+# =====================
+# Worker pool
+# =====================
+class WorkerPool:
+    """A set of interchangeable endpoints serving the same backend."""
+
+    def __init__(self, name: str, backend: str, urls: Iterable[str], policy: str = "least_outstanding"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy '{policy}', expected one of {POLICIES}")
+        self.name = name
+        self.backend = backend
+        self.policy = policy
+        self.endpoints: List[Endpoint] = [Endpoint(u, name) for u in urls]
+        if not self.endpoints:
+            raise ValueError(f"Pool '{name}' has no endpoints")
+        for ep in self.endpoints:
+            ep.peers = self.endpoints
+        self._rr = itertools.cycle(range(len(self.endpoints)))
+
+    def available(self) -> List[Endpoint]:
+        now = time.monotonic()
+        return [e for e in self.endpoints if e.available(now)]
+
+    def pick(self, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        available = self.available()
+        if not available:
+            raise NoEndpointAvailable(f"No available endpoint in pool '{self.name}'")
+        candidates = [e for e in available if e not in exclude] or available
+        if len(candidates) == 1:
+            return candidates[0]
+
+        if self.policy == "round_robin":
+            while True:
+                ep = self.endpoints[next(self._rr)]
+                if ep in candidates:
+                    return ep
+
+        if self.policy == "p2c":
+            a, b = random.sample(candidates, 2)
+            return a if a.load_score() <= b.load_score() else b
+
+        # least_outstanding: fewest in-flight requests, EWMA latency breaks ties
+        return min(candidates, key=lambda e: (e.inflight, e.ewma_latency, random.random()))
+
+    def snapshot(self) -> dict:
+        return {
+            "backend": self.backend,
+            "policy": self.policy,
+            "endpoints": [e.snapshot() for e in self.endpoints],
+        }
+
+
+# =====================
+# Pool set (model -> pool)
+# =====================
+class PoolSet:
+    """All configured pools plus the logical model name -> pool mapping."""
+
+    def __init__(self, pools: Dict[str, WorkerPool], model_pools: Dict[str, str], default_pool: str):
+        if default_pool not in pools:
+            raise ValueError(f"DEFAULT_POOL '{default_pool}' is not a configured pool ({list(pools)})")
+        for model, pool in model_pools.items():
+            if pool not in pools:
+                raise ValueError(f"MODEL_POOLS maps '{model}' to unknown pool '{pool}'")
+        self.pools = pools
+        self.model_pools = model_pools
+        self.default_pool = default_pool
+
+    def for_model(self, model: str) -> WorkerPool:
+        return self.pools[self.model_pools.get(model, self.default_pool)]
+
+    def endpoints(self) -> List[Endpoint]:
+        return [e for p in self.pools.values() for e in p.endpoints]
+
+    def snapshot(self) -> dict:
+        return {
+            "default_pool": self.default_pool,
+            "model_pools": self.model_pools,
+            "pools": {name: p.snapshot() for name, p in self.pools.items()},
+        }
+
+
+def _split(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _pool_urls(prefix: str, default_host: Optional[str], default_port: str) -> List[str]:
+    """Endpoints for one backend: ``<PREFIX>_WORKER_URLS`` (comma separated,
+    e.g. pod addresses behind a headless Service) wins over the single
+    ``<PREFIX>_WORKER_HOST``/``<PREFIX>_WORKER_PORT`` pair."""
+    urls = os.environ.get(f"{prefix}_WORKER_URLS")
+    if urls:
+        return [u if "://" in u else f"http://{u}" for u in _split(urls)]
+    host = os.environ.get(f"{prefix}_WORKER_HOST", default_host)
+    if not host:
+        return []
+    port = os.environ.get(f"{prefix}_WORKER_PORT", default_port)
+    return [f"http://{host}:{port}"]
+
+
+def load_pools_from_env() -> PoolSet:
+    """Build the pool set from env.
+
+    - VLLM_WORKER_URLS / VLLM_WORKER_HOST + VLLM_WORKER_PORT: vLLM pool
+    - TRT_WORKER_URLS / TRT_WORKER_HOST + TRT_WORKER_PORT: TensorRT-LLM pool
+      (only created when configured; must expose the OpenAI API)
+    - LONG_WORKER_URLS / LONG_WORKER_HOST + LONG_WORKER_PORT: long-context
+      pool (only created when configured; backend name from LONG_BACKEND)
+    - BERT_WORKER_URLS / BERT_WORKER_HOST + BERT_WORKER_PORT: embedding
+      pool (only created when configured; must expose /v1/embeddings)
+    - ROUTING_POLICY: round_robin | least_outstanding | p2c
+    - MODEL_POOLS: "model-a=vllm,model-b=trt"
+    - DEFAULT_POOL: pool for models not listed in MODEL_POOLS
+    """
+    policy = os.environ.get("ROUTING_POLICY", "least_outstanding").strip().lower()
+
+    pools: Dict[str, WorkerPool] = {}
+    vllm_urls = _pool_urls("VLLM", "vllm-worker-service.llm.svc.cluster.local", "8002")
+    if vllm_urls:
+        pools["vllm"] = WorkerPool("vllm", "vllm", vllm_urls, policy)
+    trt_urls = _pool_urls("TRT", None, "8003")
+    if trt_urls:
+        pools["trt"] = WorkerPool("trt", "tensorrt-llm", trt_urls, policy)
+    long_urls = _pool_urls("LONG", None, "8002")
+    if long_urls:
+        pools["long"] = WorkerPool("long", os.environ.get("LONG_BACKEND", "vllm"), long_urls, policy)
+    bert_urls = _pool_urls("BERT", None, "8004")
+    if bert_urls:
+        pools["bert"] = WorkerPool("bert", "bert", bert_urls, policy)
+
+    model_pools = {}
+    for item in _split(os.environ.get("MODEL_POOLS", "")):
+        model, _, pool = item.partition("=")
+        model_pools[model.strip()] = pool.strip()
+
+    default_pool = os.environ.get("DEFAULT_POOL", "vllm")
+    pool_set = PoolSet(pools, model_pools, default_pool)
+    for name, p in pools.items():
+        logger.info(f"Pool '{name}' ({p.backend}, {policy}): {[e.url for e in p.endpoints]}")
+    return pool_set
+
+
+# =====================
+# Metrics
+# =====================
+class PoolSetCollector:
+    """Exports per-endpoint load, latency and health state at scrape time."""
+
+    def __init__(self, get_pool_set):
+        self.get_pool_set = get_pool_set
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        inflight = GaugeMetricFamily(
+            "router_endpoint_inflight_requests",
+            "In-flight requests per worker endpoint",
+            labels=["pool", "endpoint"],
+        )
+        latency = GaugeMetricFamily(
+            "router_endpoint_ewma_latency_seconds",
+            "EWMA request latency per worker endpoint",
+            labels=["pool", "endpoint"],
+        )
+        healthy = GaugeMetricFamily(
+            "router_endpoint_healthy",
+            "1 if the worker endpoint passes active health checks",
+            labels=["pool", "endpoint"],
+        )
+        breaker = GaugeMetricFamily(
+            "router_endpoint_breaker_state",
+            "Circuit breaker state per worker endpoint (0=closed, 1=half_open, 2=open)",
+            labels=["pool", "endpoint"],
+        )
+        ejected = GaugeMetricFamily(
+            "router_endpoint_ejected",
+            "1 while the worker endpoint is ejected as an outlier",
+            labels=["pool", "endpoint"],
+        )
+        pool_set = self.get_pool_set()
+        if pool_set is not None:
+            now = time.monotonic()
+            for ep in pool_set.endpoints():
+                labels = [ep.pool, ep.url]
+                inflight.add_metric(labels, ep.inflight)
+                latency.add_metric(labels, ep.ewma_latency)
+                healthy.add_metric(labels, 1 if ep.healthy else 0)
+                breaker.add_metric(labels, BREAKER_STATE_VALUES[ep.breaker.state(now)])
+                ejected.add_metric(labels, 1 if ep.outlier.is_ejected(now) else 0)
+        yield inflight
+        yield latency
+        yield healthy
+        yield breaker
+        yield ejected
@@ -0,0 +1,162 @@
+# router/registry.py
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from prometheus_client import Counter, Gauge
+
+from pool import PoolSet, WorkerPool
+
+logger = logging.getLogger("router.registry")
+
+# =====================
+# Config
+# =====================
+MODEL_REGISTRY_INTERVAL = float(os.environ.get("MODEL_REGISTRY_INTERVAL", "30"))
+# A model not reported by any worker for this long drops out of the catalogue.
+MODEL_REGISTRY_TTL = float(os.environ.get("MODEL_REGISTRY_TTL", "120"))
+MODEL_REGISTRY_TIMEOUT = float(os.environ.get("MODEL_REGISTRY_TIMEOUT", "5"))
+# Listed (on DEFAULT_POOL) until discovery has found anything, so the
+# catalogue is never empty while every model still routes to DEFAULT_POOL.
+DEFAULT_MODEL = os.environ.get("DEFAULT_MODEL", "qwen2.5-0.5b")
+
+REGISTRY_MODELS = Gauge("router_registry_models", "Models in the discovered catalogue", multiprocess_mode="livemax")
+REGISTRY_POLLS = Counter(
+    "router_registry_polls_total",
+    "Worker /v1/models polls",
+    ["pool", "result"],  # ok | error
+)
+
+
+class ModelRegistry:
+    """Catalogue of served models, discovered from the workers.
+
+    Every MODEL_REGISTRY_INTERVAL seconds each available endpoint's
+    ``/v1/models`` is polled and the model cards are merged per pool.
+    Explicit MODEL_POOLS entries always win; other models route to the
+    pool(s) whose workers report them. While nothing has been discovered
+    every model goes to DEFAULT_POOL, as before discovery existed.
+    """
+
+    def __init__(
+        self,
+        pool_set: PoolSet,
+        interval: float = MODEL_REGISTRY_INTERVAL,
+        ttl: float = MODEL_REGISTRY_TTL,
+        default_model: str = DEFAULT_MODEL,
+    ):
+        self.pool_set = pool_set
+        self.default_model = default_model
+        self.interval = interval
+        self.ttl = ttl
+        # model id -> pool name -> (last seen, model card)
+        self._seen: Dict[str, Dict[str, Tuple[float, dict]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- lifecycle ----------
+    def start(self, client: httpx.AsyncClient):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run(client))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, client: httpx.AsyncClient):
+        while True:
+            await self.refresh(client)
+            await asyncio.sleep(self.interval)
+
+    # ---------- discovery ----------
+    async def refresh(self, client: httpx.AsyncClient):
+        polls = [
+            (pool, self._poll(client, pool, ep))
+            for pool in self.pool_set.pools.values()
+            for ep in pool.available()
+        ]
+        results = await asyncio.gather(*(p for _, p in polls))
+        now = time.monotonic()
+        for (pool, _), cards in zip(polls, results):
+            for card in cards or ():
+                model_id = card.get("id")
+                if isinstance(model_id, str):
+                    self._seen.setdefault(model_id, {})[pool.name] = (now, card)
+        self._expire(now)
+        REGISTRY_MODELS.set(len(self._seen))
+
+    async def _poll(self, client: httpx.AsyncClient, pool: WorkerPool, ep) -> Optional[List[dict]]:
+        try:
+            resp = await client.get(f"{ep.url}/v1/models", timeout=MODEL_REGISTRY_TIMEOUT)
+            resp.raise_for_status()
+            cards = resp.json().get("data", [])
+        except (httpx.HTTPError, ValueError, AttributeError) as e:
+            REGISTRY_POLLS.labels(pool=pool.name, result="error").inc()
+            logger.warning(f"Model discovery failed for {ep.url}: {e}")
+            return None
+        REGISTRY_POLLS.labels(pool=pool.name, result="ok").inc()
+        return cards if isinstance(cards, list) else None
+
+    def _expire(self, now: float):
+        for model_id in list(self._seen):
+            pools = {p: v for p, v in self._seen[model_id].items() if now - v[0] <= self.ttl}
+            if pools:
+                self._seen[model_id] = pools
+            else:
+                del self._seen[model_id]
+                logger.info(f"Model '{model_id}' no longer served, removed from catalogue")
+
+    # ---------- lookups ----------
+    @property
+    def discovered(self) -> bool:
+        """False while no worker has reported a model: any model is routable."""
+        return bool(self._seen)
+
+    def pool_for(self, model: str) -> Optional[WorkerPool]:
+        """Pool serving ``model``, or None if the model is unknown."""
+        pools = self.pool_set.pools
+        if model in self.pool_set.model_pools:
+            return pools[self.pool_set.model_pools[model]]
+        if not self._seen:
+            # Nothing discovered (yet): route as if discovery did not exist.
+            return pools[self.pool_set.default_pool]
+        serving = self._seen.get(model)
+        if not serving:
+            return None
+        if self.pool_set.default_pool in serving:
+            return pools[self.pool_set.default_pool]
+        return pools[next(iter(serving))]
+
+    def serves(self, model: str, pool_name: str) -> bool:
+        """Whether ``pool_name`` can take ``model`` (assumed while nothing is discovered)."""
+        if self.pool_set.model_pools.get(model) == pool_name or not self._seen:
+            return True
+        return pool_name in self._seen.get(model, {})
+
+    def max_model_len(self, model: str, pool_name: str) -> Optional[int]:
+        """Context window the pool's workers report (vLLM's ``max_model_len``)."""
+        entry = self._seen.get(model, {}).get(pool_name)
+        value = entry[1].get("max_model_len") if entry else None
+        return value if isinstance(value, int) else None
+
+    def catalogue(self) -> List[dict]:
+        """OpenAI model cards for every routable model, with their pools."""
+        models: Dict[str, dict] = {}
+        for model_id, serving in self._seen.items():
+            card = dict(next(iter(serving.values()))[1])
+            card["pools"] = sorted(serving)
+            models[model_id] = card
+        for model_id, pool in self.pool_set.model_pools.items():
+            card = models.setdefault(model_id, {"id": model_id, "object": "model", "owned_by": pool})
+            card["pools"] = [pool]
+        if not self._seen and self.default_model and self.default_model not in models:
+            pool = self.pool_set.default_pool
+            models[self.default_model] = {"id": self.default_model, "object": "model", "owned_by": pool, "pools": [pool]}
+        return sorted(models.values(), key=lambda c: c["id"])
@@ -0,0 +1,135 @@
+# router/retry.py
+
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from prometheus_client import Counter
+
+# =====================
+# Config
+# =====================
+# Extra attempts after a failure that never reached the worker.
+MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "2"))
+# Retries may add at most RATIO x recent requests, plus a small floor so a
+# quiet router can still retry, within RETRY_BUDGET_WINDOW seconds.
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SEC = float(os.environ.get("RETRY_BUDGET_MIN_PER_SEC", "5"))
+RETRY_BUDGET_WINDOW = float(os.environ.get("RETRY_BUDGET_WINDOW", "10"))
+
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").strip().lower() in ("1", "true", "yes", "on")
+# Only requests this short are hedged; long generations are too costly to duplicate.
+HEDGE_MAX_TOKENS = int(os.environ.get("HEDGE_MAX_TOKENS", "64"))
+HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "50"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_WINDOW = int(os.environ.get("HEDGE_WINDOW", "500"))
+
+# =====================
+# Metrics
+# =====================
+UPSTREAM_ATTEMPTS = Counter(
+    "router_upstream_attempts_total",
+    "Worker calls by kind; (retry + hedge) / primary is the extra load",
+    ["pool", "kind"],  # primary | retry | hedge
+)
+RETRIES_DENIED = Counter(
+    "router_retries_denied_total",
+    "Retryable failures returned to the client without retrying",
+    ["pool", "reason"],  # max_retries | budget
+)
+HEDGE_WINS = Counter(
+    "router_hedge_wins_total",
+    "Hedged requests answered first by the hedge; / hedge attempts = win rate",
+    ["pool"],
+)
+
+
+# =====================
+# Retry budget
+# =====================
+class RetryBudget:
+    """Caps retries to a fraction of recent traffic.
+
+    When workers are overloaded every request fails and naive retries
+    multiply the load; with a budget the extra load stays bounded by
+    ``ratio`` no matter how much fails. Kept per router process: every
+    replica enforces the same ratio, so the cluster total is bounded by it
+    too.
+    """
+
+    def __init__(
+        self,
+        ratio: float = RETRY_BUDGET_RATIO,
+        min_per_sec: float = RETRY_BUDGET_MIN_PER_SEC,
+        window: float = RETRY_BUDGET_WINDOW,
+    ):
+        self.ratio = ratio
+        self.floor = min_per_sec * window
+        self.window = window
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+
+    def _trim(self, now: float):
+        cutoff = now - self.window
+        for q in (self._requests, self._retries):
+            while q and q[0] < cutoff:
+                q.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= self.floor + self.ratio * len(self._requests):
+            return False
+        self._retries.append(now)
+        return True
+
+
+# =====================
+# Hedge delay
+# =====================
+class LatencyTracker:
+    """Rolling latency quantile per pool, used as the hedge delay.
+
+    The quantile is re-sorted at most every ``refresh`` samples so the
+    request path does not sort the window on every call.
+    """
+
+    def __init__(
+        self,
+        quantile: float = HEDGE_QUANTILE,
+        window: int = HEDGE_WINDOW,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        refresh: int = 20,
+    ):
+        self.quantile = quantile
+        self.window = window
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self._samples: Dict[str, deque] = {}
+        self._cached: Dict[str, Optional[float]] = {}
+        self._stale: Dict[str, int] = {}
+
+    def observe(self, pool: str, latency: float):
+        samples = self._samples.setdefault(pool, deque(maxlen=self.window))
+        samples.append(latency)
+        self._stale[pool] = self._stale.get(pool, 0) + 1
+
+    def delay(self, pool: str) -> Optional[float]:
+        """Current quantile, or None until enough samples exist."""
+        if pool in self._cached and self._stale.get(pool, 0) < self.refresh:
+            return self._cached[pool]
+        samples = self._samples.get(pool)
+        value = None
+        if samples and len(samples) >= self.min_samples:
+            ordered = sorted(samples)
+            value = max(ordered[int(self.quantile * (len(ordered) - 1))], HEDGE_MIN_DELAY)
+        self._cached[pool] = value
+        self._stale[pool] = 0
+        return value
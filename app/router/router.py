@@ -1,14 +1,51 @@
 # router/router.py
 
+import os
 import time
+import asyncio
 import logging
 import httpx
-from typing import List, Literal
+from contextlib import asynccontextmanager
+from typing import Dict, List, Literal, Optional, Tuple, Union
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
 from pydantic import BaseModel
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from fastapi.responses import Response
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST
+from fastapi.responses import Response, StreamingResponse
+
+from common.httpclient import build_async_client, PoolCollector
+from common.streaming import relay_stream, SSE_HEADERS
+from common.tracing import Tracer
+from pool import EWMA_ALPHA, Endpoint, NoEndpointAvailable, PoolSetCollector, load_pools_from_env
+from health import HealthChecker
+from registry import ModelRegistry
+from length import ContextExceeded, LengthPolicy, TokenEstimator
+from affinity import PREFIX_AFFINITY, PrefixAffinity
+from admission import DEFAULT_PRIORITY, RETRY_AFTER_SECONDS, Shed, build_admission, parse_priority
+from embeddings import BatchKey, MicroBatcher
+from singleflight import SingleFlight
+from retry import (
+    HEDGE_ENABLED,
+    HEDGE_MAX_TOKENS,
+    HEDGE_WINS,
+    MAX_RETRIES,
+    RETRIES_DENIED,
+    UPSTREAM_ATTEMPTS,
+    LatencyTracker,
+    RetryBudget,
+)
+from common.canonical import request_key
+from common.fastjson import JSON_CONTENT_TYPE, dumps, loads
+from common.deadline import ClientDisconnected, Deadline, cancel_on_disconnect
+from common.metrics import (
+    CHUNK_GAP_BUCKETS,
+    TTFT_BUCKETS,
+    HopMetrics,
+    MetricsMiddleware,
+    add_upstream_time,
+    annotate,
+    server_timing,
+)
 
 # =====================
 # Logging
@@ -19,25 +56,109 @@ logging.basicConfig(
 )
 logger = logging.getLogger("router")
 
+# Structured request tracing (off by default, see common/tracing.py)
+TRACER = Tracer.from_env("router")
+
+# =====================
+# Upstream HTTP client
+# =====================
+# One pooled client per process, opened/closed by the app lifespan.
+http_client: Optional[httpx.AsyncClient] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    http_client = build_async_client(timeout=30.0)
+    TRACER.start()
+    TOKENS.load()
+    health_checker = HealthChecker(POOLS, http_client)
+    health_checker.start()
+    MODELS.start(http_client)
+    METRICS.start()
+    try:
+        yield
+    finally:
+        await METRICS.stop()
+        await MODELS.stop()
+        await health_checker.stop()
+        await http_client.aclose()
+        http_client = None
+        TRACER.stop()
+
+
 # =====================
 # FastAPI App
 # =====================
-app = FastAPI(title="LLM Router (OpenAI-compatible)")
+app = FastAPI(title="LLM Router (OpenAI-compatible)", lifespan=lifespan)
 
 # =====================
 # Metrics
 # =====================
+# Status/model/backend-labelled counts, duration (errors included), worker
+# time vs. router overhead, body sizes and token usage (common/metrics.py)
+METRICS = HopMetrics("router")
+app.add_middleware(MetricsMiddleware, hop=METRICS)
+
 ROUTER_REQUESTS = Counter("router_requests_total", "Total router requests")
-ROUTER_LATENCY = Histogram("router_latency_seconds", "Router latency")
+ROUTER_STREAM_TTFT = Histogram(
+    "router_stream_ttft_seconds",
+    "Time from request to first streamed chunk from the worker",
+    buckets=TTFT_BUCKETS,
+)
+ROUTER_STREAM_CHUNK_GAP = Histogram(
+    "router_stream_inter_chunk_seconds",
+    "Time between consecutive streamed chunks from the worker",
+    buckets=CHUNK_GAP_BUCKETS,
+)
+ROUTER_CANCELLED = Counter(
+    "router_cancelled_requests_total",
+    "Worker calls abandoned before completion",
+    ["reason"],  # client_disconnect | deadline | hedge_loser
+)
+ROUTER_WASTED_TOKENS = Counter(
+    "router_wasted_tokens_total",
+    "Estimated completion tokens generated for worker calls that were abandoned",
+)
+METRICS.register_collector(PoolCollector("router", lambda: http_client))
 
 # =====================
-# Worker config
+# Worker pools
 # =====================
-import os
-VLLM_WORKER_HOST = os.environ.get("VLLM_WORKER_HOST", "vllm-worker-service.llm.svc.cluster.local")
-VLLM_WORKER_PORT = os.environ.get("VLLM_WORKER_PORT", "8002")
-WORKER_URL = f"http://{VLLM_WORKER_HOST}:{VLLM_WORKER_PORT}"
-logger.info(f"Using WORKER_URL: {WORKER_URL}")
+POOLS = load_pools_from_env()
+METRICS.register_collector(PoolSetCollector(lambda: POOLS), summed=("router_endpoint_inflight_requests",))
+
+# Served models, discovered from the workers' /v1/models (registry.py)
+MODELS = ModelRegistry(POOLS)
+
+# Prompt-token estimates drive context-limit rejection, long-context pool
+# selection and shortest-job-first queueing (length.py, admission.py).
+TOKENS = TokenEstimator()
+LENGTH = LengthPolicy(POOLS, MODELS)
+
+# Prefix-affinity routing keeps conversations sharing a prompt prefix on
+# the same replica so vLLM's prefix cache can reuse their KV blocks.
+AFFINITY = PrefixAffinity() if PREFIX_AFFINITY else None
+# Gateway sessions (X-Session-Id) are pinned by id even without prefix
+# affinity: their whole stored history is the reusable prefix.
+SESSION_AFFINITY = AFFINITY or PrefixAffinity()
+
+# Per-pool concurrency limit + bounded priority queue (load shedding)
+ADMISSION = build_admission(POOLS.pools)
+
+# Identical in-flight deterministic (temperature=0) completions share one
+# upstream call.
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+SINGLE_FLIGHT = SingleFlight()
+
+# Retries for failures that never reached a worker share one budget with
+# hedges (duplicate calls for short requests slower than the pool's p95).
+RETRY_BUDGET = RetryBudget()
+HEDGE_LATENCIES = LatencyTracker()
+
+# Completion tokens/second per pool, learned from worker `usage`; used to
+# estimate how many tokens an abandoned generation had already produced.
+TOKEN_RATES: Dict[str, float] = {}
 
 # =====================
 # OpenAI schemas
@@ -51,170 +172,605 @@ class ChatCompletionRequest(BaseModel):
     messages: List[ChatMessage]
     max_tokens: int = 128
     temperature: float = 0.7
+    stream: bool = False
+
+class EmbeddingRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    encoding_format: Optional[Literal["float", "base64"]] = None
+    dimensions: Optional[int] = None
 
 # =====================
 # Health / metrics
 # =====================
 @app.get("/health")
 def health():
-    return {"status": "ok", "worker": WORKER_URL}
+    return {"status": "ok", "workers": POOLS.snapshot()}
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return Response(METRICS.render(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/v1/models")
+def list_models():
+    # "discovered": false tells the gateway the list is not exhaustive yet
+    # (every model still routes to DEFAULT_POOL), so it must not 404.
+    return {"object": "list", "data": MODELS.catalogue(), "discovered": MODELS.discovered}
+
+class WorkerConnectError(HTTPException):
+    """The request never reached the worker, so another attempt is safe."""
+
+
+def report_timeout(ep: Endpoint, deadline: Deadline):
+    """Count a timed-out call against the replica, unless it was the
+    caller's own short deadline (X-Request-Timeout) that ran out: a client
+    asking for 0.2s must not open the breaker on a healthy worker."""
+    if deadline.expired() and deadline.caller_limited:
+        return
+    ep.report(False)
+
+
+class WorkerRejected(HTTPException):
+    """The worker refused the request's inputs (4xx): the caller's fault,
+    not the replica's."""
+
+
+class Completion:
+    """A worker response body, forwarded byte-for-byte, plus the ``usage``
+    block read from it for metrics."""
+
+    __slots__ = ("body", "usage")
+
+    def __init__(self, body: bytes, usage: Optional[dict]):
+        self.body = body
+        self.usage = usage
+
 
 # =====================
-# Core API
+# Streaming
 # =====================
-@app.post("/route_generate")
-async def route_generate(req: ChatCompletionRequest):
-    request_id = f"req_{int(time.time() * 1000)}"
-    start = time.time()
+async def stream_generate(ep: Endpoint, req: ChatCompletionRequest, request_id: str, start: float, deadline: Deadline, on_done):
+    """Open a streaming call to the worker and relay its SSE bytes as-is.
 
-    ROUTER_REQUESTS.inc()
-    logger.info(f"[{request_id}] routing to vLLM")
-    # #region agent log
-    import json
-    debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"B","location":"router.py:66","message":"Router request received","data":{"worker_url":WORKER_URL,"model":req.model,"messages_count":len(req.messages)},"timestamp":int(time.time()*1000)}
-    logger.info(f"[DEBUG] {json.dumps(debug_data)}")
+    The endpoint stays counted as in-flight until the relay finishes, and
+    ``on_done`` runs then as well. The relay stops at the deadline.
+    """
+    request = http_client.build_request(
+        "POST",
+        f"{ep.url}/v1/chat/completions",
+        content=dumps(req.dict()),
+        headers=JSON_CONTENT_TYPE,
+        timeout=deadline.timeout(http_client),
+    )
+    trial = ep.begin()
+    sent = time.time()
+    # Until the relay takes over (and ends the endpoint when it finishes),
+    # every way out of here must release the endpoint exactly once.
     try:
-        with open('/tmp/debug.log', 'a') as f:
-            f.write(json.dumps(debug_data)+'\n')
-    except Exception as e:
-        logger.warning(f"[DEBUG] Failed to write log file: {e}")
-    # #endregion
+        resp = await http_client.send(request, stream=True)
+    except httpx.ConnectError as e:
+        ep.report(False)
+        ep.end(trial=trial)
+        logger.error(f"[{request_id}] worker connection error: {e}")
+        raise WorkerConnectError(status_code=502, detail=f"Worker connection error: {str(e)}")
+    except httpx.TimeoutException as e:
+        report_timeout(ep, deadline)
+        ep.end(trial=trial)
+        logger.error(f"[{request_id}] worker timeout")
+        error = WorkerConnectError if isinstance(e, httpx.ConnectTimeout) else HTTPException
+        raise error(status_code=504, detail="Worker timeout")
+    except httpx.HTTPError as e:
+        # e.g. RemoteProtocolError / ReadError on a stale keep-alive connection
+        ep.report(False)
+        ep.end(trial=trial)
+        logger.error(f"[{request_id}] worker error: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=502, detail=f"Worker error: {type(e).__name__}: {str(e)}")
+    except BaseException:
+        ep.end(trial=trial)  # cancelled (client gone / hedge loser)
+        raise
+
+    ep.report(resp.status_code < 500)
+    if resp.status_code >= 400:
+        try:
+            response_text = (await resp.aread()).decode(errors="replace")
+        except httpx.HTTPError as e:
+            response_text = f"<body unreadable: {type(e).__name__}>"
+        finally:
+            await resp.aclose()
+            ep.end(trial=trial)
+        logger.error(f"[{request_id}] worker error {resp.status_code}: {response_text[:500]}")
+        raise HTTPException(
+            status_code=502,
+            detail=f"Worker HTTP error {resp.status_code}: {response_text[:100]}",
+        )
+
+    return StreamingResponse(
+        relay_stream(
+            resp,
+            start,
+            ROUTER_STREAM_TTFT,
+            ROUTER_STREAM_CHUNK_GAP,
+            on_done=lambda: (ep.end(time.time() - start, trial), add_upstream_time(time.time() - sent), on_done()),
+            deadline=deadline,
+            on_cancel=lambda reason: ROUTER_CANCELLED.labels(reason=reason).inc(),
+        ),
+        media_type=resp.headers.get("content-type", "text/event-stream"),
+        headers=SSE_HEADERS,
+    )
+
+
+# =====================
+# Worker call
+# =====================
+async def forward_to_worker(ep: Endpoint, req: ChatCompletionRequest, request_id: str, trace, deadline: Deadline) -> Completion:
+    """Send a non-streaming completion to one worker endpoint.
 
+    The body is parsed once, only to check it is JSON and to read
+    ``usage``; the original bytes are what gets returned to the caller.
+    """
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # #region agent log
-            req_dict = req.dict()
-            debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"B","location":"router.py:74","message":"Calling worker","data":{"url":f"{WORKER_URL}/v1/chat/completions","payload":req_dict},"timestamp":int(time.time()*1000)}
-            logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-            try:
-                with open('/tmp/debug.log', 'a') as f:
-                    f.write(json.dumps(debug_data)+'\n')
-            except Exception as e:
-                logger.warning(f"[DEBUG] Failed to write log file: {e}")
-            # #endregion
-            resp = await client.post(
-                f"{WORKER_URL}/v1/chat/completions",
-                json=req_dict,
-            )
-            # #region agent log
-            debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"C","location":"router.py:80","message":"Worker response received","data":{"status_code":resp.status_code},"timestamp":int(time.time()*1000)}
-            logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-            try:
-                with open('/tmp/debug.log', 'a') as f:
-                    f.write(json.dumps(debug_data)+'\n')
-            except Exception as e:
-                logger.warning(f"[DEBUG] Failed to write log file: {e}")
-            # #endregion
-            resp.raise_for_status()
-            # #region agent log
-            try:
-                response_text = resp.text
-                debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"C","location":"router.py:112","message":"Worker response text received","data":{"status_code":resp.status_code,"response_length":len(response_text),"response_preview":response_text[:200]},"timestamp":int(time.time()*1000)}
-                logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-                try:
-                    with open('/tmp/debug.log', 'a') as f:
-                        f.write(json.dumps(debug_data)+'\n')
-                except Exception as e:
-                    logger.warning(f"[DEBUG] Failed to write log file: {e}")
-            except Exception as e:
-                logger.warning(f"[DEBUG] Failed to log response text: {e}")
-            # #endregion
-            try:
-                data = resp.json()
-            except Exception as json_err:
-                # #region agent log
-                debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"E","location":"router.py:125","message":"Worker response JSON parse error","data":{"status_code":resp.status_code,"json_error":str(json_err),"response_preview":response_text[:500] if 'response_text' in locals() else "N/A"},"timestamp":int(time.time()*1000)}
-                logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-                try:
-                    with open('/tmp/debug.log', 'a') as f:
-                        f.write(json.dumps(debug_data)+'\n')
-                except Exception as e2:
-                    logger.warning(f"[DEBUG] Failed to write log file: {e2}")
-                # #endregion
-                logger.error(f"[{request_id}] worker response JSON parse error: {json_err}")
-                raise HTTPException(status_code=502, detail=f"Worker response parse error: {str(json_err)}")
-            # #region agent log
-            debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"C","location":"router.py:135","message":"Worker response parsed","data":{"has_choices":"choices" in data if isinstance(data,dict) else False,"data_keys":list(data.keys()) if isinstance(data,dict) else "not_dict"},"timestamp":int(time.time()*1000)}
-            logger.info(f"[DEBUG] {json.dumps(debug_data)}")
-            try:
-                with open('/tmp/debug.log', 'a') as f:
-                    f.write(json.dumps(debug_data)+'\n')
-            except Exception as e:
-                logger.warning(f"[DEBUG] Failed to write log file: {e}")
-            # #endregion
+        trace.debug("Calling worker", url=f"{ep.url}/v1/chat/completions")
+        resp = await http_client.post(
+            f"{ep.url}/v1/chat/completions",
+            content=dumps(req.dict()),
+            headers=JSON_CONTENT_TYPE,
+            timeout=deadline.timeout(http_client),
+        )
+        trace.debug("Worker response received", status_code=resp.status_code)
+        resp.raise_for_status()
+        body = resp.content
+        try:
+            data = loads(body)
+            usage = data.get("usage") if isinstance(data, dict) else None
+        except ValueError as json_err:
+            trace.error("Worker response JSON parse error", json_error=str(json_err), response_preview=body[:500].decode(errors="replace"))
+            logger.error(f"[{request_id}] worker response JSON parse error: {json_err}")
+            ep.report(False)
+            raise HTTPException(status_code=502, detail=f"Worker response parse error: {str(json_err)}")
 
     except httpx.ConnectError as e:
-        # #region agent log
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"B","location":"router.py:123","message":"Worker connection error","data":{"exception_type":type(e).__name__,"exception_msg":str(e),"worker_url":WORKER_URL},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e2:
-            logger.warning(f"[DEBUG] Failed to write log file: {e2}")
-        # #endregion
+        trace.error("Worker connection error", exception_type=type(e).__name__, exception_msg=str(e), worker_url=ep.url)
         logger.error(f"[{request_id}] worker connection error: {e}")
-        raise HTTPException(status_code=502, detail=f"Worker connection error: {str(e)}")
+        ep.report(False)
+        raise WorkerConnectError(status_code=502, detail=f"Worker connection error: {str(e)}")
 
     except httpx.TimeoutException as e:
-        # #region agent log
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"D","location":"router.py:135","message":"Worker timeout","data":{"exception_type":type(e).__name__,"exception_msg":str(e),"worker_url":WORKER_URL},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e2:
-            logger.warning(f"[DEBUG] Failed to write log file: {e2}")
-        # #endregion
+        trace.error("Worker timeout", exception_type=type(e).__name__, worker_url=ep.url)
         logger.error(f"[{request_id}] worker timeout")
-        raise HTTPException(status_code=504, detail="Worker timeout")
+        report_timeout(ep, deadline)
+        if deadline.expired():
+            ROUTER_CANCELLED.labels(reason="deadline").inc()
+            raise HTTPException(status_code=504, detail="Deadline exceeded waiting for worker")
+        error = WorkerConnectError if isinstance(e, httpx.ConnectTimeout) else HTTPException
+        raise error(status_code=504, detail="Worker timeout")
 
     except httpx.HTTPStatusError as e:
-        # #region agent log
-        response_text = ""
-        try:
-            if hasattr(e.response, 'text'):
-                response_text = e.response.text[:500]
-        except:
-            pass
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"C","location":"router.py:149","message":"Worker HTTP error","data":{"status_code":e.response.status_code,"response_text":response_text,"worker_url":WORKER_URL},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e2:
-            logger.warning(f"[DEBUG] Failed to write log file: {e2}")
-        # #endregion
+        response_text = e.response.text[:500]
+        trace.error("Worker HTTP error", status_code=e.response.status_code, response_text=response_text, worker_url=ep.url)
         logger.error(f"[{request_id}] worker error {e.response.status_code}: {response_text}")
+        # 4xx is the request's fault, not the replica's
+        ep.report(e.response.status_code < 500)
         raise HTTPException(status_code=502, detail=f"Worker HTTP error {e.response.status_code}: {response_text[:100]}")
 
+    except HTTPException:
+        raise
+
     except Exception as e:
-        # #region agent log
-        debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"B","location":"router.py:163","message":"Worker exception","data":{"exception_type":type(e).__name__,"exception_msg":str(e),"worker_url":WORKER_URL},"timestamp":int(time.time()*1000)}
-        logger.error(f"[DEBUG] {json.dumps(debug_data)}")
-        try:
-            with open('/tmp/debug.log', 'a') as f:
-                f.write(json.dumps(debug_data)+'\n')
-        except Exception as e2:
-            logger.warning(f"[DEBUG] Failed to write log file: {e2}")
-        # #endregion
+        trace.error("Worker exception", exception_type=type(e).__name__, exception_msg=str(e), worker_url=ep.url)
         logger.exception(f"[{request_id}] worker failed: {e}")
+        ep.report(False)
         raise HTTPException(status_code=502, detail=f"Worker error: {str(e)}")
 
+    ep.report(True)
+    return Completion(body, usage)
+
+
+# =====================
+# Core API
+# =====================
+async def admit(pool, priority: str, request_id: str, trace, deadline: Deadline, cost: int = 0):
+    """Take a pool slot or fail fast with 429/503 + Retry-After.
+
+    Waiting in the queue never outlasts the request's deadline; ``cost``
+    (estimated tokens) orders requests of the same priority.
+    """
+    admission = ADMISSION[pool.name]
+    try:
+        await admission.acquire(priority, timeout=deadline.remaining(), cost=cost)
+    except Shed as e:
+        trace.error("Request shed", pool=pool.name, priority=priority, reason=e.reason)
+        logger.warning(f"[{request_id}] shed ({e.reason}) pool={pool.name} priority={priority}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=f"Router overloaded ({e.reason}), retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    return admission
+
+
+def pick_endpoint(pool, req: Optional[ChatCompletionRequest], request_id: str, trace, exclude=(), session_id: Optional[str] = None) -> Endpoint:
+    """Choose a healthy endpoint, or fail fast with 503 when none is left.
+    Prefix affinity applies to chat requests only (``req`` given)."""
+    try:
+        if session_id:
+            return SESSION_AFFINITY.pick(pool, req.messages, exclude, key=session_id.encode())
+        return AFFINITY.pick(pool, req.messages, exclude) if AFFINITY and req is not None else pool.pick(exclude)
+    except NoEndpointAvailable as e:
+        trace.error("No available endpoint", pool=pool.name)
+        logger.error(f"[{request_id}] {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+
+
+def may_retry(pool, attempt: int, error: HTTPException, request_id: str, deadline: Deadline) -> bool:
+    """Allow another attempt unless MAX_RETRIES, the deadline or the retry
+    budget is spent."""
+    if deadline.expired():
+        return False
+    if attempt > MAX_RETRIES:
+        RETRIES_DENIED.labels(pool=pool.name, reason="max_retries").inc()
+        return False
+    if not RETRY_BUDGET.try_spend():
+        RETRIES_DENIED.labels(pool=pool.name, reason="budget").inc()
+        logger.warning(f"[{request_id}] retry budget exhausted, not retrying")
+        return False
+    logger.warning(f"[{request_id}] retrying on another endpoint after: {error.detail}")
+    return True
+
+
+def record_wasted(pool, req: ChatCompletionRequest, elapsed: float):
+    rate = TOKEN_RATES.get(pool.name)
+    if rate:
+        ROUTER_WASTED_TOKENS.inc(min(req.max_tokens, int(rate * elapsed)))
+
+
+async def call_endpoint(ep: Endpoint, req: ChatCompletionRequest, pool, request_id: str, trace, deadline: Deadline) -> Completion:
+    """One non-streaming worker call, keeping the endpoint's load stats."""
+    start = time.time()
+    trial = ep.begin()
+    try:
+        completion = await forward_to_worker(ep, req, request_id, trace, deadline)
+    except BaseException as e:
+        ep.end(trial=trial)
+        # Cancelled (client gone, hedge lost) or cut off by a read timeout:
+        # the worker had been generating for nobody.
+        if isinstance(e, asyncio.CancelledError) or (
+            isinstance(e, HTTPException) and e.status_code == 504 and not isinstance(e, WorkerConnectError)
+        ):
+            record_wasted(pool, req, time.time() - start)
+        raise
     latency = time.time() - start
-    ROUTER_LATENCY.observe(latency)
-    # #region agent log
-    debug_data = {"sessionId":"debug-session","runId":"run1","hypothesisId":"C","location":"router.py:99","message":"Router returning data","data":{"latency":latency,"data_type":type(data).__name__},"timestamp":int(time.time()*1000)}
-    logger.info(f"[DEBUG] {json.dumps(debug_data)}")
+    ep.end(latency, trial)
+    METRICS.observe_usage(req.model, completion.usage, latency)
+    prompt_tokens = (completion.usage or {}).get("prompt_tokens")
+    if isinstance(prompt_tokens, int):
+        TOKENS.calibrate(req.model, req.messages, prompt_tokens)
+    completion_tokens = (completion.usage or {}).get("completion_tokens")
+    if completion_tokens and latency > 0:
+        rate = completion_tokens / latency
+        prev = TOKEN_RATES.get(pool.name)
+        TOKEN_RATES[pool.name] = rate if prev is None else prev + EWMA_ALPHA * (rate - prev)
+    if HEDGE_ENABLED and req.max_tokens <= HEDGE_MAX_TOKENS:
+        HEDGE_LATENCIES.observe(pool.name, latency)
+    return completion
+
+
+async def hedged_call(ep: Endpoint, req: ChatCompletionRequest, pool, tried: List[Endpoint], request_id: str, trace, deadline: Deadline) -> Completion:
+    """Call ``ep``; if it is still running after the pool's p95, send a copy
+    to another endpoint and return whichever answers first. The loser is
+    cancelled, which closes its connection so the worker stops generating.
+    """
+    primary = asyncio.ensure_future(call_endpoint(ep, req, pool, request_id, trace, deadline))
+    delay = HEDGE_LATENCIES.delay(pool.name)
+    if delay is None:
+        return await primary
+
+    hedge = None
+    pending = {primary}
     try:
-        with open('/tmp/debug.log', 'a') as f:
-            f.write(json.dumps(debug_data)+'\n')
-    except Exception as e:
-        logger.warning(f"[DEBUG] Failed to write log file: {e}")
-    # #endregion
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and not deadline.expired():
+            try:
+                other = pool.pick(tried)
+            except NoEndpointAvailable:
+                other = None
+            if other is not None and other not in tried and RETRY_BUDGET.try_spend():
+                tried.append(other)
+                UPSTREAM_ATTEMPTS.labels(pool=pool.name, kind="hedge").inc()
+                logger.info(f"[{request_id}] hedging to {other.url} after {delay:.3f}s")
+                hedge = asyncio.ensure_future(call_endpoint(other, req, pool, request_id, trace, deadline))
+                pending.add(hedge)
+
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [t for t in done if t.exception() is None]
+            if succeeded:
+                ROUTER_CANCELLED.labels(reason="hedge_loser").inc(len(pending))
+                if hedge in succeeded:
+                    HEDGE_WINS.labels(pool=pool.name).inc()
+                    return hedge.result()
+                return succeeded[0].result()
+            if not pending:
+                # Both failed: surface the last error (retryable or not)
+                return done.pop().result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def generate(req: ChatCompletionRequest, pool, priority: str, request_id: str, trace, deadline: Deadline, cost: int = 0, session_id: Optional[str] = None) -> Completion:
+    """Admit, pick an endpoint and run one non-streaming completion,
+    retrying elsewhere when the worker could not be reached."""
+    admission = await admit(pool, priority, request_id, trace, deadline, cost)
+    upstream_start = time.time()
+    try:
+        RETRY_BUDGET.record_request()
+        hedge = HEDGE_ENABLED and req.max_tokens <= HEDGE_MAX_TOKENS
+        tried: List[Endpoint] = []
+        attempt = 0
+        while True:
+            ep = pick_endpoint(pool, req, request_id, trace, exclude=tried, session_id=session_id)
+            tried.append(ep)
+            UPSTREAM_ATTEMPTS.labels(pool=pool.name, kind="retry" if attempt else "primary").inc()
+            attempt += 1
+            trace.info("Router request received", model=req.model, messages_count=len(req.messages), pool=pool.name, worker_url=ep.url)
+            logger.info(f"[{request_id}] routing to {pool.name} {ep.url}")
+            try:
+                if hedge:
+                    return await hedged_call(ep, req, pool, tried, request_id, trace, deadline)
+                return await call_endpoint(ep, req, pool, request_id, trace, deadline)
+            except WorkerConnectError as e:
+                if not may_retry(pool, attempt, e, request_id, deadline):
+                    raise
+    finally:
+        admission.release()
+        add_upstream_time(time.time() - upstream_start)
+
+
+@app.post("/route_generate")
+async def route_generate(
+    req: ChatCompletionRequest,
+    request: Request,
+    x_priority: Optional[str] = Header(default=None),
+    x_request_timeout: Optional[str] = Header(default=None),
+    x_session_id: Optional[str] = Header(default=None),
+):
+    return await route_completion(req, x_priority, x_request_timeout, request, x_session_id)
+
+
+async def route_completion(
+    req: ChatCompletionRequest,
+    x_priority: Optional[str] = None,
+    x_request_timeout: Optional[str] = None,
+    request: Optional[Request] = None,
+    x_session_id: Optional[str] = None,
+) -> Response:
+    """Route one chat completion: the service endpoint and the library
+    entry point (embedded.py). Errors are raised as HTTPException; the
+    client is watched for disconnects when ``request`` is given.
+    ``x_session_id`` pins a gateway session to one endpoint.
+    """
+    request_id = f"req_{int(time.time() * 1000)}"
+    start = time.time()
+    trace = TRACER.begin(request_id)
+    deadline = Deadline.for_request(req.max_tokens, x_request_timeout)
+
+    ROUTER_REQUESTS.inc()
+    pool = MODELS.pool_for(req.model)
+    if pool is None:
+        annotate(model=req.model)
+        raise HTTPException(status_code=404, detail=f"Model '{req.model}' not found")
+    prompt_tokens = TOKENS.estimate(req.model, req.messages)
+    cost = prompt_tokens + req.max_tokens
+    pool = LENGTH.route(req.model, pool, cost)
+    priority = parse_priority(x_priority)
+    annotate(model=req.model, backend=pool.backend)
+
+    if deadline.expired():
+        ROUTER_CANCELLED.labels(reason="deadline").inc()
+        raise HTTPException(status_code=504, detail="Deadline exceeded before routing")
+
+    try:
+        LENGTH.check(req.model, pool, prompt_tokens, req.max_tokens)
+    except ContextExceeded as e:
+        logger.warning(f"[{request_id}] rejected: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if req.stream:
+        admission = await admit(pool, priority, request_id, trace, deadline, cost)
+        try:
+            RETRY_BUDGET.record_request()
+            tried: List[Endpoint] = []
+            while True:
+                ep = pick_endpoint(pool, req, request_id, trace, exclude=tried, session_id=x_session_id)
+                tried.append(ep)
+                UPSTREAM_ATTEMPTS.labels(pool=pool.name, kind="retry" if len(tried) > 1 else "primary").inc()
+                trace.info("Router request received", model=req.model, messages_count=len(req.messages), pool=pool.name, worker_url=ep.url)
+                logger.info(f"[{request_id}] streaming from {pool.name} {ep.url}")
+                try:
+                    streaming = await stream_generate(ep, req, request_id, start, deadline, on_done=admission.release)
+                    streaming.headers["X-Backend"] = pool.backend
+                    streaming.headers.update(server_timing("router", time.time() - start))
+                    return streaming
+                except WorkerConnectError as e:
+                    if not may_retry(pool, len(tried), e, request_id, deadline):
+                        raise
+        except BaseException:
+            admission.release()
+            raise
+
+    if COALESCE_ENABLED and req.temperature == 0:
+        # Priority is part of the key: an interactive request never waits
+        # behind a low-priority call's place in the admission queue.
+        key = f"{priority}:" + request_key(req.model, [m.dict() for m in req.messages], req.max_tokens, req.temperature)
+        work = SINGLE_FLIGHT.do(
+            key,
+            lambda: generate(req, pool, priority, request_id, trace, deadline, cost, x_session_id),
+            deadline=deadline,
+        )
+    else:
+        work = generate(req, pool, priority, request_id, trace, deadline, cost, x_session_id)
+    try:
+        completion = await (cancel_on_disconnect(request, work) if request is not None else work)
+    except ClientDisconnected:
+        ROUTER_CANCELLED.labels(reason="client_disconnect").inc()
+        logger.info(f"[{request_id}] client disconnected after {time.time() - start:.3f}s, cancelled")
+        return Response(status_code=499)
+
+    latency = time.time() - start
+    trace.info("Router returning data", latency=latency)
     logger.info(f"[{request_id}] done in {latency:.3f}s")
-    return data
+    # The worker's bytes go back unchanged: no re-parse, no re-serialization.
+    return Response(
+        content=completion.body,
+        media_type="application/json",
+        headers={"X-Backend": pool.backend, **server_timing("router", latency)},
+    )
+
+
+# =====================
+# Embeddings
+# =====================
+async def forward_embeddings(ep: Endpoint, body: dict, request_id: str, deadline: Deadline) -> Tuple[list, int]:
+    """One batched /v1/embeddings call: the embeddings in input order and
+    the call's prompt tokens."""
+    trial = ep.begin()
+    start = time.time()
+    try:
+        resp = await http_client.post(
+            f"{ep.url}/v1/embeddings",
+            content=dumps(body),
+            headers=JSON_CONTENT_TYPE,
+            timeout=deadline.timeout(http_client),
+        )
+    except httpx.ConnectError as e:
+        ep.report(False)
+        ep.end(trial=trial)
+        logger.error(f"[{request_id}] worker connection error: {e}")
+        raise WorkerConnectError(status_code=502, detail=f"Worker connection error: {str(e)}")
+    except httpx.TimeoutException as e:
+        report_timeout(ep, deadline)
+        ep.end(trial=trial)
+        logger.error(f"[{request_id}] worker timeout")
+        error = WorkerConnectError if isinstance(e, httpx.ConnectTimeout) else HTTPException
+        raise error(status_code=504, detail="Worker timeout")
+    except httpx.HTTPError as e:
+        ep.report(False)
+        ep.end(trial=trial)
+        logger.error(f"[{request_id}] worker error: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=502, detail=f"Worker error: {type(e).__name__}: {str(e)}")
+    except BaseException:
+        ep.end(trial=trial)  # cancelled
+        raise
+
+    ep.report(resp.status_code < 500)
+    ep.end(time.time() - start, trial)
+    if resp.status_code >= 400:
+        logger.error(f"[{request_id}] worker error {resp.status_code}: {resp.text[:500]}")
+        if resp.status_code < 500:
+            raise WorkerRejected(status_code=400, detail=f"Worker rejected the input ({resp.status_code}): {resp.text[:100]}")
+        raise HTTPException(status_code=502, detail=f"Worker HTTP error {resp.status_code}: {resp.text[:100]}")
+    try:
+        data = loads(resp.content)
+        embeddings = [item["embedding"] for item in sorted(data["data"], key=lambda item: item["index"])]
+        prompt_tokens = (data.get("usage") or {}).get("prompt_tokens") or 0
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.error(f"[{request_id}] worker embeddings parse error: {e}")
+        raise HTTPException(status_code=502, detail=f"Worker response parse error: {str(e)}")
+    if len(embeddings) != len(body["input"]):
+        raise HTTPException(
+            status_code=502,
+            detail=f"Worker returned {len(embeddings)} embeddings for {len(body['input'])} inputs",
+        )
+    return embeddings, prompt_tokens
+
+
+async def embed_batch(key: BatchKey, inputs: List[str], deadline: Deadline) -> Tuple[list, int]:
+    """Send one micro-batch: a single pool slot, retried on another endpoint
+    when the worker could not be reached."""
+    pool_name, model, encoding_format, dimensions = key
+    pool = POOLS.pools[pool_name]
+    request_id = f"emb_{int(time.time() * 1000)}"
+    trace = TRACER.begin(request_id)
+    body = {"model": model, "input": inputs}
+    if encoding_format is not None:
+        body["encoding_format"] = encoding_format
+    if dimensions is not None:
+        body["dimensions"] = dimensions
+
+    admission = await admit(pool, DEFAULT_PRIORITY, request_id, trace, deadline)
+    try:
+        RETRY_BUDGET.record_request()
+        tried: List[Endpoint] = []
+        while True:
+            ep = pick_endpoint(pool, None, request_id, trace, exclude=tried)
+            tried.append(ep)
+            UPSTREAM_ATTEMPTS.labels(pool=pool.name, kind="retry" if len(tried) > 1 else "primary").inc()
+            logger.info(f"[{request_id}] embedding {len(inputs)} inputs on {pool.name} {ep.url}")
+            try:
+                return await forward_embeddings(ep, body, request_id, deadline)
+            except WorkerConnectError as e:
+                if not may_retry(pool, len(tried), e, request_id, deadline):
+                    raise
+    finally:
+        admission.release()
+
+
+# Concurrent embedding requests share batched worker calls (embeddings.py);
+# a batch the worker rejects is re-sent per request to isolate the bad input.
+EMBEDDINGS = MicroBatcher(embed_batch, split_on=(WorkerRejected,))
+
+
+@app.post("/route_embeddings")
+async def route_embeddings(
+    req: EmbeddingRequest,
+    request: Request,
+    x_request_timeout: Optional[str] = Header(default=None),
+):
+    return await route_embedding(req, x_request_timeout, request)
+
+
+async def route_embedding(req: EmbeddingRequest, x_request_timeout: Optional[str] = None, request: Optional[Request] = None) -> Response:
+    """Embed ``req.input`` through the micro-batcher: the service endpoint
+    and the library entry point (embedded.py). The client is watched for
+    disconnects when ``request`` is given; a request that leaves before
+    its batch is sent is dropped from it."""
+    start = time.time()
+    deadline = Deadline.for_request(0, x_request_timeout)
+
+    ROUTER_REQUESTS.inc()
+    pool = MODELS.pool_for(req.model)
+    if pool is None:
+        annotate(model=req.model)
+        raise HTTPException(status_code=404, detail=f"Model '{req.model}' not found")
+    annotate(model=req.model, backend=pool.backend)
+    inputs = [req.input] if isinstance(req.input, str) else req.input
+    if not inputs:
+        raise HTTPException(status_code=400, detail="'input' must not be empty")
+
+    key = (pool.name, req.model, req.encoding_format, req.dimensions)
+    work = EMBEDDINGS.submit(key, inputs, deadline)
+    try:
+        embeddings, prompt_tokens = await (cancel_on_disconnect(request, work) if request is not None else work)
+    except asyncio.TimeoutError:
+        ROUTER_CANCELLED.labels(reason="deadline").inc()
+        raise HTTPException(status_code=504, detail="Deadline exceeded waiting for embeddings")
+    except ClientDisconnected:
+        ROUTER_CANCELLED.labels(reason="client_disconnect").inc()
+        logger.info(f"embedding client disconnected after {time.time() - start:.3f}s, cancelled")
+        return Response(status_code=499)
+
+    body = {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": e} for i, e in enumerate(embeddings)],
+        "model": req.model,
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+    }
+    return Response(
+        content=dumps(body),
+        media_type="application/json",
+        headers={"X-Backend": pool.backend, **server_timing("router", time.time() - start)},
+    )
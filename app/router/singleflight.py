@@ -0,0 +1,79 @@
+# router/singleflight.py
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from prometheus_client import Counter
+
+# A request only joins a call whose deadline leaves it at least this share
+# of its own remaining budget, so it never inherits a much shorter deadline
+# from another client.
+JOIN_MIN_DEADLINE_SHARE = 0.9
+
+COALESCED = Counter(
+    "router_coalesced_requests_total",
+    "Requests served by joining an identical in-flight upstream call",
+)
+
+
+class _Call:
+    __slots__ = ("task", "waiters", "deadline")
+
+    def __init__(self, task: asyncio.Task, deadline):
+        self.task = task
+        self.waiters = 0
+        self.deadline = deadline
+
+
+class SingleFlight:
+    """Share one upstream call between concurrent requests with the same key.
+
+    The first caller starts ``fn()`` as its own task; later callers with the
+    same key await that task instead of starting another. Every waiter gets
+    the result or the same exception. A waiter being cancelled (client
+    disconnect) only detaches it; the shared call is cancelled once no
+    waiters are left. Given a ``deadline`` (common.deadline.Deadline, the
+    one ``fn`` runs under), a caller only joins a call that leaves it
+    nearly all of its own budget; otherwise it starts a new call, which
+    later callers join instead.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], deadline=None) -> Any:
+        call = self._calls.get(key)
+        if call is None or not self._may_join(call, deadline):
+            call = _Call(asyncio.ensure_future(fn()), deadline)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._forget(key, call))
+        else:
+            COALESCED.inc()
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Unregister first: a request arriving while the task
+                # unwinds must start a new call, not join a cancelled one.
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+
+    @staticmethod
+    def _may_join(call: _Call, deadline: Optional[Any]) -> bool:
+        if deadline is None or call.deadline is None:
+            return True
+        return call.deadline.remaining() >= JOIN_MIN_DEADLINE_SHARE * deadline.remaining()
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Mark the exception as retrieved when every waiter has gone away.
+        if not call.task.cancelled():
+            call.task.exception()
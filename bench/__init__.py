@@ -0,0 +1,5 @@
+# bench/__init__.py
+#
+# Latency / throughput benchmark for the gateway -> router -> worker path.
+# Runs entirely on localhost against a fake OpenAI-compatible worker, so it
+# needs no GPU and no network. Usage: python -m bench --help
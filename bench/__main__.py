@@ -0,0 +1,198 @@
+# bench/__main__.py
+#
+# python -m bench [options]
+#
+# Starts a fake worker, router.app and gateway.app on localhost (unless
+# --gateway-url/--router-url/--worker-url point at a running stack), replays
+# a request mix against worker, router and gateway in turn, and prints one
+# JSON report with throughput, latency/TTFT percentiles, error rate and the
+# p50 overhead each hop adds.
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+
+import httpx
+
+from bench.fake_worker import create_app
+from bench.loadgen import DEFAULT_MIX, closed_loop, load_mix, open_loop, summarize
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(REPO_DIR, "app")
+
+# Target -> completion path
+PATHS = {
+    "worker": "/v1/chat/completions",
+    "router": "/route_generate",
+    "gateway": "/v1/chat/completions",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """A uvicorn server running inside the current event loop."""
+
+    def __init__(self, app, port: int):
+        import uvicorn
+
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            if self.task.done():
+                self.task.result()
+            await asyncio.sleep(0.01)
+
+    async def stop(self):
+        self.server.should_exit = True
+        await self.task
+
+
+async def start_stack(args):
+    """Fake worker + router + gateway in-process. Env is set before the
+    service modules are imported because they read config at import.
+
+    With --router-mode embedded the gateway routes in its own process and
+    no router server is started (both would share the router module)."""
+    embedded = args.router_mode == "embedded"
+    worker_port, router_port, gateway_port = free_port(), free_port(), free_port()
+    os.environ.setdefault("VLLM_WORKER_URLS", f"127.0.0.1:{worker_port}")
+    os.environ["ROUTER_URL"] = f"http://127.0.0.1:{router_port}"
+    os.environ["ROUTER_MODE"] = args.router_mode
+    os.environ.pop("ROUTER_SERVICE_HOST", None)
+    for path in (APP_DIR, os.path.join(APP_DIR, "router"), os.path.join(APP_DIR, "gateway")):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    import router
+    import gateway
+
+    for name in ("router", "gateway", "httpx", "common.httpclient"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    worker = LocalServer(create_app(args.worker_latency_ms, args.worker_tokens_per_sec, args.worker_completion_tokens), worker_port)
+    router_server = None if embedded else LocalServer(router.app, router_port)
+    gateway_server = LocalServer(gateway.app, gateway_port)
+    servers = [s for s in (worker, router_server, gateway_server) if s is not None]
+    for s in servers:
+        await s.start()
+    urls = {"worker": worker.url, "router": router_server.url if router_server else None, "gateway": gateway_server.url}
+    return servers, urls
+
+
+async def run_target(client, url: str, mix, args):
+    # Short warm-up so connection setup is not in the numbers.
+    await closed_loop(client, url, mix, min(args.concurrency, 4), min(args.requests, 8), args.stream)
+    start = time.perf_counter()
+    if args.mode == "open":
+        samples = await open_loop(client, url, mix, args.rate, args.requests, args.stream)
+    else:
+        samples = await closed_loop(client, url, mix, args.concurrency, args.requests, args.stream)
+    return summarize(samples, time.perf_counter() - start)
+
+
+async def main_async(args) -> dict:
+    mix = load_mix(args.mix) if args.mix else DEFAULT_MIX
+
+    servers = []
+    urls = {"worker": args.worker_url, "router": args.router_url, "gateway": args.gateway_url}
+    if not any(urls.values()):
+        servers, urls = await start_stack(args)
+
+    report = {
+        "config": {
+            "mode": args.mode,
+            "requests": args.requests,
+            "concurrency": args.concurrency if args.mode == "closed" else None,
+            "rate": args.rate if args.mode == "open" else None,
+            "stream": args.stream,
+            "mix": args.mix or "default",
+            "router_mode": args.router_mode,
+            "worker_latency_ms": args.worker_latency_ms,
+            "worker_tokens_per_sec": args.worker_tokens_per_sec,
+            "worker_completion_tokens": args.worker_completion_tokens,
+        },
+        "targets": {},
+    }
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency, 100), max_keepalive_connections=max(args.concurrency, 100))
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            for target in ("worker", "router", "gateway"):
+                if urls.get(target):
+                    report["targets"][target] = await run_target(client, urls[target].rstrip("/") + PATHS[target], mix, args)
+    finally:
+        for s in reversed(servers):
+            await s.stop()
+
+    def p50(target):
+        t = report["targets"].get(target)
+        return t["latency_ms"]["p50"] if t and t["latency_ms"]["p50"] is not None else None
+
+    hops = {}
+    if p50("router") is not None and p50("worker") is not None:
+        hops["router"] = round(p50("router") - p50("worker"), 3)
+    if p50("gateway") is not None and p50("router") is not None:
+        hops["gateway"] = round(p50("gateway") - p50("router"), 3)
+    elif p50("gateway") is not None and p50("worker") is not None:
+        # Embedded router: one hop does both.
+        hops["gateway+router"] = round(p50("gateway") - p50("worker"), 3)
+    report["hop_overhead_ms_p50"] = hops
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__)
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed", help="closed-loop users or open-loop Poisson arrivals")
+    parser.add_argument("--requests", type=int, default=500, help="requests per target")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed-loop users")
+    parser.add_argument("--rate", type=float, default=100.0, help="open-loop arrival rate (req/s)")
+    parser.add_argument("--stream", action="store_true", help="send stream=true requests (reports TTFT)")
+    parser.add_argument("--mix", help="JSONL request mix (chat bodies, batch lines or requests.jsonl)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--worker-latency-ms", type=float, default=20.0)
+    parser.add_argument("--worker-tokens-per-sec", type=float, default=500.0)
+    parser.add_argument("--worker-completion-tokens", type=int, default=32)
+    parser.add_argument("--worker-url", help="benchmark a running worker instead of the fake one")
+    parser.add_argument("--router-url", help="benchmark a running router")
+    parser.add_argument("--gateway-url", help="benchmark a running gateway")
+    parser.add_argument(
+        "--router-mode",
+        choices=["remote", "embedded"],
+        default=os.environ.get("ROUTER_MODE", "remote"),
+        help="local stack only: router as its own server or inside the gateway",
+    )
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--max-error-rate", type=float, help="exit 1 if any target exceeds this error rate")
+    parser.add_argument("--max-hop-overhead-ms", type=float, help="exit 1 if any hop adds more p50 latency")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    failed = False
+    if args.max_error_rate is not None:
+        failed |= any((t["error_rate"] or 0) > args.max_error_rate for t in report["targets"].values())
+    if args.max_hop_overhead_ms is not None:
+        failed |= any(v > args.max_hop_overhead_ms for v in report["hop_overhead_ms_p50"].values())
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
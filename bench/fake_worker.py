@@ -0,0 +1,80 @@
+# bench/fake_worker.py
+
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+def create_app(
+    latency_ms: float = 20.0,
+    tokens_per_sec: float = 200.0,
+    completion_tokens: int = 32,
+    model: str = "qwen2.5-0.5b",
+) -> FastAPI:
+    """Fake OpenAI-compatible worker.
+
+    A completion costs ``latency_ms`` (prefill) plus one token every
+    1/``tokens_per_sec`` seconds, for min(max_tokens, completion_tokens)
+    tokens. With stream=true, each token is sent as its own SSE chunk.
+    """
+    app = FastAPI(title="Fake LLM worker")
+    token_interval = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+
+    def n_tokens(body: dict) -> int:
+        return max(1, min(int(body.get("max_tokens", 128)), completion_tokens))
+
+    def usage(body: dict, completion: int) -> dict:
+        prompt = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4 + 1
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": model, "object": "model", "owned_by": "fake"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        tokens = n_tokens(body)
+        completion_id = f"chatcmpl-fake-{time.time_ns()}"
+
+        if body.get("stream"):
+            async def events():
+                await asyncio.sleep(latency_ms / 1000.0)
+                for i in range(tokens):
+                    if i:
+                        await asyncio.sleep(token_interval)
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "model": body.get("model", model),
+                        "choices": [{"index": 0, "delta": {"content": "tok "}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency_ms / 1000.0 + token_interval * tokens)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", model),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "tok " * tokens},
+                    "finish_reason": "length" if tokens >= int(body.get("max_tokens", 128)) else "stop",
+                }
+            ],
+            "usage": usage(body, tokens),
+        }
+
+    return app
@@ -0,0 +1,145 @@
+# bench/loadgen.py
+
+import json
+import time
+import random
+import asyncio
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+import httpx
+
+
+@dataclass
+class Sample:
+    latency: float
+    ttft: Optional[float]
+    status: Optional[int]
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.error is None
+
+
+# =====================
+# Request mixes
+# =====================
+DEFAULT_MIX = [
+    {"model": "qwen2.5-0.5b", "messages": [{"role": "user", "content": "Classify: great product!"}], "max_tokens": 8},
+    {"model": "qwen2.5-0.5b", "messages": [{"role": "system", "content": "You are a helpful assistant."},
+                                           {"role": "user", "content": "Summarize the plot of Hamlet."}], "max_tokens": 128},
+    {"model": "qwen2.5-0.5b", "messages": [{"role": "user", "content": "Write a haiku about GPUs."}], "max_tokens": 32},
+]
+
+
+def load_mix(path: str) -> List[dict]:
+    """Chat bodies from a JSONL file.
+
+    Accepts bare chat bodies, OpenAI batch lines ({"body": {...}}) and
+    backlog-style lines ({"title", "body": "<text>"}), which become a
+    single user message.
+    """
+    mix = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            body = item.get("body", item)
+            if isinstance(body, str):
+                text = f"{item.get('title', '')}\n\n{body}".strip()
+                body = {"model": "qwen2.5-0.5b", "messages": [{"role": "user", "content": text}], "max_tokens": 128}
+            mix.append(body)
+    if not mix:
+        raise ValueError(f"No requests in {path}")
+    return mix
+
+
+# =====================
+# Single request
+# =====================
+async def send(client: httpx.AsyncClient, url: str, body: dict) -> Sample:
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if body.get("stream"):
+            async with client.stream("POST", url, json=body) as resp:
+                async for _ in resp.aiter_raw():
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                status = resp.status_code
+        else:
+            resp = await client.post(url, json=body)
+            status = resp.status_code
+    except httpx.HTTPError as e:
+        return Sample(time.perf_counter() - start, ttft, None, f"{type(e).__name__}: {e}")
+    return Sample(time.perf_counter() - start, ttft, status)
+
+
+# =====================
+# Load shapes
+# =====================
+async def closed_loop(client, url: str, mix: List[dict], concurrency: int, total: int, stream: bool) -> List[Sample]:
+    """``concurrency`` users, each sending its next request when the last returns."""
+    samples: List[Sample] = []
+    counter = iter(range(total))
+
+    async def user():
+        for i in counter:
+            samples.append(await send(client, url, _body(mix, i, stream)))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return samples
+
+
+async def open_loop(client, url: str, mix: List[dict], rate: float, total: int, stream: bool) -> List[Sample]:
+    """Poisson arrivals at ``rate`` req/s, independent of response times."""
+    tasks = []
+    for i in range(total):
+        tasks.append(asyncio.create_task(send(client, url, _body(mix, i, stream))))
+        await asyncio.sleep(random.expovariate(rate))
+    return list(await asyncio.gather(*tasks))
+
+
+def _body(mix: List[dict], i: int, stream: bool) -> dict:
+    body = dict(mix[i % len(mix)])
+    if stream:
+        body["stream"] = True
+    return body
+
+
+# =====================
+# Stats
+# =====================
+def percentile(values: Iterable[float], q: float) -> Optional[float]:
+    data = sorted(values)
+    if not data:
+        return None
+    k = (len(data) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (k - lo)
+
+
+def summarize(samples: List[Sample], elapsed: float) -> dict:
+    ok = [s for s in samples if s.ok]
+    lat = [s.latency * 1000 for s in ok]
+    ttft = [s.ttft * 1000 for s in ok if s.ttft is not None]
+
+    def ms(v):
+        return None if v is None else round(v, 3)
+
+    statuses = {}
+    for s in samples:
+        key = str(s.status) if s.status is not None else "transport_error"
+        statuses[key] = statuses.get(key, 0) + 1
+
+    return {
+        "requests": len(samples),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else None,
+        "statuses": statuses,
+        "latency_ms": {"p50": ms(percentile(lat, 0.5)), "p95": ms(percentile(lat, 0.95)), "p99": ms(percentile(lat, 0.99))},
+        "ttft_ms": {"p50": ms(percentile(ttft, 0.5)), "p95": ms(percentile(ttft, 0.95)), "p99": ms(percentile(ttft, 0.99))},
+    }
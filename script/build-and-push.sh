@@ -150,8 +150,8 @@ main() {
     echo ""
     
     # 构建并推送所有镜像（传入 version tag）
-    build_and_push "gateway" "app/gateway" "app/gateway/Dockerfile" "${VERSION_TAG}"
-    build_and_push "router" "app/router" "app/router/Dockerfile" "${VERSION_TAG}"
+    build_and_push "gateway" "app" "app/gateway/Dockerfile" "${VERSION_TAG}"
+    build_and_push "router" "app" "app/router/Dockerfile" "${VERSION_TAG}"
     build_and_push "vllm-worker" "app/worker/vllm" "app/worker/vllm/Dockerfile" "${VERSION_TAG}"
     build_and_push "trt-worker" "app/worker/tensorRT" "app/worker/tensorRT/Dockerfile" "${VERSION_TAG}"
     build_and_push "web" "app/web" "app/web/Dockerfile" "${VERSION_TAG}"
@@ -0,0 +1,13 @@
+# tests/conftest.py
+#
+# The services import their modules flat (``from pool import ...``) and the
+# shared package as ``common``, as in their images: put both on sys.path.
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ("app", "app/router", "app/gateway"):
+    path = os.path.join(ROOT, path)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,76 @@
+# tests/test_admission.py
+
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from admission import PRIORITIES, AdmissionController, Shed
+
+
+def gauges(pool: str) -> tuple:
+    return (
+        REGISTRY.get_sample_value("router_admitted_requests", {"pool": pool}),
+        REGISTRY.get_sample_value("router_queue_depth", {"pool": pool}),
+    )
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_high_priority_preempts_a_queued_low_request():
+    async def main():
+        admission = AdmissionController("preempt", limit=1, max_queue=1, queue_timeout=5)
+        await admission.acquire("normal")
+        low = asyncio.create_task(admission.acquire("low"))
+        await settle()
+        assert gauges("preempt") == (1, 1)
+
+        high = asyncio.create_task(admission.acquire("high"))
+        await settle()
+        with pytest.raises(Shed) as shed:
+            await low
+        assert (shed.value.reason, shed.value.status_code) == ("preempted", 429)
+        assert admission.waiting == 1 and gauges("preempt") == (1, 1)
+
+        admission.release()  # the slot goes straight to the high request
+        await high
+        assert gauges("preempt") == (1, 0)
+        admission.release()
+        assert gauges("preempt") == (0, 0)
+
+    asyncio.run(main())
+
+
+def test_preemption_updates_the_queue_gauge():
+    async def main():
+        admission = AdmissionController("preempt-gauge", limit=1, max_queue=1, queue_timeout=5)
+        await admission.acquire("normal")
+        low = asyncio.create_task(admission.acquire("low"))
+        await settle()
+
+        assert admission._preempt(PRIORITIES["high"])
+        assert gauges("preempt-gauge") == (1, 0)
+        with pytest.raises(Shed):
+            await low
+
+    asyncio.run(main())
+
+
+def test_full_queue_sheds_equal_priority():
+    async def main():
+        admission = AdmissionController("full", limit=1, max_queue=1, queue_timeout=5)
+        await admission.acquire("normal")
+        waiter = asyncio.create_task(admission.acquire("normal"))
+        await settle()
+        with pytest.raises(Shed) as shed:
+            await admission.acquire("normal")
+        assert shed.value.reason == "queue_full"
+        assert gauges("full") == (1, 1)
+        waiter.cancel()
+        await settle()
+        assert gauges("full") == (1, 0)
+
+    asyncio.run(main())
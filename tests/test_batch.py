@@ -0,0 +1,74 @@
+# tests/test_batch.py
+
+import json
+import asyncio
+
+import httpx
+import pytest
+
+from batch import BatchJob
+
+
+def write_lines(path, contents):
+    path.write_text("".join(json.dumps({"custom_id": c, "body": {"model": "m", "messages": [{"role": "user", "content": c}]}}) + "\n" for c in contents))
+
+
+def run_job(tmp_path, handler, **kwargs) -> list:
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            job = BatchJob(str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl"), "http://router", client, **kwargs)
+            await job.run()
+            return job
+
+    job = asyncio.run(main())
+    assert job.status == "completed", job.error
+    return [json.loads(line) for line in (tmp_path / "out.jsonl").read_text().splitlines()]
+
+
+def echo(request: httpx.Request) -> httpx.Response:
+    content = json.loads(request.content)["messages"][0]["content"]
+    if content == "garbled":
+        return httpx.Response(200, text="<html>oops</html>")
+    return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+
+def test_non_json_success_is_a_line_error(tmp_path):
+    write_lines(tmp_path / "in.jsonl", ["a", "garbled", "b"])
+    results = run_job(tmp_path, echo)
+
+    assert [r["custom_id"] for r in results] == ["a", "garbled", "b"]
+    assert results[1]["response"]["status_code"] == 200
+    assert results[1]["error"]["message"].startswith("invalid JSON from router")
+    assert results[0]["error"] is None and results[2]["error"] is None
+
+
+def test_restarted_job_resumes_after_the_checkpoint(tmp_path):
+    write_lines(tmp_path / "in.jsonl", ["a", "b", "c", "d"])
+    seen = []
+    hang = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        content = json.loads(request.content)["messages"][0]["content"]
+        seen.append(content)
+        if content == "c" and len(seen) == 3:
+            await hang.wait()  # the first run is killed here
+        return echo(request)
+
+    async def first_run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            job = BatchJob(str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl"), "http://router", client, concurrency=1, checkpoint_every=1)
+            job.start()
+            while len(seen) < 3:
+                await asyncio.sleep(0.01)
+            job.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await job._task
+            return job
+
+    assert asyncio.run(first_run()).status == "cancelled"
+    with open(tmp_path / "out.jsonl", "a") as f:
+        f.write('{"id": "partial')  # a torn write past the checkpoint
+
+    results = run_job(tmp_path, handler, concurrency=1, checkpoint_every=1)
+    assert [r["custom_id"] for r in results] == ["a", "b", "c", "d"]
+    assert seen == ["a", "b", "c", "c", "d"]  # only the unfinished line is sent again
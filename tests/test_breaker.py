@@ -0,0 +1,85 @@
+# tests/test_breaker.py
+
+import time
+
+from health import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from pool import Endpoint
+
+
+def open_breaker(**kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker("http://worker:8000", failures=2, open_seconds=0, **kwargs)
+    breaker.record(False)
+    breaker.record(False)
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("http://worker:8000", failures=3, open_seconds=60)
+    breaker.record(False)
+    breaker.record(False)
+    breaker.record(True)  # a success resets the streak
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state() == CLOSED
+    breaker.record(False)
+    assert breaker.state() == OPEN
+    assert not breaker.allows(time.monotonic())
+
+
+def test_half_open_admits_a_single_trial():
+    breaker = open_breaker()
+    assert breaker.state() == HALF_OPEN
+    assert breaker.allows(time.monotonic())
+    trial = breaker.on_pick()
+    assert trial is not None
+    assert not breaker.allows(time.monotonic())
+    breaker.on_done(trial)
+    assert breaker.allows(time.monotonic())
+
+
+def test_trial_outcome_closes_or_reopens():
+    breaker = open_breaker()
+    breaker.state()
+    breaker.on_pick()
+    breaker.record(True)
+    assert breaker.state() == CLOSED
+
+    breaker = CircuitBreaker("http://worker:8000", failures=1, open_seconds=60)
+    breaker.record(False)
+    breaker.opened_at -= 60
+    assert breaker.state() == HALF_OPEN
+    breaker.on_pick()
+    breaker.record(False)
+    assert breaker.state() == OPEN
+
+
+def test_only_the_trial_frees_the_trial_slot():
+    ep = Endpoint("http://worker:8000", "vllm")
+    ep.breaker.failures = 1
+    ep.breaker.open_seconds = 0
+    before = ep.begin()  # picked while closed
+    assert before is None
+    ep.report(False)
+    assert ep.breaker.state() == HALF_OPEN
+
+    trial = ep.begin()
+    assert trial is not None
+    ep.end(0.1, before)  # the older request finishing must not free the slot
+    assert not ep.breaker.allows(time.monotonic())
+    ep.end(0.1, trial)
+    assert ep.breaker.allows(time.monotonic())
+    assert ep.inflight == 0
+
+
+def test_lost_trial_times_out():
+    breaker = open_breaker(trial_timeout=0.05)
+    breaker.state()
+    lost = breaker.on_pick()
+    assert not breaker.allows(time.monotonic())
+    time.sleep(0.06)
+    assert breaker.allows(time.monotonic())
+    second = breaker.on_pick()
+    breaker.on_done(lost)  # the lost trial turning up late changes nothing
+    assert not breaker.allows(time.monotonic())
+    breaker.on_done(second)
+    assert breaker.allows(time.monotonic())
@@ -0,0 +1,82 @@
+# tests/test_deadline_accounting.py
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import router
+from common.deadline import Deadline
+from health import CLOSED, OPEN
+from pool import Endpoint
+
+
+def slow_worker(delay: float):
+    """A healthy worker slower than the call's read timeout (which, like a
+    real connection, the mock transport has to enforce itself)."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        read_timeout = request.extensions["timeout"]["read"]
+        if read_timeout is not None and read_timeout < delay:
+            await asyncio.sleep(read_timeout)
+            raise httpx.ReadTimeout("timed out", request=request)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={"choices": []})
+
+    return httpx.MockTransport(handler)
+
+
+def timing_out_worker():
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ReadTimeout("worker timed out", request=request)
+
+    return httpx.MockTransport(handler)
+
+
+def chat(max_tokens: int = 128) -> router.ChatCompletionRequest:
+    return router.ChatCompletionRequest(model="m", messages=[{"role": "user", "content": "hi"}], max_tokens=max_tokens)
+
+
+async def call(transport, ep: Endpoint, deadline: Deadline):
+    router.http_client = httpx.AsyncClient(transport=transport, timeout=30.0)
+    try:
+        await router.forward_to_worker(ep, chat(), "req_test", router.TRACER.begin("req_test"), deadline)
+    finally:
+        await router.http_client.aclose()
+        router.http_client = None
+
+
+def test_short_client_deadlines_do_not_open_the_breaker():
+    ep = Endpoint("http://worker:8000", "vllm")
+
+    async def run():
+        for _ in range(ep.breaker.failures * 2):
+            with pytest.raises(HTTPException) as exc:
+                await call(slow_worker(2.0), ep, Deadline.for_request(128, "0.05"))
+            assert exc.value.status_code == 504
+
+    asyncio.run(run())
+    assert ep.breaker.state() == CLOSED
+    assert ep.breaker.consecutive_failures == 0
+    assert False not in ep.outlier.outcomes
+
+
+def test_worker_timeouts_within_the_full_budget_open_the_breaker():
+    ep = Endpoint("http://worker:8000", "vllm")
+
+    async def run():
+        for _ in range(ep.breaker.failures):
+            with pytest.raises(HTTPException):
+                await call(timing_out_worker(), ep, Deadline.for_request(128))
+
+    asyncio.run(run())
+    assert ep.breaker.state() == OPEN
+
+
+def test_caller_limited():
+    assert Deadline.for_request(128, "0.2").caller_limited
+    assert not Deadline.for_request(128).caller_limited
+    # What a gateway forwards: the default budget minus its own overhead.
+    full = Deadline.for_request(128).budget
+    assert not Deadline.for_request(128, f"{full - 0.01:.3f}").caller_limited
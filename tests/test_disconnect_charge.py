@@ -0,0 +1,67 @@
+# tests/test_disconnect_charge.py
+
+import json
+import asyncio
+
+import httpx
+from prometheus_client import REGISTRY
+
+import gateway
+from ratelimit import KeyStore
+
+
+async def disconnecting_call(path: str, body: dict) -> list:
+    """Send ``body`` to the gateway as a client that leaves right after."""
+    sent = []
+    messages = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(0.05)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"authorization", b"Bearer sk-dc")],
+        "client": ("test", 1),
+        "server": ("gw", 80),
+    }
+    await gateway.app(scope, receive, send)
+    return sent
+
+
+def test_disconnect_settles_the_estimate(tmp_path, monkeypatch):
+    keys = tmp_path / "keys.json"
+    keys.write_text(json.dumps({"keys": [{"key": "sk-dc", "name": "disconnect", "tpm": 6000}]}))
+    store = KeyStore(path=str(keys))
+    store.reload()
+    monkeypatch.setattr(gateway, "API_KEYS", store)
+
+    async def slow_router(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(10)
+        return httpx.Response(500)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(slow_router)) as upstream:
+            monkeypatch.setattr(gateway, "http_client", upstream)
+            chat = await disconnecting_call("/v1/chat/completions", {"model": "m", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 100})
+            embed = await disconnecting_call("/v1/embeddings", {"model": "m", "input": "x" * 40})
+        return chat, embed
+
+    chat, embed = asyncio.run(main())
+    assert chat[0]["status"] == 499 and embed[0]["status"] == 499
+    # Settled at the estimate (a refund would count 0): max_tokens + "hi",
+    # then 40 chars of embedding input.
+    assert REGISTRY.get_sample_value("gateway_key_tokens_total", {"key": "disconnect"}) == 100 + 10
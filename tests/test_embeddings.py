@@ -0,0 +1,64 @@
+# tests/test_embeddings.py
+
+import asyncio
+import types
+
+import router
+from common.deadline import Deadline
+from embeddings import MicroBatcher
+
+
+class Disconnecting:
+    """A Starlette request whose client leaves after ``after`` seconds."""
+
+    def __init__(self, after: float):
+        self.after = after
+
+    async def receive(self):
+        await asyncio.sleep(self.after)
+        return {"type": "http.disconnect"}
+
+
+def test_disconnected_request_leaves_its_batch(monkeypatch):
+    sent = []
+
+    async def send(key, inputs, deadline):
+        sent.append(list(inputs))
+        return [[float(len(text))] for text in inputs], len(inputs)
+
+    pool = types.SimpleNamespace(name="embed", backend="fake")
+    monkeypatch.setattr(router.MODELS, "pool_for", lambda model: pool)
+    monkeypatch.setattr(router, "EMBEDDINGS", MicroBatcher(send, max_wait_ms=50))
+
+    async def main():
+        gone = asyncio.create_task(router.route_embedding(router.EmbeddingRequest(model="m", input="gone"), "5", Disconnecting(0.01)))
+        kept = asyncio.create_task(router.route_embedding(router.EmbeddingRequest(model="m", input="kept"), "5"))
+        return await gone, await kept
+
+    gone, kept = asyncio.run(main())
+    assert gone.status_code == 499
+    assert kept.status_code == 200
+    assert sent == [["kept"]]
+
+
+def test_split_requests_keep_their_own_deadline():
+    seen = {}
+
+    class Rejected(Exception):
+        pass
+
+    async def send(key, inputs, deadline):
+        if len(inputs) > 1:
+            raise Rejected()
+        seen[inputs[0]] = deadline
+        return [[0.0]], 1
+
+    async def main():
+        batcher = MicroBatcher(send, max_wait_ms=20, split_on=(Rejected,))
+        short, long = Deadline(1.0), Deadline(30.0)
+        await asyncio.gather(batcher.submit(("p", "m", None, None), ["a"], short), batcher.submit(("p", "m", None, None), ["b"], long))
+        return short, long
+
+    short, long = asyncio.run(main())
+    assert seen["a"] is short
+    assert seen["b"] is long
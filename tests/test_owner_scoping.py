@@ -0,0 +1,62 @@
+# tests/test_owner_scoping.py
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import gateway
+from batch import BatchJob
+from ratelimit import KeyStore
+from sessions import MemorySessionStore
+
+TEAM_A = {"Authorization": "Bearer sk-a"}
+TEAM_B = {"Authorization": "Bearer sk-b"}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    keys = tmp_path / "keys.json"
+    keys.write_text(json.dumps({"keys": [{"key": "sk-a", "name": "team-a"}, {"key": "sk-b", "name": "team-b"}]}))
+    store = KeyStore(path=str(keys))
+    store.reload()
+    monkeypatch.setattr(gateway, "API_KEYS", store)
+    monkeypatch.setattr(gateway, "BATCH_JOBS", {})
+    monkeypatch.setattr(gateway, "SESSIONS", MemorySessionStore())
+    # No lifespan: nothing here reaches the router.
+    return TestClient(gateway.app)
+
+
+def add_job(owner: str, job_id: str) -> BatchJob:
+    job = BatchJob("/in.jsonl", "/out.jsonl", "http://router", None, job_id=job_id, owner=owner)
+    gateway.BATCH_JOBS[job.id] = job
+    return job
+
+
+def test_batches_are_scoped_to_their_key(client):
+    add_job("team-a", "batch_a")
+    add_job("team-b", "batch_b")
+
+    listed = client.get("/v1/batches", headers=TEAM_A).json()["data"]
+    assert [job["id"] for job in listed] == ["batch_a"]
+    assert client.get("/v1/batches/batch_a", headers=TEAM_A).status_code == 200
+    assert client.get("/v1/batches/batch_b", headers=TEAM_A).status_code == 404
+    assert client.post("/v1/batches/batch_b/cancel", headers=TEAM_A).status_code == 404
+    assert client.get("/v1/batches", headers=TEAM_B).json()["data"][0]["id"] == "batch_b"
+
+
+def test_batches_require_a_key(client):
+    add_job("team-a", "batch_a")
+    assert client.get("/v1/batches").status_code == 401
+    assert client.get("/v1/batches/batch_a", headers={"Authorization": "Bearer sk-x"}).status_code == 403
+
+
+def test_sessions_are_scoped_to_their_key(client):
+    created = client.post("/v1/sessions", headers=TEAM_A, json={"messages": [{"role": "system", "content": "hi"}]})
+    session_id = created.json()["id"]
+
+    assert client.get(f"/v1/sessions/{session_id}", headers=TEAM_A).status_code == 200
+    assert client.get(f"/v1/sessions/{session_id}", headers=TEAM_B).status_code == 404
+    assert client.delete(f"/v1/sessions/{session_id}", headers=TEAM_B).status_code == 404
+    assert client.delete(f"/v1/sessions/{session_id}", headers=TEAM_A).status_code == 200
+    assert client.get(f"/v1/sessions/{session_id}", headers=TEAM_A).status_code == 404
@@ -0,0 +1,32 @@
+# tests/test_priority.py
+
+import pytest
+
+from ratelimit import ApiKey, resolve_priority
+
+
+def key(priority: str) -> ApiKey:
+    return ApiKey("team", rps=0, burst=0, tpm=0, priority=priority)
+
+
+def test_clients_can_only_lower_their_priority():
+    assert resolve_priority(key("normal"), "high") == "normal"
+    assert resolve_priority(key("normal"), "low") == "low"
+    assert resolve_priority(key("high"), "normal") == "normal"
+    assert resolve_priority(key("low"), "high") == "low"
+
+
+def test_missing_or_unknown_header_uses_the_key_priority():
+    assert resolve_priority(key("high"), None) == "high"
+    assert resolve_priority(key("high"), "urgent") == "high"
+    assert resolve_priority(key("high"), " LOW ") == "low"
+
+
+def test_without_auth_nobody_gets_above_the_default():
+    assert resolve_priority(None, "high") == "normal"
+    assert resolve_priority(None, "low") == "low"
+
+
+def test_unknown_key_priority_is_rejected():
+    with pytest.raises(ValueError):
+        key("urgent")
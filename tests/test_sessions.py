@@ -0,0 +1,71 @@
+# tests/test_sessions.py
+
+import json
+import time
+import asyncio
+
+import httpx
+
+import gateway
+from sessions import MemorySessionStore, TurnGuard
+
+
+def test_replies_without_text_are_not_saved(monkeypatch):
+    monkeypatch.setattr(gateway, "SESSIONS", MemorySessionStore())
+
+    async def main():
+        session = gateway.Session.create("team-a", [])
+        await gateway.save_reply(session, [{"role": "user", "content": "hi"}], {"choices": [{"message": {"content": None}}]}, "req")
+        await gateway.save_reply(session, [{"role": "user", "content": "hi"}], {"choices": []}, "req")
+        assert session.messages == []
+        await gateway.save_reply(session, [{"role": "user", "content": "hi"}], {"choices": [{"message": {"content": "hello"}}]}, "req")
+        assert [m["content"] for m in session.messages] == ["hi", "hello"]
+
+    asyncio.run(main())
+
+
+def test_concurrent_turns_on_a_session_are_refused(monkeypatch):
+    monkeypatch.setattr(gateway, "SESSIONS", MemorySessionStore())
+    monkeypatch.setattr(gateway, "SESSION_TURNS", TurnGuard())
+    monkeypatch.setattr(gateway.API_KEYS, "path", "")
+    monkeypatch.setattr(gateway.API_KEYS, "legacy_key", None)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def router(request: httpx.Request) -> httpx.Response:
+            await release.wait()
+            reply = json.loads(request.content)["messages"][-1]["content"].upper()
+            return httpx.Response(200, json={"choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}]})
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(router)) as upstream:
+            monkeypatch.setattr(gateway, "http_client", upstream)
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway.app), base_url="http://gw") as client:
+                session_id = (await client.post("/v1/sessions", json={})).json()["id"]
+
+                def turn(text: str):
+                    body = {"model": "m", "messages": [{"role": "user", "content": text}]}
+                    return client.post("/v1/chat/completions", json=body, headers={"X-Session-Id": session_id})
+
+                first = asyncio.create_task(turn("one"))
+                await asyncio.sleep(0.05)
+                second = await turn("two")
+                assert second.status_code == 409
+
+                release.set()
+                assert (await first).status_code == 200
+                assert (await turn("three")).status_code == 200
+
+        session = await gateway.SESSIONS.get(session_id)
+        assert [m["content"] for m in session.messages] == ["one", "ONE", "three", "THREE"]
+
+    asyncio.run(main())
+
+
+def test_turn_guard_lapses_at_the_deadline():
+    guard = TurnGuard()
+    assert guard.begin("s", time.monotonic() + 60)
+    assert not guard.begin("s", time.monotonic() + 60)
+    guard.end("s")
+    assert guard.begin("s", time.monotonic() - 1)  # already past its deadline
+    assert guard.begin("s", time.monotonic() + 60)
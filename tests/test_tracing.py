@@ -0,0 +1,29 @@
+# tests/test_tracing.py
+
+import os
+import json
+
+from common.tracing import Tracer
+
+
+def test_each_process_writes_its_own_trace_file(tmp_path):
+    tracer = Tracer("test", enabled=True, path=str(tmp_path / "debug.log"), per_process=True, flush_interval=0.01)
+    tracer.start()
+    tracer.begin("req_1").info("hello")
+    tracer.stop()
+
+    assert tracer.path == str(tmp_path / f"debug.{os.getpid()}.log")
+    assert os.listdir(tmp_path) == [f"debug.{os.getpid()}.log"]
+    with open(tracer.path) as f:
+        assert json.loads(f.readline())["message"] == "hello"
+
+
+def test_rotation_keeps_backups(tmp_path):
+    path = tmp_path / "debug.log"
+    tracer = Tracer("test", enabled=True, path=str(path), max_bytes=1, backup_count=2)
+    for i in range(3):
+        tracer._write([{"n": i}])
+
+    assert json.loads(path.read_text())["n"] == 2
+    assert json.loads((tmp_path / "debug.log.1").read_text())["n"] == 1
+    assert json.loads((tmp_path / "debug.log.2").read_text())["n"] == 0